@@ -0,0 +1,65 @@
+"""
+This script measures the cost of a commit with the different SQLite connection settings used in this project.
+It writes rows to a throw-away database file and reports time per row for each connection setup.
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import database
+
+parser = argparse.ArgumentParser(description="benchmark sqlite commit cost")
+parser.add_argument("--rows", type=int, help="number of rows to write for each test", default=500)
+parser.add_argument("--dir", type=str, help="directory for the benchmark database, defaults to a temp directory", default=None)
+
+# treat args parsed as a dictionary
+args = vars(parser.parse_args())
+
+user_rows = args["rows"]
+user_dir = args["dir"]
+
+CREATE_TABLE = "create table if not exists bench (id integer primary key, name text not null, value integer not null);"
+INSERT = "insert into bench (name, value) values (?, ?);"
+
+
+def run(name: str, connect, per_row_commit: bool, directory: str):
+    filename = os.path.join(directory, f"benchmark-{name}.sqlite")
+    for suffix in ["", "-wal", "-shm", "-journal"]:
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
+
+    conn = connect(filename)
+    conn.execute(CREATE_TABLE)
+    conn.commit()
+
+    start = time.perf_counter()
+    if per_row_commit:
+        for i in range(0, user_rows):
+            conn.execute(INSERT, (f"row {i}", i))
+            conn.commit()
+    else:
+        with database.transaction(conn):
+            for i in range(0, user_rows):
+                conn.execute(INSERT, (f"row {i}", i))
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    print(f"{name:<32} {1000*elapsed:10.1f} ms total {1000000*elapsed/user_rows:10.1f} us/row")
+
+
+if __name__ == '__main__':
+    directory = user_dir
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix="benchmark-database-")
+    print(f"writing {user_rows} rows per test in '{directory}'")
+
+    run("default, commit per row", lambda f: sqlite3.connect(f), True, directory)
+    run("scheduler, commit per row", lambda f: database.connect(f, database.PRAGMAS_SCHEDULER), True, directory)
+    run("astrophotography, commit per row", lambda f: database.connect(f, database.PRAGMAS_ASTROPHOTOGRAPHY), True, directory)
+    run("wal (header cache), commit per row",
+        lambda f: database.connect(f, {"journal_mode": "WAL", "synchronous": "NORMAL"}), True, directory)
+    run("default, one transaction", lambda f: sqlite3.connect(f), False, directory)
+    run("astrophotography, one transaction", lambda f: database.connect(f, database.PRAGMAS_ASTROPHOTOGRAPHY), False, directory)
@@ -1,17 +1,28 @@
 from codeop import CommandCompiler
+import atexit
+import collections
+import concurrent.futures
+import csv
+import functools
+import io
 import os
 import shutil
 import re
 import json
+import sys
 import xisf
 
 import zipfile
 from astropy.io import fits
 from io import BytesIO
+from xml.etree import ElementTree
 
 from astropy.io import fits
 from pathlib import Path
 from datetime import datetime, timedelta
+from collections.abc import MutableMapping
+
+import filecache
 
 CONSTANT_NORMALIZATION_DATA = {
     "camera": {
@@ -88,6 +99,134 @@ FILTER_NORMALIZATION_DATA = {
     },
 }
 
+# profile directory, i.e. "SQA55@f4.8+ATR585M"
+PROFILE_PATH_RE = re.compile("(.*[\\\\\\/])([^@]*)@f([^+]*)[+]([^\\\\\\/]*)([\\\\\\/].*)")
+# directories are skipped (with everything under them) when walking the tree if the path contains any of these
+WALK_EXCLUDE = ["_stash"]
+# number of files scanned and enriched at a time when streaming metadata, see iter_metadata()
+METADATA_BATCH_SIZE = 1000
+# number of distinct directories parsed by get_file_headers that are kept
+FILE_HEADERS_DIRECTORY_CACHE_SIZE = 4096
+# number of threads checking if directories exist, see find_missing_dirs()
+DIRECTORY_CHECK_WORKERS = 8
+
+# FITS header layout, see read_fits_header_cards()
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+FITS_MAX_HEADER_BLOCKS = 100
+FITS_COMMENTARY_KEYWORDS = ("COMMENT", "HISTORY", "")
+FITS_KEYWORD_RE = re.compile(r"^[A-Z0-9_-]+$")
+# same as the fixed format value regex in astropy.io.fits.card
+FITS_VALUE_RE = re.compile(
+    r" *(?:'(?P<strg>([ -~]+?|''|) *?)'(?=$|/| )"
+    r"|(?P<bool>[FT])"
+    r"|(?P<numr>[+-]?(\.\d+|\d+(\.\d*)?)([DE][+-]?\d+)?))?"
+    r" *(?P<comm_field>/ *(?P<comm>[!-~][ -~]*)?)?$"
+)
+FITS_RVKC_RE = re.compile(r"^ *[a-zA-Z_]\w*(\.[a-zA-Z_]\w*)*: +")
+
+# XISF header layout, see read_xisf_header_keywords()
+XISF_SIGNATURE = b"XISF0100"
+XISF_READ_SIZE = 4096
+XISF_TAG_IMAGE = "{http://www.pixinsight.com/xisf}Image"
+XISF_TAG_FITSKEYWORD = "{http://www.pixinsight.com/xisf}FITSKeyword"
+
+# persistent cache of raw file headers, see open_header_cache()
+HEADER_CACHE = None
+
+class FrameMetadata(MutableMapping):
+    """
+    Compact, dict compatible metadata for one frame.  Well known normalized headers are stored in slots, anything else
+    in an overflow dict that is only created when needed.  Values that repeat across frames (camera, optic, filter,
+    target, ...) are interned so every frame shares the same string.
+    Iteration order is the slot order followed by overflow keys in insertion order, not the order keys were added.
+    Note json.dumps does not accept a FrameMetadata, use to_dict() first.
+    """
+    # well known headers (normalized names)
+    FIELDS = ('filename', 'type', 'camera', 'optic', 'focal_ratio', 'filter', 'exposureseconds', 'date', 'datetime',
+              'settemp', 'temp', 'gain', 'offset', 'readoutmode', 'targetname', 'panel', 'latitude', 'longitude',
+              'hfr', 'stars', 'rmsac')
+    # well known headers whose values repeat across frames
+    INTERNED = frozenset(('type', 'camera', 'optic', 'focal_ratio', 'filter', 'exposureseconds', 'date', 'settemp',
+                          'gain', 'offset', 'readoutmode', 'targetname', 'panel', 'latitude', 'longitude'))
+    __slots__ = FIELDS + ('_extra',)
+    _FIELDS = frozenset(FIELDS)
+
+    def __init__(self, data=None):
+        self._extra = None
+        if data is not None:
+            for key in data:
+                self[key] = data[key]
+
+    def __getitem__(self, key):
+        if key in FrameMetadata._FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in FrameMetadata._FIELDS:
+            if key in FrameMetadata.INTERNED and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            if type(value) is str and len(value) < 64:
+                # short values tend to repeat (gain, offset, sunangle, ...)
+                value = sys.intern(value)
+            self._extra[sys.intern(key)] = value
+
+    def __delitem__(self, key):
+        if key in FrameMetadata._FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in FrameMetadata._FIELDS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in FrameMetadata.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        count = sum(1 for key in FrameMetadata.FIELDS if hasattr(self, key))
+        if self._extra is not None:
+            count += len(self._extra)
+        return count
+
+    def get(self, key, default=None):
+        if key in FrameMetadata._FIELDS:
+            return getattr(self, key, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def copy(self):
+        return FrameMetadata(self)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"FrameMetadata({self.to_dict()})"
+
+
 # https://stackoverflow.com/questions/8347048/how-to-convert-string-to-title-case-in-python
 def camelCase(st):
     """
@@ -97,15 +236,11 @@ def camelCase(st):
     return output[0].lower() + output[1:]
 
 
-def get_file_headers(filename: str, profileFromPath: bool, objectFromPath=True, normalize=True):
+def _rewrite_path(filename: str, profileFromPath: bool, objectFromPath: bool):
     """
-    Extracts headers from a filename, optionally normalizing and extracting profile/object information from the path.
-    Handles special cases for certain header keys and file types.
+    Applies the path rewrites needed before a path can be split into headers:
+    SET-TEMP dash removal, OBJECT injection before "accept" and profile (optic, focal ratio, camera) injection.
     """
-    output = {
-        "filename": filename, # before any name manipulations
-    }
-
     # SPECIAL CASES:
     # SET-TEMP: A key with a dash.  Thanks NINA.  Handle it before parsing by removing the dash.
     if "SET-TEMP" in filename:
@@ -130,36 +265,81 @@ def get_file_headers(filename: str, profileFromPath: bool, objectFromPath=True,
 
     # Pick Profile (optic, focal ratio, camera) from path.
     if profileFromPath:
-        m = re.match("(.*[\\\\\\/])([^@]*)@f([^+]*)[+]([^\\\\\\/]*)([\\\\\\/].*)", filename)
+        m = PROFILE_PATH_RE.match(filename)
         if m and m.groups() and len(m.groups()) == 5:
             # rebuild path by injecting property prefixes
             p = m.groups()
             filename=f"{p[0]}TELESCOP_{p[1]}_FOCRATIO_{p[2]}_INSTRUME_{p[3]}{p[4]}"
 
-    # just get the headers from the filename itself
-    # don't be picky.  get EVERYTHING that could match
-    for chunk in os.path.splitext(filename)[0].split(os.sep):
-        #print(f"chunk={chunk}")
-        m1 = re.split("[_]", chunk)
-        for i in range(1, len(m1)):
-            k = m1[i-1]
-            v = m1[i]
-            #print(f"k={k}, v={v}")
-            if not str.isnumeric(k) and k not in output:
-                output[k] = v
-        for x in m1:
-            #print(f"x={x}")
-            if "-" in x:
-                m2 = re.split("[-]", x)
-                k = m2[0]
-                v = "-".join(m2[1:])
-                if not str.isnumeric(k) and k not in output and v is not None:
-                    #print(f"m2: k={k}, v={v}")
-                    output[k] = v
+    return filename
+
+
+def _chunk_header_pairs(chunk: str, output: list):
+    """
+    Appends all (key, value) pairs found in one path chunk to output, underscore pairs first then dash pairs.
+    Don't be picky.  get EVERYTHING that could match
+    """
+    m1 = chunk.split("_")
+    for i in range(1, len(m1)):
+        k = m1[i-1]
+        if not k.isnumeric():
+            output.append((k, m1[i]))
+    for x in m1:
+        if "-" in x:
+            k, _, v = x.partition("-")
+            if not k.isnumeric():
+                output.append((k, v))
+
+
+@functools.lru_cache(maxsize=FILE_HEADERS_DIRECTORY_CACHE_SIZE)
+def _get_directory_header_pairs(directory: str, profileFromPath: bool, objectFromPath: bool, leaf_is_accept: bool):
+    """
+    Returns the (key, value) pairs for all components of a directory, first value for a key wins.
+    Memoized, thousands of files share the same directory.  The leaf only matters to the directory if it is "accept".
+    """
+    # the leaf placeholder is never rewritten and is dropped after the split
+    path = _rewrite_path(directory + os.sep + (DIRECTORY_ACCEPT if leaf_is_accept else ""), profileFromPath, objectFromPath)
+    pairs = []
+    for chunk in path.split(os.sep)[:-1]:
+        _chunk_header_pairs(chunk, pairs)
+    output = {}
+    for k, v in pairs:
+        if k not in output:
+            output[k] = v
+    return tuple(output.items())
+
+
+def get_file_headers(filename: str, profileFromPath: bool, objectFromPath=True, normalize=True):
+    """
+    Extracts headers from a filename, optionally normalizing and extracting profile/object information from the path.
+    Handles special cases for certain header keys and file types.
+    Directory components are parsed once and memoized, only the leaf is tokenized for each file.
+    """
+    output = {
+        "filename": filename, # before any name manipulations
+    }
+
+    pairs = []
+    i = filename.rfind(os.sep)
+    leaf = filename[i+1:]
+    if i < 0 or "\\" in leaf or "/" in leaf or "\n" in filename:
+        # unusual path, can't split it safely.  parse the whole thing.
+        path = _rewrite_path(filename, profileFromPath, objectFromPath)
+        for chunk in os.path.splitext(path)[0].split(os.sep):
+            _chunk_header_pairs(chunk, pairs)
+    else:
+        pairs.extend(_get_directory_header_pairs(filename[:i], profileFromPath, objectFromPath, leaf == DIRECTORY_ACCEPT))
+        # rewrites never change the end of the leaf
+        path = leaf
+        _chunk_header_pairs(os.path.splitext(leaf.replace("SET-TEMP", "SETTEMP"))[0], pairs)
+
+    for k, v in pairs:
+        if k not in output:
+            output[k] = v
 
     # SPECIAL CASES:
     # .CR2: If extension is .cr2 and TYPE is not already set, default TYPE to LIGHT
-    if filename.endswith(".cr2") and "TYPE" not in output:
+    if path.endswith(".cr2") and "TYPE" not in output:
         output["TYPE"] = "LIGHT"
 
     # SET-TEMP: The dash was previously removed.  Add it back.
@@ -176,16 +356,10 @@ def get_file_headers(filename: str, profileFromPath: bool, objectFromPath=True,
     return output
 
 
-def get_fits_headers(filename: str, profileFromPath: bool, normalize=True, file_naming_override=False):
+def read_fits_file_headers_astropy(filename: str):
     """
-    Extracts and normalizes FITS headers from a file, optionally overriding with headers from the filename.
+    Reads the raw headers of the primary image in a FITS file using astropy.  All values are converted to string (None is kept).
     """
-    file_output = {}
-    output = {}
-
-    if file_naming_override:
-        file_output=get_file_headers(filename, normalize=normalize, profileFromPath=profileFromPath)
-
     with fits.open(filename) as fits_file:
         # get all headers (key/value) as dict from primary image
         output = dict(fits_file[0].header)
@@ -193,6 +367,285 @@ def get_fits_headers(filename: str, profileFromPath: bool, normalize=True, file_
     for k in output:
         if output[k] is not None and type(output[k]) is not str:
             output[k] = str(output[k])
+    return output
+
+
+def read_fits_header_cards(filename: str):
+    """
+    Reads the 80 character cards of the primary header of a FITS file, up to but not including END.
+    Only the header blocks are read, never the image data.  Returns None if END is not found in a sane number of blocks.
+    """
+    cards = []
+    with open(filename, "rb") as f:
+        for _ in range(0, FITS_MAX_HEADER_BLOCKS):
+            block = f.read(FITS_BLOCK_SIZE)
+            if len(block) != FITS_BLOCK_SIZE:
+                return None
+            try:
+                block = block.decode("ascii")
+            except UnicodeDecodeError:
+                return None
+            for i in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+                card = block[i:i+FITS_CARD_SIZE]
+                if card[:8] == "END     ":
+                    return cards
+                cards.append(card)
+    return None
+
+
+def parse_fits_header_cards(cards: list):
+    """
+    Parses FITS header cards into a dict of string values, matching what astropy gives for dict(header) with values
+    converted to string.  Only plain keyword/value cards plus commentary cards (COMMENT, HISTORY, blank) are supported.
+    Returns None for anything else (CONTINUE, HIERARCH, complex or undefined values, duplicate keywords, etc).
+    """
+    if cards is None or len(cards) == 0 or cards[0][:8] != "SIMPLE  ":
+        return None
+
+    output = {}
+    commentary = {}
+    for card in cards:
+        keyword = card[:8].rstrip()
+        if keyword in FITS_COMMENTARY_KEYWORDS:
+            if keyword not in commentary:
+                commentary[keyword] = []
+                # placeholder, keeps the order of the first card
+                output[keyword] = None
+            commentary[keyword].append(card[8:].rstrip())
+            continue
+
+        if card[8:10] != "= " or keyword in output or not FITS_KEYWORD_RE.match(keyword):
+            return None
+
+        m = FITS_VALUE_RE.match(card[10:])
+        if m is None:
+            return None
+        if m.group("bool") is not None:
+            value = str(m.group("bool") == "T")
+        elif m.group("strg") is not None:
+            value = m.group("strg").replace("''", "'").rstrip()
+            if FITS_RVKC_RE.match(value):
+                # astropy treats this as a record-valued keyword card
+                return None
+        elif m.group("numr") is not None:
+            numr = m.group("numr").replace("D", "E")
+            try:
+                value = str(int(numr))
+            except ValueError:
+                value = str(float(numr))
+        else:
+            # undefined value
+            return None
+        output[keyword] = value
+
+    for keyword in commentary:
+        output[keyword] = "\n".join(commentary[keyword])
+    return output
+
+
+def read_fits_file_headers(filename: str):
+    """
+    Reads the raw headers of the primary image in a FITS file.  All values are converted to string (None is kept).
+    Only the header blocks are read and parsed, astropy is used if the header has anything unusual in it.
+    """
+    output = parse_fits_header_cards(read_fits_header_cards(filename))
+    if output is None:
+        output = read_fits_file_headers_astropy(filename)
+    return output
+
+
+def read_xisf_file_headers_xisf(filename: str):
+    """
+    Reads the raw FITS keywords of the first image in a XISF file using the xisf module.
+    Only the first value of each keyword is kept (if not empty), converted to string.  HISTORY is skipped.
+    """
+    output = {}
+    xisf_file = xisf.XISF(filename)
+    metadata = xisf_file.get_images_metadata()
+    # get all fits headers from metadata, converted to string
+    for k in metadata[0]['FITSKeywords'].keys():
+        if k == "HISTORY":
+            continue
+        if len(metadata[0]['FITSKeywords'][k]) > 0 and 'value' in metadata[0]['FITSKeywords'][k][0]:
+            v = metadata[0]['FITSKeywords'][k][0]['value']
+            if v is not None and str(v) != "":
+                output[k] = str(v)
+    return output
+
+
+def read_xisf_header_keywords(filename: str):
+    """
+    Reads the FITS keywords of the first image in a XISF file by streaming only the XML header block through an
+    incremental parser.  Reading stops at the end of the first image element, the image data is never read.
+    Same output as read_xisf_file_headers_xisf.  Returns None if the header can't be handled.
+    """
+    output = {}
+    seen = set()
+    with open(filename, "rb") as f:
+        if f.read(len(XISF_SIGNATURE)) != XISF_SIGNATURE:
+            return None
+        remaining = int.from_bytes(f.read(4), byteorder="little")
+        # skip reserved field
+        f.read(4)
+
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+        depth = 0
+        in_image = False
+        while remaining > 0:
+            chunk = f.read(min(XISF_READ_SIZE, remaining))
+            if len(chunk) == 0:
+                return None
+            remaining -= len(chunk)
+            try:
+                # some files pad the end of the header with nulls
+                parser.feed(chunk.rstrip(b"\0"))
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        depth += 1
+                        if depth == 2 and elem.tag == XISF_TAG_IMAGE:
+                            in_image = True
+                        continue
+                    depth -= 1
+                    if in_image and depth == 2 and elem.tag == XISF_TAG_FITSKEYWORD:
+                        # like the xisf module: only the first value for a keyword is considered
+                        k = elem.attrib.get("name")
+                        if k is None or "value" not in elem.attrib or k in seen:
+                            continue
+                        seen.add(k)
+                        v = elem.attrib["value"].strip("'").strip(" ")
+                        if k != "HISTORY" and v != "":
+                            output[k] = v
+                    elif in_image and depth == 1 and elem.tag == XISF_TAG_IMAGE:
+                        # done with the first image
+                        return output
+            except ElementTree.ParseError:
+                return None
+    return None
+
+
+def read_xisf_file_headers(filename: str):
+    """
+    Reads the raw FITS keywords of the first image in a XISF file.
+    Only the first value of each keyword is kept (if not empty), converted to string.  HISTORY is skipped.
+    Only the XML header is read, the xisf module is used if the header can't be handled.
+    """
+    output = read_xisf_header_keywords(filename)
+    if output is None:
+        output = read_xisf_file_headers_xisf(filename)
+    return output
+
+
+def read_file_headers(filename: str):
+    """
+    Reads the raw headers embedded in a FITS or XISF file.  Returns None for any other type of file.
+    """
+    if filename.endswith(".fits"):
+        return read_fits_file_headers(filename)
+    elif filename.endswith(".xisf"):
+        return read_xisf_file_headers(filename)
+    return None
+
+
+def get_cached_file_headers(filename: str):
+    """
+    Returns the raw headers embedded in a file, using HEADER_CACHE if it has been opened (see open_header_cache).
+    """
+    if HEADER_CACHE is None:
+        return read_file_headers(filename)
+    headers = HEADER_CACHE.get(filename)
+    if headers is None:
+        headers = read_file_headers(filename)
+        if headers is not None:
+            HEADER_CACHE.put(filename, headers)
+    return headers
+
+
+def iter_file_headers(filenames: list, workers=0, pool="thread"):
+    """
+    Yields (filename, raw headers) for each filename, in the same order as the input.
+    With workers > 1 the files are read concurrently using a pool of threads ("thread", best for I/O bound reads)
+    or processes ("process", best for parse bound reads, requires the calling script to guard with __main__).
+    The header cache is only used from the calling thread; only cache misses are sent to the pool.
+    """
+    if workers is None or workers < 2:
+        for filename in filenames:
+            yield (filename, get_cached_file_headers(filename))
+        return
+
+    if pool == "thread":
+        executor_class = concurrent.futures.ThreadPoolExecutor
+    elif pool == "process":
+        executor_class = concurrent.futures.ProcessPoolExecutor
+    else:
+        raise Exception(f"unexpected pool type: {pool}")
+
+    with executor_class(max_workers=workers) as executor:
+        # bounded window of outstanding reads, results are handed out strictly in input order
+        pending = collections.deque()
+
+        def next_result():
+            filename, headers, future = pending.popleft()
+            if future is not None:
+                headers = future.result()
+                if HEADER_CACHE is not None and headers is not None:
+                    HEADER_CACHE.put(filename, headers)
+            return (filename, headers)
+
+        for filename in filenames:
+            headers = None
+            future = None
+            if HEADER_CACHE is not None:
+                headers = HEADER_CACHE.get(filename)
+            if headers is None and (filename.endswith(".fits") or filename.endswith(".xisf")):
+                future = executor.submit(read_file_headers, filename)
+            pending.append((filename, headers, future))
+            while len(pending) > workers * 8:
+                yield next_result()
+        while len(pending) > 0:
+            yield next_result()
+
+
+def open_header_cache(db_filename=None, max_entries=500000, debug=False):
+    """
+    Opens the persistent header cache used by enrich_metadata.  The cache is closed (and flushed) at exit.
+    Entries are keyed by path, size and mtime so a changed file is always re-read.
+    """
+    global HEADER_CACHE
+    if HEADER_CACHE is not None:
+        return HEADER_CACHE
+    if db_filename is None:
+        db_filename = DATABASE_HEADER_CACHE
+    cache = filecache.FileCache(db_filename=db_filename, table="headers", max_entries=max_entries, debug=debug)
+    cache.open()
+    HEADER_CACHE = cache
+    atexit.register(close_header_cache)
+    return HEADER_CACHE
+
+
+def close_header_cache():
+    """
+    Flushes and closes the header cache, if open.
+    """
+    global HEADER_CACHE
+    if HEADER_CACHE is not None:
+        HEADER_CACHE.close()
+        HEADER_CACHE = None
+
+
+def get_fits_headers(filename: str, profileFromPath: bool, normalize=True, file_naming_override=False, headers=None):
+    """
+    Extracts and normalizes FITS headers from a file, optionally overriding with headers from the filename.
+    If the raw file headers have already been read they can be passed as 'headers' to skip opening the file.
+    """
+    file_output = {}
+    output = {}
+
+    if file_naming_override:
+        file_output=get_file_headers(filename, normalize=normalize, profileFromPath=profileFromPath)
+
+    if headers is None:
+        headers = read_fits_file_headers(filename)
+    output = dict(headers)
 
     # file naming is higher priority but might be empty
     output = dict(list(output.items()) + list(file_output.items()))
@@ -203,26 +656,23 @@ def get_fits_headers(filename: str, profileFromPath: bool, normalize=True, file_
     return output
 
 
-def get_xisf_headers(filename: str, profileFromPath: bool, normalize=True, file_naming_override=False):
+def get_xisf_headers(filename: str, profileFromPath: bool, normalize=True, file_naming_override=False, headers=None):
     """
     Extracts and normalizes XISF headers from a file, optionally overriding with headers from the filename.
+    If the raw file headers have already been read they can be passed as 'headers' to skip opening the file.
     """
     output = {}
 
     if file_naming_override:
         output=get_file_headers(filename, normalize=normalize, profileFromPath=profileFromPath)
 
-    xisf_file = xisf.XISF(filename)
-    metadata = xisf_file.get_images_metadata()
-    # get all fits headers from metadata, converted to string
-    for k in metadata[0]['FITSKeywords'].keys():
+    if headers is None:
+        headers = read_xisf_file_headers(filename)
+    for k in headers.keys():
         # don't overwrite any headers that already exist (only happens if loaded from filename)
-        if k in output or k == "HISTORY":
+        if k in output:
             continue
-        if len(metadata[0]['FITSKeywords'][k]) > 0 and 'value' in metadata[0]['FITSKeywords'][k][0]:
-            v = metadata[0]['FITSKeywords'][k][0]['value']
-            if v is not None and str(v) != "":
-                output[k] = str(v)
+        output[k] = headers[k]
     # normalize if required
     if normalize:
         output = normalize_headers(output)
@@ -391,6 +841,48 @@ def project_status_from_path(path: str):
     return status
 
 
+def get_directory_parts(path: str):
+    """
+    Splits a data directory into its parts.  Data directories look like:
+    <root>/<optic>@f<focal ratio>+<camera>/<stage>/<target>[ Panel <panel>]/accept/DATE_<date>/...
+    Returns a dict with rig, stage, target, panel, date and target_directory (everything before 'accept').
+    Parts that are not found are None.
+    """
+    parts = re.split("[\\\/]", path)
+    output = {
+        "rig": None,
+        "stage": None,
+        "target": None,
+        "panel": None,
+        "date": None,
+        "target_directory": None,
+    }
+
+    stage_index = None
+    for i, part in enumerate(parts):
+        if stage_index is None and "@f" in part and "+" in part:
+            output["rig"] = part
+        elif stage_index is None and part in DIRECTORY_STAGES:
+            output["stage"] = part
+            stage_index = i
+        elif part.startswith("DATE_") and output["date"] is None:
+            output["date"] = part[len("DATE_"):]
+
+    if stage_index is not None and stage_index + 1 < len(parts) and parts[stage_index + 1] != DIRECTORY_ACCEPT:
+        output["target"] = parts[stage_index + 1]
+        output["panel"] = ""
+        m = re.match("(.*) Panel (.*)", output["target"])
+        if m is not None:
+            output["target"] = m.groups()[0]
+            output["panel"] = m.groups()[1]
+
+    m = re.match("(.*)[\\\/]accept[\\\/].*", path)
+    if m is not None:
+        output["target_directory"] = m.groups()[0]
+
+    return output
+
+
 def backup_scheduler_database(): # pragma: no cover
     """
     Creates a backup of the NINA Scheduler database to Dropbox.
@@ -404,40 +896,68 @@ def backup_scheduler_database(): # pragma: no cover
     print("Target Scheduler database file backed up to Dropbox.")
 
 
-def simpleObject_to_csv(data: list, output_headers=True):
+def write_file_if_changed(filename: str, content: str) -> bool:
     """
-    Converts a list of dictionaries to a CSV string, optionally including headers.
-    Ensures deterministic key order for testing.
+    Writes content to the file unless the file already has exactly that content.
+    The new content is written to a temporary file next to it and moved into place, so the file is never partially
+    written (i.e. when Dropbox picks it up).
+    Returns True if the file was written.
     """
-    output = ""
-    header_printed=not output_headers
-    # collect all keys, order is important for deterministic output (aka testing)
-    keys = []
-    for datum in data:
-        for key in datum.keys():
-            if key not in keys:
-                keys.append(key)
-    # process all the data
+    try:
+        with open(filename, "r") as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    filename_tmp = f"{filename}.tmp"
+    with open(filename_tmp, "w") as f:
+        f.write(content)
+    os.replace(filename_tmp, filename)
+    return True
+
+
+def write_csv(f, data, columns: list=None, output_headers=True):
+    """
+    Writes dictionaries as CSV rows to an open file (or any object with write()), one row at a time.
+    Missing keys are written as empty values, values are written as str(value) and quoted only when needed.
+
+    Args:
+        f (Any): The file to write to.  Rows end with "\n" so a file opened in text mode (without newline="") gets
+            the platform's line endings, same as writing the output of simpleObject_to_csv.
+        data (Any): Iterable of dictionaries, can be a generator.
+        columns (list): Column order.  If not given all rows are read first to collect the keys in order of first
+            appearance, give it to write rows as they are generated.
+        output_headers (bool): Write the column names as the first row.  No header is written if there are no rows.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if columns is None:
+        data = list(data)
+        keys = {}
+        for datum in data:
+            for key in datum.keys():
+                keys[key] = None
+        columns = list(keys.keys())
+
+    writer = csv.writer(f, lineterminator="\n")
+    count = 0
     for datum in data:
-        if not header_printed:
-            # print headers from the ordered list of keys
-            output += ",".join(str(x) for x in keys)
-            output += "\n"
-            header_printed=True
-
-        # create array of values, filling in empty values (missing key) with empty string
-        values = []
-        for key in keys:
-            if key in datum:
-                values.append(datum[key])
-            else:
-                values.append("")
+        if count == 0 and output_headers:
+            writer.writerow([str(x) for x in columns])
+        writer.writerow([str(datum[key]) if key in datum else "" for key in columns])
+        count += 1
+    return count
 
-        # create output by simply joining all the values
-        output += ",".join(str(x) for x in values)
-        # always add a newline
-        output += "\n"
-    return output
+
+def simpleObject_to_csv(data: list, output_headers=True):
+    """
+    Converts a list of dictionaries to a CSV string, optionally including headers.
+    Ensures deterministic key order for testing.  See write_csv to write directly to a file.
+    """
+    output = io.StringIO()
+    write_csv(output, data, output_headers=output_headers)
+    return output.getvalue()
 
 
 def normalize_filterName(name: str):
@@ -512,9 +1032,10 @@ def copy_file(from_file: str, to_file: str, debug=False, dryrun=False): # pragma
         shutil.copy2(from_file, to_file)
 
 
-def get_filtered_metadata(dirs: list, filters: dict, profileFromPath: bool, patterns=[".*\.fits$"], recursive=False, required_properties=[], debug=False, printStatus=False):
+def get_filtered_metadata(dirs: list, filters: dict, profileFromPath: bool, patterns=[".*\.fits$"], recursive=False, required_properties=[], debug=False, printStatus=False, workers=0, pool="thread", compact=False):
     """
     Loads metadata for files in given directories, then filters the metadata based on provided filters and required properties.
+    See enrich_metadata for 'workers' and 'pool', iter_metadata for 'compact'.
     """
 
     if required_properties is None:
@@ -524,112 +1045,308 @@ def get_filtered_metadata(dirs: list, filters: dict, profileFromPath: bool, patt
         if filter not in required_properties:
             required_properties.append(filter)
 
-    metadata = get_metadata(
+    metadata = {}
+    for datum in iter_metadata(
         dirs=dirs,
         patterns=patterns,
         recursive=recursive,
         required_properties=required_properties,
+        filters=filters,
         debug=debug,
         printStatus=printStatus,
         profileFromPath=profileFromPath,
-    )
+        workers=workers,
+        pool=pool,
+        compact=compact,
+    ):
+        metadata[datum['filename']] = datum
+
+    return metadata
+
 
-    metadata = filter_metadata(
-        data=metadata,
+def iter_filtered_metadata(dirs: list, filters: dict, profileFromPath: bool, patterns=[".*\.fits$"], recursive=False, required_properties=[], debug=False, printStatus=False, workers=0, pool="thread", batch_size=None, compact=False):
+    """
+    Yields metadata for files in given directories that match the provided filters, see iter_metadata.
+    All filter keys are required properties.
+    """
+    _required_properties = list(required_properties or [])
+    for filter in filters.keys():
+        if filter not in _required_properties:
+            _required_properties.append(filter)
+
+    return iter_metadata(
+        dirs=dirs,
+        patterns=patterns,
+        recursive=recursive,
+        required_properties=_required_properties,
         filters=filters,
         debug=debug,
+        printStatus=printStatus,
+        profileFromPath=profileFromPath,
+        workers=workers,
+        pool=pool,
+        batch_size=batch_size,
+        compact=compact,
     )
 
-    return metadata
+
+def _compile_patterns(patterns: list):
+    """
+    Compiles a list of regex patterns into a single search function that is True if any pattern matches.
+    """
+    try:
+        return re.compile("|".join(f"(?:{p})" for p in patterns)).search
+    except re.error:
+        # some patterns can't be combined (i.e. inline flags), check them one at a time
+        compiled = [re.compile(p) for p in patterns]
+        return lambda name: any(c.search(name) for c in compiled)
+
+
+def iter_filenames(dirs: list, patterns=[".*\.fits$"], recursive=False, with_entries=False, exclude=WALK_EXCLUDE):
+    """
+    Yields filenames in the given directories where the name matches any of the patterns, in a single pass over the tree.
+    Recursive walks visit directories in the same order as os.walk (top-down, symlinked directories are not followed)
+    and do not descend into any directory whose path contains one of the 'exclude' strings.
+    If with_entries is True yields (filename, os.DirEntry) so callers can reuse the cached stat information.
+    """
+    search = _compile_patterns(patterns)
+    for dir in dirs:
+        dir = replace_env_vars(dir)
+        if not recursive:
+            # list before yielding, callers may create files in the directory
+            with os.scandir(dir) as it:
+                entries = list(it)
+            for entry in entries:
+                if search(entry.name):
+                    yield (entry.path, entry) if with_entries else entry.path
+            continue
+
+        if any(x in dir for x in exclude):
+            continue
+        stack = [dir]
+        while len(stack) > 0:
+            root = stack.pop()
+            subdirs = []
+            try:
+                with os.scandir(root) as it:
+                    entries = list(it)
+            except OSError:
+                # same as os.walk, skip anything that can't be listed
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    try:
+                        is_symlink = entry.is_symlink()
+                    except OSError:
+                        is_symlink = False
+                    if not is_symlink and not any(x in entry.path for x in exclude):
+                        subdirs.append(entry.path)
+                elif search(entry.name):
+                    yield (entry.path, entry) if with_entries else entry.path
+            # depth first, in listing order
+            stack.extend(reversed(subdirs))
+
+
+def find_missing_dirs(dirs: list, root: str, workers=DIRECTORY_CHECK_WORKERS):
+    """
+    Returns the set of directories that do not exist.
+    Each directory's parents (below 'root') are checked first, level by level, and once a parent is missing none of
+    the directories under it are checked.  Checks on a level run concurrently with 'workers' threads.
+    """
+    # every directory and its parents below root, by depth
+    levels = {}
+    for dir in set(dirs):
+        path = dir
+        while True:
+            depth = path.count(os.sep)
+            if path in levels.get(depth, set()):
+                break
+            levels.setdefault(depth, set()).add(path)
+            parent = os.path.dirname(path)
+            if parent == path or len(parent) <= len(root) or not parent.startswith(root):
+                break
+            path = parent
+
+    missing = set()
+    executor = None
+    if workers is not None and workers > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for depth in sorted(levels.keys()):
+            to_check = []
+            for path in levels[depth]:
+                if os.path.dirname(path) in missing:
+                    missing.add(path)
+                else:
+                    to_check.append(path)
+            if executor is not None:
+                exists = list(executor.map(os.path.isdir, to_check))
+            else:
+                exists = [os.path.isdir(path) for path in to_check]
+            for path, path_exists in zip(to_check, exists):
+                if not path_exists:
+                    missing.add(path)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return missing & set(dirs)
 
 
 def get_filenames(dirs: list, patterns=[".*\.fits$"], recursive=False, zips=False):
     """
     Returns a list of filenames in the given directories matching the provided patterns.
-    Supports recursive search and ZIP archive extraction.
+    Supports recursive search and ZIP archive extraction (not recursive only).
+    The tree is walked once, results are ordered by pattern then directory and a file matching more than one pattern
+    is listed once per pattern.
     """
+    # bucket by pattern then directory
+    buckets = [[[] for _ in dirs] for _ in patterns]
+    compiled = [re.compile(p) for p in patterns]
+    walk_patterns = patterns
+    if zips and not recursive:
+        # zip files are expanded no matter what they are named
+        walk_patterns = [INPUT_PATTERN_ALL]
+    for i, dir in enumerate(dirs):
+        for filename in iter_filenames([dir], patterns=walk_patterns, recursive=recursive):
+            if walk_patterns is not patterns and zipfile.is_zipfile(filename):
+                # Process ZIP archive, add each contained filename that matches the pattern
+                with zipfile.ZipFile(filename, 'r') as archive:
+                    zip_filenames = archive.namelist()
+                for j, c in enumerate(compiled):
+                    for zip_filename in zip_filenames:
+                        if c.search(zip_filename):
+                            buckets[j][i].append(os.path.join(filename, zip_filename))
+                continue
+            name = os.path.basename(filename)
+            for j, c in enumerate(compiled):
+                if c.search(name):
+                    buckets[j][i].append(filename)
+
     filenames = []
-    for pattern in patterns:
-        for dir in dirs:
-            dir=replace_env_vars(dir)
-            if not recursive:
-                print(os.listdir(dir))
-                for filename in (filename for filename in os.listdir(dir) if re.search(pattern, filename) or (zips and zipfile.is_zipfile(filename))):
-                    # found a matching file or found a zip file
-                    filename_path = os.path.join(dir, filename)
-                    if zips and zipfile.is_zipfile(filename_path):
-                        # Process ZIP archive
-                        with zipfile.ZipFile(filename_path, 'r') as archive:
-                            for zip_filename in (filename for filename in archive.filelist if re.search(pattern, filename)):
-                                # add each contained filename that matches the pattern
-                                filenames.append(os.path(filename_path, zip_filename))
-                    else:
-                        # not a zip, simply add it
-                        filenames.append(filename_path)
-            else:
-                for root, _, f_names in os.walk(dir):
-                    for filename in (filename for filename in f_names if re.search(pattern, filename)):
-                        # special cases to ignore...
-                        if "_stash" in root:
-                            continue
-                        filenames.append(os.path.join(root, filename))
+    for bucket in buckets:
+        for bucket_dir in bucket:
+            filenames.extend(bucket_dir)
     return filenames
 
 
-def get_metadata(dirs: list, profileFromPath: bool, patterns=[".*\.fits$"], recursive=False, required_properties=[], debug=False, printStatus=False):
+def get_metadata(dirs: list, profileFromPath: bool, patterns=[".*\.fits$"], recursive=False, required_properties=[], debug=False, printStatus=False, workers=0, pool="thread", compact=False):
     """
     Loads metadata for files in the given directories, ensuring all required properties are present.
-    Optionally prints status updates.
+    Optionally prints status updates.  See enrich_metadata for 'workers' and 'pool', iter_metadata for 'compact'.
     """
-    _required_properties = list(required_properties)
-    # 'targetname' is always required, simply to have a value of None...
-    if 'targetname' not in _required_properties:
-        _required_properties.append('targetname')
-
     # key of 'data' is the full path of the file
     data = {}
-
-    # find files and load metadata from path+name.
-    count_files=0 # could use len but assuming this is faster
-    if printStatus:
-        print("Loading data..", end=".", flush=True)
-
-    filenames = get_filenames(
+    for datum in iter_metadata(
         dirs=dirs,
         patterns=patterns,
         recursive=recursive,
-    )
+        required_properties=required_properties,
+        debug=debug,
+        printStatus=printStatus,
+        profileFromPath=profileFromPath,
+        workers=workers,
+        pool=pool,
+        compact=compact,
+    ):
+        data[datum['filename']] = datum
+    return data
 
-    for filename in filenames:
-        d = get_file_headers(filename, profileFromPath=profileFromPath)
-        data[d['filename']] = d
-        count_files += 1
-        if printStatus and count_files % 1000 == 0:
-            print(".", end="", flush=True)
 
-    if printStatus:
-        # need to complete the line!
-        print("")
+def iter_metadata(dirs: list, profileFromPath: bool, patterns=[".*\.fits$"], recursive=False, required_properties=[], filters=None, debug=False, printStatus=False, workers=0, pool="thread", batch_size=None, compact=False):
+    """
+    Yields metadata for files in the given directories, ensuring all required properties are present.
+    If filters are provided only records matching them are yielded (see filter_metadata).
+    With batch_size=None everything is scanned and enriched before the first record is yielded, in the same order as get_metadata.
+    Otherwise the tree is walked lazily and records are yielded batch_size files at a time so callers can start
+    working while the scan is still running and memory stays flat.  Status output is printed per batch.
+    With compact=True records are FrameMetadata instead of dict, use it when holding on to a lot of records.
+    See enrich_metadata for 'workers' and 'pool'.
+    """
+    if filters is not None:
+        validate_filters(filters)
 
-    # make sure all required properties are at least None
-    for f in data.keys():
-        for p in _required_properties:
-            if p not in data[f]:
-                data[f][p] = None
+    _required_properties = list(required_properties)
+    # 'targetname' is always required, simply to have a value of None...
+    if 'targetname' not in _required_properties:
+        _required_properties.append('targetname')
 
-    return enrich_metadata(
-        data=data,
-        required_properties=_required_properties,
-        debug=debug,
-        printStatus=printStatus,
-        profileFromPath=profileFromPath,
-    )
+    if batch_size is None:
+        batches = [get_filenames(
+            dirs=dirs,
+            patterns=patterns,
+            recursive=recursive,
+        )]
+    else:
+        batches = batched(iter_filenames(dirs=dirs, patterns=patterns, recursive=recursive), batch_size)
+
+    for filenames in batches:
+        # key of 'data' is the full path of the file
+        data = {}
+
+        # find files and load metadata from path+name.
+        count_files=0 # could use len but assuming this is faster
+        if printStatus:
+            print("Loading data..", end=".", flush=True)
+
+        for filename in filenames:
+            d = get_file_headers(filename, profileFromPath=profileFromPath)
+            # convert right away so the dict and its compact copy are never both held for every file
+            data[d['filename']] = FrameMetadata(d) if compact else d
+            count_files += 1
+            if printStatus and count_files % 1000 == 0:
+                print(".", end="", flush=True)
+
+        if printStatus:
+            # need to complete the line!
+            print("")
+
+        # make sure all required properties are at least None
+        for f in data.keys():
+            for p in _required_properties:
+                if p not in data[f]:
+                    data[f][p] = None
+
+        data = enrich_metadata(
+            data=data,
+            required_properties=_required_properties,
+            debug=debug,
+            printStatus=printStatus,
+            profileFromPath=profileFromPath,
+            workers=workers,
+            pool=pool,
+            compact=compact,
+        )
+
+        for datum in data.values():
+            if filters is None or match_filters(datum, filters):
+                yield datum
 
 
-def enrich_metadata(data: dict, profileFromPath: bool, required_properties=[], debug=False, printStatus=False):
+def batched(iterable, size: int):
+    """
+    Yields lists of up to 'size' items from iterable.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def enrich_metadata(data: dict, profileFromPath: bool, required_properties=[], debug=False, printStatus=False, workers=0, pool="thread", compact=False):
     """
     Enriches metadata for files missing required properties by extracting additional headers from the files themselves.
     Optionally prints status updates.
+    With workers > 1 headers are read concurrently (see iter_file_headers), results are processed in the same order.
+    With compact=True enriched records are stored as FrameMetadata as soon as they are read.
     """
     # list of filenames (key of data dict) that need enrichment
     to_enrich = []
@@ -650,15 +1367,22 @@ def enrich_metadata(data: dict, profileFromPath: bool, required_properties=[], d
     last_targetname = None
     last_target_count = 0
 
+    # raw headers in the order of to_enrich.  a filename can be in to_enrich more than once but is read once.
+    file_headers = iter_file_headers(list(dict.fromkeys(to_enrich)), workers=workers, pool=pool)
+    headers_filename = None
+    headers = None
+
     # enrich things that need it
     for filename in to_enrich:
         datum = data[filename]
+        if filename != headers_filename:
+            headers_filename, headers = next(file_headers)
         # get headers from metadata.  normalize and use file naming override.
         enriched = None
         if filename.endswith(".fits"):
-            enriched = get_fits_headers(filename, normalize=True, file_naming_override=True, profileFromPath=profileFromPath)
+            enriched = get_fits_headers(filename, normalize=True, file_naming_override=True, profileFromPath=profileFromPath, headers=headers)
         elif filename.endswith(".xisf"):
-            enriched = get_xisf_headers(filename, normalize=True, file_naming_override=True, profileFromPath=profileFromPath)
+            enriched = get_xisf_headers(filename, normalize=True, file_naming_override=True, profileFromPath=profileFromPath, headers=headers)
         else:
             # some other file type, probably cr2
             # can only default the location to "home"
@@ -685,6 +1409,8 @@ def enrich_metadata(data: dict, profileFromPath: bool, required_properties=[], d
             print("", end=".", flush=True)
 
         # store the now-enriched data
+        if compact and not isinstance(enriched, FrameMetadata):
+            enriched = FrameMetadata(enriched)
         data[filename] = enriched
 
     if printStatus:
@@ -697,10 +1423,9 @@ def enrich_metadata(data: dict, profileFromPath: bool, required_properties=[], d
     return data
 
 
-def filter_metadata(data: dict, filters: dict, debug=False):
+def validate_filters(filters: dict):
     """
-    Filters a metadata dictionary based on provided filter key/value pairs or functions.
-    Returns a new dictionary with only matching entries.
+    Raises an exception if the filters can't be used with filter_metadata.
     """
     # validate input filter data
     if filters is None or filters.keys() is None or len(filters.keys()) == 0:
@@ -715,75 +1440,122 @@ def filter_metadata(data: dict, filters: dict, debug=False):
             print(f"ERROR filter: key '{filter_key}' has no value '{filter_value}'")
             raise(Exception(f"filter key '{filter_key}' has no value '{filter_value}'"))
 
-    # filters are good.  process the data and build a new output data set
-    output = {}
 
-    # for each datum, check filter.  if it matches all filters, add the datum to 'new_data'
-    for filename in data.keys():
-        datum = data[filename]
-        # process each filter for this datum
-        # is_match will be False if at least one filter does not match
-        is_match = True
+def match_filters(datum: dict, filters: dict):
+    """
+    Returns True if the datum matches all filters, see filter_metadata.  Filters are not validated.
+    """
+    # loop through each filter.  if any filter does not match return False
+    for filter_key in filters.keys():
+        filter_value = filters[filter_key]
 
-        # loop through each filter.  if any filter does not match set is_match False and break the loop
-        for filter_key in filters.keys():
-            filter_value = filters[filter_key]
+        # if we don't have the filter in the datum it's ok, just treat it as "OK"
+        if filter_key not in datum:
+            continue
 
-            # if we don't have the filter in the datum it's ok, just treat it as "OK"
-            if filter_key not in datum:
-                continue
+        # filter exists in datum, check value
+        if callable(filter_value):
+            try:
+                # assumes the function returns bool...
+                if not filter_value(datum[filter_key]):
+                    # not a match
+                    return False
+            except:
+                # no idea, bad function? bail!
+                raise Exception(f"WARNING failed to call function '{filter_value}' with argument '{datum[filter_key]}'")
+
+        elif type(filter_value) is int:
+            try:
+                # convert to float first because "90.00" won't convert to int directly
+                if int(float(datum[filter_key])) != filter_value:
+                    # not a match
+                    return False
+            except:
+                # cannot convert to int probably, so it's not a match
+                return False
+
+        elif type(filter_value) is float:
+            try:
+                # set to match if
+                if float(datum[filter_key]) != filter_value:
+                    # not a match
+                    return False
+            except:
+                # cannot convert to float probably, so it's not a match
+                return False
 
-            # filter exists in datum, check value
-            if callable(filter_value):
-                try:
-                    # assumes the function returns bool...
-                    if not filter_value(datum[filter_key]):
-                        # not a match
-                        is_match = False
-                        break
-                except:
-                    # no idea, bad function? bail!
-                    raise Exception(f"WARNING failed to call function '{filter_value}' with argument '{datum[filter_key]}'")
+        else:
+            # default, treat as string
+            if str(datum[filter_key]) != filter_value:
+                # not a match
+                return False
 
-            elif type(filter_value) is int:
-                try:
-                    # convert to float first because "90.00" won't convert to int directly
-                    if int(float(datum[filter_key])) != filter_value:
-                        # not a match
-                        is_match = False
-                        break
-                except:
-                    # cannot convert to int probably, so it's not a match
-                    is_match = False
-                    break
+    return True
 
-            elif type(filter_value) is float:
-                try:
-                    # set to match if
-                    if float(datum[filter_key]) != filter_value:
-                        # not a match
-                        is_match = False
-                        break
-                except:
-                    # cannot convert to float probably, so it's not a match
-                    is_match = False
-                    break
 
-            else:
-                # default, treat as string
-                if str(datum[filter_key]) != filter_value:
-                    # not a match
-                    is_match = False
-                    break
+def filter_metadata(data: dict, filters: dict, debug=False):
+    """
+    Filters a metadata dictionary based on provided filter key/value pairs or functions.
+    Returns a new dictionary with only matching entries.
+    """
+    validate_filters(filters)
 
-        # all filters have been checked, did we find a match?
-        if is_match:
-            # found a match for all filters.  add datum to 'output'
-            output[filename] = datum
+    # filters are good.  process the data and build a new output data set
+    output = {}
+
+    # for each datum, check filter.  if it matches all filters, add the datum to 'output'
+    for filename in data.keys():
+        if match_filters(data[filename], filters):
+            output[filename] = data[filename]
 
     return output
 
 
+class MetadataIndex():
+    """
+    Hash index over a metadata dictionary on a fixed list of keys.
+    lookup(filters) returns exactly what filter_metadata(data, filters) would for string filter values on those keys,
+    in the same order, without scanning every record.  A record missing a key matches any value for that key, so records
+    are bucketed by which keys they have and each bucket is probed once per lookup.
+    """
+
+    def __init__(self, data: dict, keys: list):
+        self.data = data
+        self.keys = list(keys)
+        self.position = {}
+        # tuple of key present flags -> tuple of values (as str) -> filenames
+        self.buckets = {}
+        for filename in data.keys():
+            datum = data[filename]
+            present = tuple(k in datum for k in self.keys)
+            values = tuple(str(datum[k]) for k, p in zip(self.keys, present) if p)
+            self.position[filename] = len(self.position)
+            self.buckets.setdefault(present, {}).setdefault(values, []).append(filename)
+
+    def lookup(self, filters: dict, debug=False):
+        """
+        Returns a new dictionary with only entries matching the filters, see filter_metadata.
+        Filters on keys that are not indexed or with non-string values fall back to filter_metadata.
+        """
+        validate_filters(filters)
+
+        if set(filters.keys()) != set(self.keys) or any(type(v) is not str for v in filters.values()):
+            return filter_metadata(data=self.data, filters=filters, debug=debug)
+
+        matches = []
+        for present in self.buckets.keys():
+            values = tuple(filters[k] for k, p in zip(self.keys, present) if p)
+            matches.extend(self.buckets[present].get(values, []))
+        if len(self.buckets) > 1:
+            # keep the order of the input data
+            matches.sort(key=self.position.get)
+
+        output = {}
+        for filename in matches:
+            output[filename] = self.data[filename]
+        return output
+
+
 def get_copy_list(data: dict, output_dir: str, filters: dict, debug=False):
     """
     Returns a list of (source, destination) tuples for copying files to an output location based on filters.
@@ -1068,6 +1840,8 @@ DIRECTORY_NINA_PROFILES=replace_env_vars(r"%Dropbox%\Family Room\Astrophotograph
 DATABASE_ASTROPHOTGRAPHY=replace_env_vars(r"%Dropbox%\Family Room\Astrophotography\Data\astrophotography.sqlite")
 DATABASE_TARGET_SCHEDULER=replace_env_vars(r"%LocalAppData%\NINA\SchedulerPlugin\schedulerdb.sqlite")
 BACKUP_TARGET_SCHEDULER=replace_env_vars(r"%Dropbox%\Family Room\Astrophotography\Configuration\NINA\SchedulerPlugin\schedulerdb.sqlite")
+# local only, must not be synced.  safe to delete at any time.
+DATABASE_HEADER_CACHE=replace_env_vars(r"%LocalAppData%\astrophotography-data-management\header-cache.sqlite")
 
 DIRECTORY_CSV=replace_env_vars(r"%Dropbox%\Family Room\Astrophotography\Data")
 
@@ -1077,6 +1851,8 @@ DIRECTORY_MASTER=r"30_Master"
 DIRECTORY_PROCESS=r"40_Process"
 DIRECTORY_BAKE=r"50_Bake"
 DIRECTORY_DONE=r"60_Done"
+# stages in workflow order, see get_directory_parts()
+DIRECTORY_STAGES=[DIRECTORY_BLINK, DIRECTORY_DATA, DIRECTORY_MASTER, DIRECTORY_PROCESS, DIRECTORY_BAKE, DIRECTORY_DONE]
 DIRECTORY_ACCEPT=r"accept"
 DIRECTORY_CALIBRATION=r"_calibration"
 
@@ -284,6 +284,7 @@ class CopyCalibration:
             filters={"type": "LIGHT"},
             debug=self.debug,
             profileFromPath=True,
+            compact=True,
         )
 
         return self._getCopyList_to_lights(
@@ -331,6 +332,7 @@ class CopyCalibration:
             filters={"type": "LIGHT"},
             debug=self.debug,
             profileFromPath=True,
+            compact=True,
         )
 
         return self._getCopyList_to_lights(
@@ -382,12 +384,14 @@ class CopyCalibration:
 
         # we have calibration, lights, and a pile of filters
         # find the calibration files to copies
+        # index calibration once on the properties every filter uses
+        index = common.MetadataIndex(data=data_calibration, keys=cleansed_required_properties)
+
         copy_list=[]
         for light_dir in filters.keys():
             f = filters[light_dir]
 
-            filtered_data_calibration = common.filter_metadata(
-                data=data_calibration,
+            filtered_data_calibration = index.lookup(
                 filters=f,
                 debug=self.debug,
             )
@@ -442,6 +446,7 @@ if __name__ == '__main__': # pragma: no cover
 
     parser.add_argument("--debug", action='store_true')
     parser.add_argument("--dryrun", action='store_true')
+    parser.add_argument("--nocache", action='store_true', help="do not use the local header cache")
 
     parser.add_argument("--darks_required_properties", type=str, help="Comma-delimited string of required properties for darks, optional")
     parser.add_argument("--flats_required_properties", type=str, help="Comma-delimited string of required properties for flats, optional")
@@ -453,6 +458,9 @@ if __name__ == '__main__': # pragma: no cover
     darks_required_properties = args["darks_required_properties"].split(",") if args["darks_required_properties"] else None
     flats_required_properties = args["flats_required_properties"].split(",") if args["flats_required_properties"] else None
 
+    if not args["nocache"]:
+        common.open_header_cache(debug=args["debug"])
+
     cc = CopyCalibration(
         src_bias_dir=args["src_bias_dir"],
         src_dark_dir=args["src_dark_dir"],
@@ -5,10 +5,12 @@ It organizes rejected images into a specified directory for further review.
 
 import os
 import argparse
+import numpy
 import statistics
 import sys
 
 import common
+import metadatatable
 
 def reject_image(dir, file):
     # create target directory (include os.sep to strip it!)
@@ -56,6 +58,7 @@ if __name__ == '__main__':
     parser.add_argument("--auto_yes_percent", type=float, help="automatic accept rejection if is less than this percent of images")
     parser.add_argument("--debug", action='store_true')
     parser.add_argument("--dryrun", action='store_true')
+    parser.add_argument("--nocache", action='store_true', help="do not use the local header cache")
 
     # treat args parsed as a dictionary
     args = vars(parser.parse_args())
@@ -67,6 +70,10 @@ if __name__ == '__main__':
     user_autoyespercent = args["auto_yes_percent"]
     user_debug = args["debug"]
     user_dryrun = args["dryrun"]
+    user_nocache = args["nocache"]
+
+    if not user_nocache:
+        common.open_header_cache(debug=user_debug)
 
     data = common.get_metadata(
         dirs=[user_srcdir],
@@ -75,56 +82,43 @@ if __name__ == '__main__':
         required_properties=[],
         debug=user_debug,
         profileFromPath=True,
+        compact=True,
     )
 
-    data_groups = {}
+    table = metadatatable.MetadataTable.from_records(data, columns=["filename", "hfr", "rmsac"])
+
+    # skip anything already accepted
+    table = table.filter({"filename": lambda f: common.DIRECTORY_ACCEPT not in f})
+    # strip filename
+    table.add_column("directory", [os.sep.join(f.split(os.sep)[:-1]) for f in table.values("filename")])
 
     # do file grouping
-    for filename in data.keys():
-        # skip anything already accepted
-        if common.DIRECTORY_ACCEPT in filename:
-            continue
-        # strip filename
-        directory = os.sep.join(filename.split(os.sep)[:-1])
-        if directory not in data_groups:
-            data_groups[directory] = []
-        data_groups[directory].append(data[filename])
+    data_groups = table.group_indices(["directory"])
 
     if user_debug:
         print("DEBUG directory groupings:")
-        for dir in data_groups.keys():
-            print(f"    {dir}: {len(data_groups[dir])}")
+        for group, rows in data_groups:
+            print(f"    {group['directory']}: {len(rows)}")
+
+    # check hfr, then rms for anything not already rejected on hfr.  missing or non-numeric values are NaN and never reject.
+    filenames = table.values("filename")
+    hfr = table.numeric("hfr")
+    rms = table.numeric("rmsac")
+    reject_hfr = hfr > user_maxhfr if user_maxhfr is not None else numpy.zeros(len(table), dtype=bool)
+    reject_rms = ~reject_hfr & (rms > user_maxrms if user_maxrms is not None else numpy.zeros(len(table), dtype=bool))
 
     # loop over data sets
     overall_count_reject = 0
     overall_count_total = 0
-    for directory in data_groups.keys():
-
+    for group, rows in data_groups:
+        directory = group["directory"]
 
-        count_reject_hfr = 0
-        count_reject_rms = 0
-        count_reject = 0
-        count_total = len(data_groups[directory])
+        count_reject_hfr = int(reject_hfr[rows].sum())
+        count_reject_rms = int(reject_rms[rows].sum())
+        count_reject = count_reject_hfr + count_reject_rms
+        count_total = len(rows)
         overall_count_total += count_total
-        datum_reject = []
-
-        for datum in data_groups[directory]:
-            # check hfr
-            key = "hfr"
-            if key in datum and datum[key] is not None:
-                if float(datum[key]) > user_maxhfr:
-                    count_reject_hfr += 1
-                    count_reject += 1
-                    datum_reject.append(datum)
-                    continue
-
-            key = "rmsac"
-            if key in datum and datum[key] is not None:
-                if float(datum[key]) > user_maxrms:
-                    count_reject_rms += 1
-                    count_reject += 1
-                    datum_reject.append(datum)
-                    continue
+        datum_reject = [filenames[i] for i in rows if reject_hfr[i] or reject_rms[i]]
 
         if count_reject > 0:
             print("==============================")
@@ -145,8 +139,8 @@ if __name__ == '__main__':
 
             if answer == "y":
                 overall_count_reject += count_reject
-                for datum in datum_reject:
-                    reject_image(directory, datum["filename"])
+                for filename in datum_reject:
+                    reject_image(directory, filename)
             # else don't reject
             print("==============================")
 
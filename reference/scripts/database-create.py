@@ -3,22 +3,42 @@ This script creates the schema and initial data for the astrophotography databas
 It uses predefined methods to set up profiles and filters in the database.
 """
 
+import argparse
+
 import common
 import database
+import filecache
+
+parser = argparse.ArgumentParser(description="create the astrophotography database and load profiles")
+parser.add_argument("--debug", action='store_true')
+parser.add_argument("--nocache", action='store_true', help="parse all profiles, not only the ones changed since the last run")
+
+# treat args parsed as a dictionary
+args = vars(parser.parse_args())
+
+user_debug = args["debug"]
+user_nocache = args["nocache"]
 
 db_ap = database.Astrophotgraphy(
     db_filename=common.DATABASE_ASTROPHOTGRAPHY,
     autoCommit=False,
+    debug=user_debug,
 )
 
+# parsed profiles are cached with the file headers
+cache = None
+if not user_nocache:
+    cache = filecache.FileCache(db_filename=common.DATABASE_HEADER_CACHE, table="profiles", debug=user_debug)
+    cache.open()
+
 try:
     db_ap.open()
 
     db_ap.CreateSchema()
-    profile_stmts = db_ap.CreateProfileStmts(profile_dir=common.DIRECTORY_NINA_PROFILES)
-    for stmt in profile_stmts:
-        db_ap.execute(stmt)
+    db_ap.CreateProfiles(profile_dir=common.DIRECTORY_NINA_PROFILES, cache=cache)
     db_ap.CreateFilters()
 finally:
     db_ap.commit()
-    db_ap.close()
\ No newline at end of file
+    db_ap.close()
+    if cache is not None:
+        cache.close()
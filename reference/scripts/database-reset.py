@@ -3,13 +3,15 @@ This script resets the astrophotography database by deleting all data from speci
 It connects to the database and executes SQL commands to clear the data.
 """
 
-import sqlite3
-
 import common
+import database
 
-with sqlite3.connect(common.DATABASE_ASTROPHOTGRAPHY) as conn:
-    c = conn.cursor()
+conn = database.connect(common.DATABASE_ASTROPHOTGRAPHY, database.PRAGMAS_ASTROPHOTOGRAPHY)
+try:
+    with database.transaction(conn):
+        c = conn.cursor()
 
-    c.execute("delete from accepted_data;")
-    c.execute("delete from target;")
-    conn.commit()
\ No newline at end of file
+        c.execute("delete from accepted_data;")
+        c.execute("delete from target;")
+finally:
+    conn.close()
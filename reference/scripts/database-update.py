@@ -19,6 +19,8 @@ parser.add_argument("--modeDelete", action='store_true', help="looks for deleted
 parser.add_argument("--modeUpdate", action='store_true', help="looks for deleted images only")
 parser.add_argument("--debug", action='store_true')
 parser.add_argument("--dryrun", action='store_true')
+parser.add_argument("--nocache", action='store_true', help="do not use the local header cache")
+parser.add_argument("--workers", type=int, help="number of threads used to read image headers, 0 to read serially", default=0)
 
 # treat args parsed as a dictionary
 args = vars(parser.parse_args())
@@ -29,6 +31,11 @@ user_modeDelete = args["modeDelete"]
 user_modeUpdate = args["modeUpdate"]
 user_debug = args["debug"]
 user_dryrun = args["dryrun"]
+user_nocache = args["nocache"]
+user_workers = args["workers"]
+
+if not user_nocache:
+    common.open_header_cache(debug=user_debug)
 
 db_ap = database.Astrophotgraphy(
     db_filename=common.DATABASE_ASTROPHOTGRAPHY,
@@ -43,6 +50,7 @@ try:
         modeCreate=user_modeCreate,
         modeDelete=user_modeDelete,
         modeUpdate=user_modeUpdate,
+        workers=user_workers,
     )
 finally:
     # always commit even if there's an exception
@@ -3,18 +3,158 @@ This module provides a class for interacting with SQLite databases used in astro
 It includes methods for opening, querying, and managing database connections.
 """
 
-import json
+import bisect
+import contextlib
+import functools
 import os
 import re
 import sys
 import traceback
-import xmltodict
 import sqlite3
-import yaml
+
+from pathlib import Path
+from xml.etree import ElementTree
 
 import common
+import metadatatable
+
+# number of compiled statements sqlite keeps per connection, and generated statements kept per process
+STATEMENT_CACHE_SIZE=256
+# rows fetched at a time by fetch_iter
+FETCH_SIZE=1000
+# values per "... where x in (...)" statement
+IN_BATCH_SIZE=500
+# seconds to wait on a locked database, NINA may be holding the scheduler database
+BUSY_TIMEOUT_SECONDS=30
+
+# connection pragmas for each database.  journal_mode is left as is for both: the astrophotography database lives in
+# a synced (Dropbox) folder and the scheduler database is owned by NINA, so neither should get WAL side files.
+# the local header cache (filecache) is the one database that runs in WAL.
+PRAGMAS_ASTROPHOTOGRAPHY = {
+    "case_sensitive_like": "ON",
+    # can be rebuilt from the image files, trade a little durability for fewer fsyncs
+    "synchronous": "NORMAL",
+    "cache_size": -65536, # KiB
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+PRAGMAS_SCHEDULER = {
+    "case_sensitive_like": "ON",
+    "cache_size": -16384, # KiB
+    "temp_store": "MEMORY",
+}
+
+
+def connect(db_filename: str, pragmas: dict=PRAGMAS_ASTROPHOTOGRAPHY, timeout: float=BUSY_TIMEOUT_SECONDS, uri=False) -> sqlite3.Connection:
+    """
+    Open a SQLite connection with a busy timeout and the given pragmas.
+
+    Args:
+        db_filename (str): The database file.
+        pragmas (dict): Pragma name -> value, applied in order.
+        timeout (float): Seconds to wait for a lock held by another connection.
+        uri (bool): db_filename is a "file:" URI, i.e. to open read-only with "?mode=ro".
+
+    Returns:
+        sqlite3.Connection: The open connection.
+    """
+    conn = sqlite3.connect(db_filename, timeout=timeout, cached_statements=STATEMENT_CACHE_SIZE, uri=uri)
+    for key in pragmas.keys():
+        conn.execute(f"PRAGMA {key}={pragmas[key]}")
+    return conn
+
+
+def prefix_range(prefix: str) -> tuple:
+    """
+    Returns (low, high) so that "column >= low and column < high" matches exactly the values starting with prefix.
+    Unlike "like 'prefix%'" this always uses the column's index and '_' and '%' in the prefix are not wildcards.
+    """
+    if len(prefix) == 0:
+        return ("", chr(0x10FFFF))
+    return (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+@contextlib.contextmanager
+def transaction(conn: sqlite3.Connection):
+    """
+    Scope a write transaction.  Takes the write lock up front (BEGIN IMMEDIATE) so waiting on a busy database happens
+    once at the start, commits on success and rolls back on any exception.
+    If a transaction is already open it is used as is and left to the caller to finish.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _where_sql(clauses: tuple) -> str:
+    """
+    For a tuple of (column, operator), create an "and"-separated list of placeholders.
+    """
+    return " and ".join([f"{column} {operator} ?" for column, operator in clauses])
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _insert_sql(table: str, columns: tuple, ignoreErrors: bool) -> str:
+    ignore = ""
+    if ignoreErrors:
+        ignore = "or ignore "
+    return f"insert {ignore}into {table} ({','.join(columns)}) values ({','.join(['?'] * len(columns))});"
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _upsert_sql(table: str, insert_columns: tuple, update_columns: tuple, conflictColumns: tuple) -> str:
+    set_stmts = ",".join([f"{c}=?" for c in update_columns])
+    return f"insert into {table} ({','.join(insert_columns)}) values ({','.join(['?'] * len(insert_columns))}) on conflict ({','.join(conflictColumns)}) do update set {set_stmts},last_updated_date=CURRENT_TIMESTAMP;"
+
+
+def read_profile(filename: str) -> dict:
+    """
+    Reads the id, name and filter wheel filter names from a NINA .profile file.
+    The XML is streamed and parsing stops as soon as everything needed has been read.
+
+    Returns:
+        dict: id, name and filters (list of filter names, as in the profile).
+    """
+    output = {"id": None, "name": None, "filters": []}
+    # elements needed, by path of local names (no namespace)
+    path_id = ("Profile", "Id")
+    path_name = ("Profile", "Name")
+    path_filterwheel = ("Profile", "FilterWheelSettings")
+    path_filter = ("Profile", "FilterWheelSettings", "FilterWheelFilters", "FilterInfo", "_name")
+    done = set()
+    path = []
+    for event, element in ElementTree.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            path.append(element.tag.rsplit("}", 1)[-1])
+            continue
+        current = tuple(path)
+        path.pop()
+        # whitespace is stripped, same as xmltodict did
+        if current == path_id:
+            output["id"] = (element.text or "").strip()
+        elif current == path_name:
+            output["name"] = (element.text or "").strip()
+        elif current == path_filter:
+            output["filters"].append((element.text or "").strip())
+        if len(current) == 2:
+            done.add(current)
+            # done with this part of the profile, free it
+            element.clear()
+            if done.issuperset([path_id, path_name, path_filterwheel]):
+                break
+    return output
+
 
 class Database():
+    pragmas = PRAGMAS_ASTROPHOTOGRAPHY
     db_filename = ""
     conn = None
     curr = None
@@ -33,14 +173,19 @@ class Database():
 
     def open(self):
         if not self.dryrun and not self.isOpen():
-            self.conn = sqlite3.connect(self.db_filename)
+            self.conn = connect(self.db_filename, self.pragmas)
             self.curr = self.conn.cursor()
-            self.conn.execute("PRAGMA case_sensitive_like=ON")
 
-    def execute(self, stmt:str):
+    def execute(self, stmt:str, params=None):
+        """
+        Execute a statement, with optional bound parameters, and return all rows.  In dryrun the statement is returned.
+        """
         if not self.dryrun:
             try:
-                self.curr.execute(stmt)
+                if params is None:
+                    self.curr.execute(stmt)
+                else:
+                    self.curr.execute(stmt, params)
             except Exception as e:
                 print(f"ERROR executing statement\n{stmt}")
                 raise e
@@ -48,6 +193,81 @@ class Database():
         else:
             return stmt
 
+    def executemany(self, stmt:str, rows:list):
+        """
+        Execute one statement for each row of bound parameters.
+        """
+        if not self.dryrun:
+            try:
+                self.curr.executemany(stmt, rows)
+            except Exception as e:
+                print(f"ERROR executing statement\n{stmt}")
+                raise e
+            return self.curr.rowcount
+        else:
+            return stmt
+
+    def fetch_iter(self, stmt:str, columns:list[str], params=None, size=FETCH_SIZE):
+        """
+        Execute a SELECT statement and yield the results as dictionaries, fetching 'size' rows at a time.
+        Uses its own cursor so other statements can be executed while iterating.  Yields nothing in dryrun.
+
+        Args:
+            stmt (str): The SELECT statement to execute.
+            columns (list): A list of column names.
+            params (Any): Optional bound parameters.
+            size (int): Number of rows to fetch at a time.
+        """
+        if self.dryrun:
+            if self.debug:
+                print(f"DEBUG would select:\n{stmt}")
+            return
+        curr = self.conn.cursor()
+        try:
+            try:
+                if params is None:
+                    curr.execute(stmt)
+                else:
+                    curr.execute(stmt, params)
+            except Exception as e:
+                print(f"ERROR executing statement\n{stmt}")
+                raise e
+            while True:
+                rows = curr.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            curr.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Scope a write transaction, see transaction().  Does nothing in dryrun.
+        """
+        if self.dryrun:
+            yield self
+            return
+        with transaction(self.conn):
+            yield self
+
+    def attach(self, db_filename:str, schema:str):
+        """
+        Attach another database file to this connection as 'schema' so a single statement can join across both.
+        The file must exist, sqlite would otherwise create an empty database for it.  Detached on close.
+        """
+        if self.dryrun:
+            return
+        if not os.path.isfile(db_filename):
+            raise Exception(f"database file '{db_filename}' does not exist")
+        self.execute(f"ATTACH DATABASE ? AS {schema};", (db_filename,))
+
+    def detach(self, schema:str):
+        if self.dryrun:
+            return
+        self.execute(f"DETACH DATABASE {schema};")
+
     def commit(self):
         if self.conn:
             self.conn.commit()
@@ -131,6 +351,33 @@ class Database():
             set_stmts.append(f"{key}='{value}'")
         return f"{','.join(set_stmts)}"
 
+    def _param(self, value):
+        """
+        Bound parameter for a value, stored the same as _make_value would (None is an empty string).
+        """
+        if value is None:
+            return ""
+        return value
+
+    def _where_params(self, where: dict[str, str]):
+        """
+        For where clause with bound parameters, see _make_where.  None matches an empty string, the same as _param
+        stores it, so rows written with a None value are found with the same dict.
+
+        Returns:
+            tuple: (where clause with placeholders, list of parameters)
+        """
+        clauses = []
+        params = []
+        for key in where.keys():
+            value = self._param(where[key])
+            if type(value) is str and "%" in value:
+                clauses.append((key, "like"))
+            else:
+                clauses.append((key, "="))
+            params.append(value)
+        return _where_sql(tuple(clauses)), params
+
     def select_stmt(self, columns: list[str], table: str, where: dict[str, str]):
         """
         Generate a SELECT statement.
@@ -145,18 +392,19 @@ class Database():
         """
         return f"select {','.join(columns)} from {table} where {self._make_where(where)};"
 
-    def select(self, stmt: str, columns: list[str]) -> list[dict]:
+    def select(self, stmt: str, columns: list[str], params=None) -> list[dict]:
         """
         Execute a SELECT statement and return the results as a list of dictionaries.
 
         Args:
             stmt (str): The SELECT statement to execute.
             columns (list): A list of column names.
+            params (Any): Optional bound parameters.
 
         Returns:
             list: A list of dictionaries representing the query results.
         """
-        rows = self.execute(stmt)
+        rows = self.execute(stmt, params)
         if self.dryrun:
             # simply return the raw response, which will be the generated statement
             return rows
@@ -169,6 +417,42 @@ class Database():
                 output.append(f)
         return output
 
+    def select_readonly(self, stmt: str, columns: list[str], params=None) -> list[dict]:
+        """
+        Execute a SELECT statement on a separate read-only connection and return the results as a list of dictionaries.
+        Works in dryrun, so a dryrun can report what would change without locking or creating the database.
+        Returns an empty list if the database file does not exist.
+        """
+        if not os.path.exists(self.db_filename):
+            return []
+        conn = connect(f"{Path(os.path.abspath(self.db_filename)).as_uri()}?mode=ro", self.pragmas, uri=True)
+        try:
+            if params is None:
+                rows = conn.execute(stmt).fetchall()
+            else:
+                rows = conn.execute(stmt, params).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def select_where(self, columns: list[str], table: str, where: dict[str, str]) -> list[dict]:
+        """
+        Execute a SELECT with bound parameters and return the results as a list of dictionaries.
+        In dryrun the statement from select_stmt is returned.
+
+        Args:
+            columns (list): A list of column names to select.
+            table (str): The table name.
+            where (dict): A dictionary of key-value pairs for the WHERE clause.
+
+        Returns:
+            list: A list of dictionaries representing the query results.
+        """
+        if self.dryrun:
+            return self.select(self.select_stmt(columns, table, where), columns)
+        where_sql, params = self._where_params(where)
+        return self.select(f"select {','.join(columns)} from {table} where {where_sql};", columns, params)
+
     def insert_stmt(self, table: str, values: dict[str, str], ignoreErrors=False):
         """
         Generate an INSERT statement.
@@ -198,7 +482,30 @@ class Database():
         Returns:
             Any: The result of the INSERT operation.
         """
-        return self.execute(self.insert_stmt(table, values, ignoreErrors))
+        if self.dryrun:
+            return self.execute(self.insert_stmt(table, values, ignoreErrors))
+        return self.execute(
+            _insert_sql(table, tuple(values.keys()), ignoreErrors),
+            [self._param(v) for v in values.values()],
+        )
+
+    def insert_many(self, table: str, columns: list[str], rows: list, ignoreErrors=False):
+        """
+        Execute an INSERT for each row.
+
+        Args:
+            table (str): The table name.
+            columns (list): A list of column names.
+            rows (list): A list of value sequences, in the order of columns.
+            ignoreErrors (bool): Whether to ignore errors during insertion.
+
+        Returns:
+            Any: The result of the INSERT operation.
+        """
+        return self.executemany(
+            _insert_sql(table, tuple(columns), ignoreErrors),
+            [[self._param(v) for v in row] for row in rows],
+        )
 
     def upsert_stmt(self, table: str, insert_values: dict[str, str], update_values: dict[str, str], conflictColumns: list[str]):
         """
@@ -228,7 +535,12 @@ class Database():
         Returns:
             Any: The result of the UPSERT operation.
         """
-        return self.execute(self.upsert_stmt(table, insert_values, update_values, conflictColumns))
+        if self.dryrun:
+            return self.execute(self.upsert_stmt(table, insert_values, update_values, conflictColumns))
+        return self.execute(
+            _upsert_sql(table, tuple(insert_values.keys()), tuple(update_values.keys()), tuple(conflictColumns)),
+            [self._param(v) for v in insert_values.values()] + [self._param(v) for v in update_values.values()],
+        )
     
     def delete(self, table: str, where: dict[str, str]):
         """
@@ -241,8 +553,11 @@ class Database():
         Returns:
             Any: The result of the DELETE operation.
         """
-        stmt = f"delete from {table} where {self._make_where(where)};"
-        return self.execute(stmt)
+        if self.dryrun:
+            stmt = f"delete from {table} where {self._make_where(where)};"
+            return self.execute(stmt)
+        where_sql, params = self._where_params(where)
+        return self.execute(f"delete from {table} where {where_sql};", params)
 
     def normalize_str(self, value):
         if type(value) is not str:
@@ -306,6 +621,23 @@ class Astrophotgraphy(Database):
                                     last_updated_date DATETIME DEFAULT CURRENT_TIMESTAMP
                                 );""",
         "CREATE UNIQUE INDEX IF NOT EXISTS filter1 ON filter(name);",
+        """CREATE TABLE IF NOT EXISTS directory (
+                                    id integer PRIMARY KEY,
+                                    parent_id integer,
+                                    path text NOT NULL,
+                                    rig text,
+                                    stage text,
+                                    target text,
+                                    panel text,
+                                    date text,
+                                    creation_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                    last_updated_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                    FOREIGN KEY (parent_id) REFERENCES directory (id)
+                                );""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS directory1 ON directory(path);",
+        "CREATE INDEX IF NOT EXISTS directory2 ON directory(stage);",
+        "CREATE INDEX IF NOT EXISTS directory3 ON directory(target);",
+        "CREATE INDEX IF NOT EXISTS directory4 ON directory(parent_id);",
         """CREATE TABLE IF NOT EXISTS accepted_data (
                                     id integer PRIMARY KEY,
                                     date text NOT NULL,
@@ -318,16 +650,26 @@ class Astrophotgraphy(Database):
                                     location_id integer NOT NULL,
                                     target_id integer NOT NULL,
                                     filter_id integer NOT NULL,
+                                    directory_id integer,
                                     creation_date DATETIME DEFAULT CURRENT_TIMESTAMP,
                                     last_updated_date DATETIME DEFAULT CURRENT_TIMESTAMP,
                                     FOREIGN KEY (camera_id) REFERENCES camera (id),
                                     FOREIGN KEY (optic_id) REFERENCES optic (id),
                                     FOREIGN KEY (target_id) REFERENCES target (id),
                                     FOREIGN KEY (filter_id) REFERENCES filter (id),
-                                    FOREIGN KEY (location_id) REFERENCES location (id)
+                                    FOREIGN KEY (location_id) REFERENCES location (id),
+                                    FOREIGN KEY (directory_id) REFERENCES directory (id)
                                 );""",
         "CREATE UNIQUE INDEX IF NOT EXISTS accepted_data1 ON accepted_data(camera_id,optic_id,location_id,target_id,filter_id,date,panel_name,shutter_time_seconds,raw_directory);",
         "CREATE UNIQUE INDEX IF NOT EXISTS accepted_data2 ON accepted_data(raw_directory);",
+        """CREATE TABLE IF NOT EXISTS summary (
+                                    id integer PRIMARY KEY,
+                                    directory text NOT NULL,
+                                    fingerprint text NOT NULL,
+                                    creation_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                    last_updated_date DATETIME DEFAULT CURRENT_TIMESTAMP
+                                );""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS summary1 ON summary(directory);",
     ]
 
     defaultLocations = [
@@ -370,13 +712,53 @@ class Astrophotgraphy(Database):
     def CreateSchema(self):
         for stmt in self.createSchema:
             self.execute(stmt)
+        self.UpgradeSchema()
 
-    def CreateProfileStmts(self, profile_dir:str) -> list[str]:
+    def UpgradeSchema(self):
         """
-        Generate the statements to create profile data for all profiles in the given directory.
-        Statements must be executed seperately.
+        Brings a database created with an older schema up to date.  Safe to run any number of times.
+        Adds accepted_data.directory_id and fills in the directory table for existing accepted_data.
         """
-        output_stmts = []
+        if self.dryrun:
+            return
+        with self.transaction():
+            for stmt in self.createSchema:
+                self.execute(stmt)
+            columns = [row[1] for row in self.execute("PRAGMA table_info(accepted_data);")]
+            if "directory_id" not in columns:
+                self.execute("ALTER TABLE accepted_data ADD COLUMN directory_id integer REFERENCES directory (id);")
+            self.execute("CREATE INDEX IF NOT EXISTS accepted_data3 ON accepted_data(directory_id);")
+
+            rows = self.execute("select id, raw_directory from accepted_data where directory_id is null and raw_directory is not null;")
+            if len(rows) > 0:
+                directory_ids = self._directory_ids(set(row[1] for row in rows))
+                self.executemany(
+                    "update accepted_data set directory_id=? where id=?;",
+                    [(directory_ids[row[1]], row[0]) for row in rows],
+                )
+
+    def NeedsUpgrade(self) -> bool:
+        """
+        Returns True if the database was created with an older schema, see UpgradeSchema.  Only reads the schema so
+        read-only callers (report.py) can check without upgrading.  Always False in dryrun.
+        """
+        if self.dryrun:
+            return False
+        columns = [row[1] for row in self.execute("PRAGMA table_info(accepted_data);")]
+        return "directory_id" not in columns
+
+    def _read_profiles(self, profile_dir:str, cache=None) -> list[dict]:
+        """
+        Reads all NINA profiles in the given directory.
+
+        Args:
+            profile_dir (str): The NINA profiles directory.
+            cache (FileCache): Optional cache of parsed profiles, only changed profile files are parsed.
+
+        Returns:
+            list: dict with id, name, filter_names, optic, focal_ratio and camera for each profile.
+        """
+        output = []
         filenames = []
         for root, _, f_names in os.walk(profile_dir):
             for f in f_names:
@@ -384,102 +766,318 @@ class Astrophotgraphy(Database):
                     continue
                 filenames.append(f"{root}{os.sep}{f}")
         for filename in filenames:
-            with open(filename, "r") as fd:
-                try:
-                    xml_dump = json.dumps(xmltodict.parse(fd.read()), indent=4)
-                    xml_data = yaml.safe_load(xml_dump)
-                    profile_id = xml_data["Profile"]["Id"]
-                    profile_name = xml_data["Profile"]["Name"]
-
-                    # write profile as json file for debugging
-                    #with open(f"C:\Users\jewza\Dropbox\Family Room\Astrophotography\Data\profile-{profile_name}.json", "w") as f:
-                    #    f.write(xml_dump)
-
-                    # find all filters
-                    filters = []
-                    if "FilterWheelSettings" in xml_data["Profile"] and "FilterWheelFilters" in xml_data["Profile"]["FilterWheelSettings"] and "a:FilterInfo" in xml_data["Profile"]["FilterWheelSettings"]["FilterWheelFilters"]:
-                        # if there is only one filter it  will not be an array. annoying..
-                        infos = xml_data["Profile"]["FilterWheelSettings"]["FilterWheelFilters"]["a:FilterInfo"]
-                        if type(infos) is not list:
-                            infos = [infos]
-
-                        for info in infos:
-                            f = common.normalize_filterName(info['a:_name'])
-                            # skip any "DARK" filter
-                            if f.startswith("DARK"):
-                                continue
-                            # skip any "BLANK" filter
-                            if f.startswith("BLANK"):
-                                continue
-                            if f not in self.defaultFilters:
-                                print(f"WARNING found unknown filter '{f}' in profile '{profile_name}'")
-                            filters.append(f)
-
-                    # special handling for filter names, order is priority.
-                    filter_names=",".join(filters)
-                    if filter_names == "L,R,G,B,S,H,O":
-                        # want to prioritize O over S and S over H
-                        filter_names="L,R,G,B,O,S,H"
-
-                    # profile names are following a standard now... <optic>@<f-ratio>+<camera>
-                    m = re.match("([^@]*)@f([^+]*)[+](.*)", profile_name)
-                    print(f"DEBUG: {profile_name}")
-                    if m is not None and m.groups() is not None and len(m.groups()) == 3:
-                        optic = m.groups()[0]
-                        focal_ratio = m.groups()[1]
-                        camera = m.groups()[2]
-                        print(f"DEBUG: {optic}, {focal_ratio}, {camera}")
-                        # insert optic (have to insert for lookup)
-                        self.execute(self.insert_stmt("optic", {"name": optic, "focal_ratio": focal_ratio}, ignoreErrors=True))
-                        # insert camera (have to insert for lookup)
-                        self.execute(self.insert_stmt("camera", {"name": camera}, ignoreErrors=True))
-                        # insert profile, allow for only "filter_names" to be updated
-                        output_stmts.append(
-                            self.upsert_stmt(
-                                table="profile",
-                                insert_values={
-                                    "id": profile_id,
-                                    "name": profile_name,
-                                    "filter_names": filter_names,
-                                    "optic_id": self.select(self.select_stmt(['id'], "optic", {"name": optic, "focal_ratio": focal_ratio}), ['id'])[0]['id'],
-                                    "camera_id": self.select(self.select_stmt(['id'], "camera", {"name": camera}), ['id'])[0]['id'],
-                                },
-                                update_values={
-                                    "name": profile_name,
-                                    "filter_names": filter_names,
-                                    "optic_id": self.select(self.select_stmt(['id'], "optic", {"name": optic, "focal_ratio": focal_ratio}), ['id'])[0]['id'],
-                                    "camera_id": self.select(self.select_stmt(['id'], "camera", {"name": camera}), ['id'])[0]['id'],
-                                },
-                                conflictColumns=["id"],
-                            )
-                        )
-                except Exception as e:
-                    print(f"error processing '{filename}")
-                    raise e
-        return output_stmts
+            try:
+                profile = None
+                if cache is not None:
+                    profile = cache.get(filename)
+                if profile is None:
+                    profile = read_profile(filename)
+                    if cache is not None:
+                        cache.put(filename, profile)
+            except Exception as e:
+                print(f"error processing '{filename}")
+                raise e
+
+            profile_name = profile["name"]
+
+            # find all filters
+            filters = []
+            for name in profile["filters"]:
+                f = common.normalize_filterName(name)
+                # skip any "DARK" filter
+                if f.startswith("DARK"):
+                    continue
+                # skip any "BLANK" filter
+                if f.startswith("BLANK"):
+                    continue
+                if f not in self.defaultFilters:
+                    print(f"WARNING found unknown filter '{f}' in profile '{profile_name}'")
+                filters.append(f)
+
+            # special handling for filter names, order is priority.
+            filter_names=",".join(filters)
+            if filter_names == "L,R,G,B,S,H,O":
+                # want to prioritize O over S and S over H
+                filter_names="L,R,G,B,O,S,H"
+
+            # profile names are following a standard now... <optic>@<f-ratio>+<camera>
+            m = re.match("([^@]*)@f([^+]*)[+](.*)", profile_name)
+            if self.debug:
+                print(f"DEBUG: {profile_name}")
+            if m is not None and m.groups() is not None and len(m.groups()) == 3:
+                optic = m.groups()[0]
+                focal_ratio = m.groups()[1]
+                camera = m.groups()[2]
+                if self.debug:
+                    print(f"DEBUG: {optic}, {focal_ratio}, {camera}")
+                output.append({
+                    "id": profile["id"],
+                    "name": profile_name,
+                    "filter_names": filter_names,
+                    "optic": optic,
+                    "focal_ratio": focal_ratio,
+                    "camera": camera,
+                })
+        return output
+
+    def CreateProfiles(self, profile_dir:str, cache=None):
+        """
+        Creates or updates profile data for all profiles in the given directory, with the optics and cameras they use.
+
+        Args:
+            profile_dir (str): The NINA profiles directory.
+            cache (FileCache): Optional cache of parsed profiles, see _read_profiles.
+        """
+        profiles = self._read_profiles(profile_dir, cache)
+        with self.transaction():
+            # optic and camera rows have to exist to get their ids
+            self.insert_many("optic", ["name", "focal_ratio"], sorted(set((p["optic"], p["focal_ratio"]) for p in profiles)), ignoreErrors=True)
+            self.insert_many("camera", ["name"], sorted(set((p["camera"],) for p in profiles)), ignoreErrors=True)
+            optic_ids = self._id_map("optic", ["name", "focal_ratio"])
+            camera_ids = self._id_map("camera", ["name"])
+
+            # insert profile, allow for everything but the id to be updated
+            rows = []
+            for p in profiles:
+                values = [p["name"], p["filter_names"], optic_ids[(p["optic"], p["focal_ratio"])], camera_ids[(p["camera"],)]]
+                rows.append([p["id"]] + values + values)
+            self.executemany(
+                _upsert_sql("profile", ("id", "name", "filter_names", "optic_id", "camera_id"), ("name", "filter_names", "optic_id", "camera_id"), ("id",)),
+                rows,
+            )
 
     def CreateFilters(self):
         for f in self.defaultFilters.keys():
             astrobin_id = self.defaultFilters[f]['astrobin_id']
             self.execute(
-                f"""INSERT INTO filter (name,astrobin_id)
-                    values (
-                        '{f}',
-                        '{astrobin_id}'
-                    )
+                """INSERT INTO filter (name,astrobin_id)
+                    values (?, ?)
                     ON CONFLICT (name)
                     DO UPDATE SET
                     last_updated_date = CURRENT_TIMESTAMP,
-                    astrobin_id = '{astrobin_id}'
-                    ;"""
+                    astrobin_id = excluded.astrobin_id
+                    ;""",
+                (f, astrobin_id),
+            )
+
+
+    # reference tables accepted_data points at: table -> (columns, accepted data keys)
+    referenceTables = {
+        "camera": (['name'], ['camera']),
+        "optic": (['name', 'focal_ratio'], ['optic', 'focal_ratio']),
+        "location": (['latitude', 'longitude'], ['latitude', 'longitude']),
+        "target": (['name'], ['targetname']),
+        "filter": (['name'], ['filter']),
+    }
+
+    def _upsert_directories(self, paths: list, parent_ids: dict) -> dict:
+        """
+        Creates or updates directory rows for the paths.  Returns path -> id.
+        """
+        rows = []
+        for path in paths:
+            parts = common.get_directory_parts(path)
+            rows.append((path, parent_ids.get(parts["target_directory"]), parts["rig"], parts["stage"], parts["target"], parts["panel"], parts["date"]))
+        self.executemany(
+            """INSERT INTO directory (path, parent_id, rig, stage, target, panel, date)
+                VALUES (?,?,?,?,?,?,?)
+                ON CONFLICT (path)
+                DO UPDATE SET
+                parent_id = excluded.parent_id,
+                rig = excluded.rig,
+                stage = excluded.stage,
+                target = excluded.target,
+                panel = excluded.panel,
+                date = excluded.date,
+                last_updated_date = CURRENT_TIMESTAMP
+                ;""",
+            rows,
+        )
+        output = {}
+        for batch in common.batched(paths, IN_BATCH_SIZE):
+            for row in self.execute(f"select id, path from directory where path in ({','.join(['?'] * len(batch))});", batch):
+                output[row[1]] = row[0]
+        return output
+
+    def _directory_ids(self, paths: set) -> dict:
+        """
+        Creates or updates the directory rows for the paths and their target directory (the parent of 'accept').
+
+        Returns:
+            dict: path -> directory id for the given paths.
+        """
+        paths = sorted(set(paths))
+        parents = set()
+        for path in paths:
+            target_directory = common.get_directory_parts(path)["target_directory"]
+            if target_directory is not None:
+                parents.add(target_directory)
+        parent_ids = self._upsert_directories(sorted(parents - set(paths)), {})
+        return self._upsert_directories(paths, parent_ids)
+
+    def _reference_value(self, value):
+        # same as insert(): None is stored as an empty string
+        if value is None:
+            return ""
+        return str(value)
+
+    def _id_map(self, table:str, columns:list[str]) -> dict:
+        """
+        Returns a dictionary of tuple of column values -> id for all rows in the table.
+        """
+        output = {}
+        for row in self.execute(f"select id,{','.join(columns)} from {table};"):
+            output[tuple(row[1:])] = row[0]
+        return output
+
+    def WriteAcceptedData(self, accepted_data:list[dict]):
+        """
+        Bulk write aggregated accepted data in one transaction.
+        Missing reference data (camera, optic, location, target, filter) is inserted first, then every accepted_data row
+        is upserted on raw_directory with the ids looked up from in-memory maps.
+
+        Args:
+            accepted_data (list): dictionaries with date, optic, focal_ratio, filter, camera, targetname, panel, latitude,
+                                  longitude, exposureseconds, directory and count.
+        """
+        with self.transaction():
+            self._write_accepted_data(accepted_data)
+
+    def _write_accepted_data(self, accepted_data:list[dict]):
+        ids = {}
+        for table in self.referenceTables.keys():
+            columns, keys = self.referenceTables[table]
+            ids[table] = self._id_map(table, columns)
+            missing = {}
+            for datum in accepted_data:
+                key = tuple(self._reference_value(datum[k]) for k in keys)
+                if key not in ids[table]:
+                    missing[key] = None
+            if len(missing) > 0:
+                # assume there is a unique key constraint for OR IGNORE to work
+                self.insert_many(table=table, columns=columns, rows=list(missing.keys()), ignoreErrors=True)
+                ids[table] = self._id_map(table, columns)
+
+        directory_ids = self._directory_ids(set(str(datum['directory']) for datum in accepted_data))
+
+        rows = []
+        for datum in accepted_data:
+            row = [
+                str(datum['date']),
+                str(datum['exposureseconds']),
+                datum['count'],
+                str(datum['panel']),
+                str(datum['directory']),
+            ]
+            for table in self.referenceTables.keys():
+                _, keys = self.referenceTables[table]
+                # None if still missing, accepted_data will reject it
+                row.append(ids[table].get(tuple(self._reference_value(datum[k]) for k in keys)))
+            row.append(directory_ids[str(datum['directory'])])
+            rows.append(row)
+
+        # insert accepted data, update accepted_count if it already exists.  rows that did not change are left alone so
+        # last_updated_date only moves when the data does (summary.py fingerprints on it)
+        self.executemany(
+            """INSERT INTO accepted_data(date, shutter_time_seconds, accepted_count, panel_name, raw_directory,
+                camera_id, optic_id, location_id, target_id, filter_id, directory_id)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?)
+                ON CONFLICT (raw_directory)
+                DO UPDATE SET
+                last_updated_date = CURRENT_TIMESTAMP,
+                accepted_count = excluded.accepted_count,
+                directory_id = excluded.directory_id
+                WHERE accepted_count IS NOT excluded.accepted_count
+                OR directory_id IS NOT excluded.directory_id
+                ;""",
+            rows,
+        )
+
+    def _delete_unused_directories(self):
+        """
+        Deletes directory rows no accepted_data references, then parents left without children.
+        """
+        self.execute("""delete from directory
+            where parent_id is not null
+            and id not in (select directory_id from accepted_data where directory_id is not null);""")
+        self.execute("""delete from directory
+            where parent_id is null
+            and id not in (select parent_id from directory where parent_id is not null)
+            and id not in (select directory_id from accepted_data where directory_id is not null);""")
+
+    def GetSummaryFingerprints(self, directories:list) -> dict:
+        """
+        Returns target directory -> fingerprint of the summary files last written there, see summary.py.
+        Directories without summary files are not in the output.
+        In dryrun the database is read from a read-only connection and a database without the summary table (see
+        UpgradeSchema) has no fingerprints.
+        """
+        select = self.select
+        if self.dryrun:
+            select = self.select_readonly
+            if len(select("select name from sqlite_master where type='table' and name='summary';", ["name"])) == 0:
+                return {}
+        output = {}
+        for batch in common.batched(directories, IN_BATCH_SIZE):
+            for row in select(f"select directory, fingerprint from summary where directory in ({','.join(['?'] * len(batch))});", ["directory", "fingerprint"], batch):
+                output[row["directory"]] = row["fingerprint"]
+        return output
+
+    def WriteSummaryFingerprints(self, fingerprints:dict):
+        """
+        Stores target directory -> fingerprint of the summary files written there.
+        """
+        with self.transaction():
+            self.executemany(
+                _upsert_sql("summary", ("directory", "fingerprint"), ("fingerprint",), ("directory",)),
+                [(directory, fingerprint, fingerprint) for directory, fingerprint in fingerprints.items()],
             )
 
+    def _select_raw_directories(self, from_dir:str) -> list[dict]:
+        """
+        Returns id and raw_directory for all accepted_data under from_dir.
+        In dryrun the database is read from a read-only connection so the dryrun can report what would change.
+        """
+        columns = ['id', 'raw_directory']
+        stmt = "select id, raw_directory from accepted_data where raw_directory >= ? and raw_directory < ?;"
+        if not self.dryrun:
+            return self.select(stmt, columns, prefix_range(from_dir))
+        return self.select_readonly(stmt, columns, prefix_range(from_dir))
 
-    def UpdateFromDirectory(self, from_dir:str, modeDelete, modeCreate, modeUpdate):
+    def _missing_directories(self, from_dir:str, directories:set) -> set:
+        """
+        Returns the directories that no accepted_data raw_directory starts with.
+        Every raw_directory under from_dir is loaded once (a range scan on the raw_directory index), sorted so each
+        directory is a set lookup or a binary search.
+
+        Args:
+            from_dir (str): The root all directories are under.
+            directories (set): Directories found on disk.
+
+        Returns:
+            set: The directories missing from the database.
+        """
+        rows = self.select(
+            "select raw_directory from accepted_data where raw_directory >= ? and raw_directory < ?;",
+            ['raw_directory'],
+            prefix_range(from_dir),
+        )
+        raw_directories = sorted(r['raw_directory'] for r in rows if r['raw_directory'] is not None)
+
+        missing = set()
+        for directory in set(directories) - set(raw_directories):
+            # a directory exists if any raw_directory starts with it
+            i = bisect.bisect_left(raw_directories, directory)
+            if i == len(raw_directories) or not raw_directories[i].startswith(directory):
+                missing.add(directory)
+        return missing
+
+    def UpdateFromDirectory(self, from_dir:str, modeDelete, modeCreate, modeUpdate, workers=0):
         """
         modeDelete - delete any accepted_data where the directory is missing (done first)
         modeCreate - create accepted_data where the directory doesn't exist in the database
         modeUpdate - create and/or update accepted_data
+        workers - number of threads used to read image headers, 0 to read serially
         """
 
         print("Modes enabled:")
@@ -491,6 +1089,9 @@ class Astrophotgraphy(Database):
             print("ERROR: at least one mode must be enabled.  Exiting!")
             return
 
+        # databases created before the directory table need it filled in
+        self.UpgradeSchema()
+
         deleted_count = 0
         accepted_count = 0
         total_count = 0
@@ -500,31 +1101,28 @@ class Astrophotgraphy(Database):
             print("Delete...")
 
             # get all raw_directories
-            c = ['id', 'raw_directory']
-            stmt = self.select_stmt(
-                columns=c,
-                table='accepted_data',
-                where={
-                    "raw_directory": f"{from_dir}%", # will add like statement...
-                },
-            )
-            data_dirs = self.select(
-                stmt=stmt,
-                columns=c,
+            data_dirs = self._select_raw_directories(from_dir)
+
+            # which directories are gone?  parents are checked first so nothing under a missing parent is checked
+            missing_dirs = common.find_missing_dirs(
+                dirs=[datum['raw_directory'] for datum in data_dirs if datum['raw_directory'] is not None],
+                root=from_dir,
+                workers=max(workers, common.DIRECTORY_CHECK_WORKERS),
             )
+            delete_ids = []
             for datum in data_dirs:
-                raw_dir = datum['raw_directory']
-                # does the directory exist?
-                if not os.path.isdir(raw_dir):
-                    # it does not! delete the accept_data
-                    if self.debug:
-                        print(f"    Deleting: {raw_dir}")
-                    if not self.dryrun:
-                        self.delete(
-                            table='accepted_data',
-                            where={"id": datum['id']},
-                        )
-                    deleted_count += 1
+                if datum['raw_directory'] in missing_dirs:
+                    # it does not exist! delete the accept_data
+                    if self.debug or self.dryrun:
+                        print(f"    {'Would delete' if self.dryrun else 'Deleting'}: {datum['raw_directory']}")
+                    delete_ids.append(datum['id'])
+            deleted_count = len(delete_ids)
+
+            if not self.dryrun:
+                with self.transaction():
+                    for ids in common.batched(delete_ids, IN_BATCH_SIZE):
+                        self.execute(f"delete from accepted_data where id in ({','.join(['?'] * len(ids))});", ids)
+                    self._delete_unused_directories()
 
         # support searching an array of directories
         from_dirs = [from_dir]
@@ -541,26 +1139,14 @@ class Astrophotgraphy(Database):
             )
 
             # walk through all accepted data and remove anything that already exists in the database
-            missing_dirs=set()
-            existing_dirs=set()
-            for filename in filenames:
-                directory = os.sep.join(filename.split(os.sep)[:-1])
-                if directory not in existing_dirs and directory not in missing_dirs:
-                    # look up the directory
-                    # cache in either missing_dirs or existing_dirs
-                    stmt = self.select_stmt(
-                        columns=['count(id)'],
-                        table="accepted_data",
-                        where={"raw_directory": f"{directory}%"}
-                    )
-                    exists = self.select(
-                        stmt=stmt,
-                        columns=['count']
-                    )
-                    if len(exists) == 1 and exists[0]['count'] == 0:
-                        missing_dirs.add(directory)
-                    else:
-                        existing_dirs.add(directory)
+            if self.dryrun:
+                # nothing to read in dryrun, treat everything as existing
+                missing_dirs = set()
+            else:
+                missing_dirs = self._missing_directories(
+                    from_dir=from_dir,
+                    directories=set(os.sep.join(filename.split(os.sep)[:-1]) for filename in filenames),
+                )
             # since this is createOnly, we'll only look at missing directories
             if self.debug:
                 for d in missing_dirs:
@@ -576,8 +1162,8 @@ class Astrophotgraphy(Database):
                                 'filter', 'camera', 'exposureseconds', 'latitude', 'longitude',
                                 'filename']
 
-            # fetch all lights metadata for cr2 and fits image files
-            data = common.get_filtered_metadata(
+            # stream all lights metadata for cr2 and fits image files, aggregate as it is read
+            data = common.iter_filtered_metadata(
                 dirs=from_dirs, 
                 patterns=[".*\.cr2$",".*\.fits$"], 
                 recursive=True, 
@@ -586,6 +1172,8 @@ class Astrophotgraphy(Database):
                 debug=self.debug,
                 printStatus=True,
                 profileFromPath=True,
+                workers=workers,
+                batch_size=common.METADATA_BATCH_SIZE,
             )
 
             # the data after manipulation and aggregation
@@ -594,54 +1182,44 @@ class Astrophotgraphy(Database):
             accepted_count = 0
             total_count = 0
 
+            # columns that identify one accepted_data row, besides directory
+            aggregate_columns = ["date", "optic", "focal_ratio", "filter", "camera", "targetname", "panel",
+                                 "latitude", "longitude", "exposureseconds"]
+
+            filename = None
             try:
-                for filename in data.keys():
+                for batch in common.batched(data, common.METADATA_BATCH_SIZE):
+                    filename = batch[-1]['filename']
+                    for datum_file in batch:
+                        if self.debug and common.DIRECTORY_ACCEPT in datum_file['filename']:
+                            print(f"datum_file={datum_file}")
+
+                        # some setups (Dwarf 3) don't have lat/long, default to first default location
+                        if 'latitude' not in datum_file or 'longitude' not in datum_file:
+                            datum_file['latitude'] = Astrophotgraphy.defaultLocations[0]['latitude']
+                            datum_file['longitude'] = Astrophotgraphy.defaultLocations[0]['longitude']
+
+                    table = metadatatable.MetadataTable.from_records(batch, columns=aggregate_columns + ['filename'])
                     # collect count of all files
-                    total_count += 1
+                    total_count += len(table)
 
                     # skip if not in an 'accept' directory
-                    if common.DIRECTORY_ACCEPT not in filename:
-                        #print(f"SKIP: {filename}\n")
-                        continue
-
+                    table = table.filter({"filename": lambda f: common.DIRECTORY_ACCEPT in f})
                     # collect count of accepted files
-                    accepted_count += 1
-
-                    directory = os.sep.join(filename.split(os.sep)[:-1])
-
-                    if self.debug:
-                        print(f"data[filename]={data[filename]}")
-
-                    # some setups (Dwarf 3) don't have lat/long, default to first default location
-                    if 'latitude' not in data[filename] or 'longitude' not in data[filename]:
-                        data[filename]['latitude'] = Astrophotgraphy.defaultLocations[0]['latitude']
-                        data[filename]['longitude'] = Astrophotgraphy.defaultLocations[0]['longitude']
-
-                    # extract bits needed for hash
-                    datum = {
-                        "date": data[filename]['date'],
-                        "optic": data[filename]['optic'],
-                        "focal_ratio": data[filename]['focal_ratio'],
-                        "filter": data[filename]['filter'],
-                        "camera": data[filename]['camera'],
-                        "targetname": data[filename]['targetname'],
-                        "panel": data[filename]['panel'],
-                        "latitude": data[filename]['latitude'],
-                        "longitude": data[filename]['longitude'],
-                        "exposureseconds": data[filename]['exposureseconds'],
-                        "directory": directory,
-                    }
-
-                    key = hash(json.dumps(datum, sort_keys=True))
-
-                    # have we already processed this accepted_data?
-                    if key in accepted_data:
-                        # yes, increment count
-                        accepted_data[key]["count"] += 1
-                    else:
-                        # no, set count to 1 and add to accepted_data
-                        datum["count"] = 1
-                        accepted_data[key] = datum
+                    accepted_count += len(table)
+
+                    table.add_column("directory", [os.sep.join(f.split(os.sep)[:-1]) for f in table.values("filename")])
+
+                    for datum in table.group_by(aggregate_columns + ["directory"]):
+                        key = tuple(datum[c] for c in aggregate_columns + ["directory"])
+
+                        # have we already processed this accepted_data?
+                        if key in accepted_data:
+                            # yes, increment count
+                            accepted_data[key]["count"] += datum["count"]
+                        else:
+                            # no, keep count and add to accepted_data
+                            accepted_data[key] = datum
 
             except KeyboardInterrupt as e:
                 print(f"User terminated!")
@@ -661,73 +1239,204 @@ class Astrophotgraphy(Database):
 
         if not self.dryrun:
             print("Updating database...")
-            for datum in accepted_data.values():
-                # create rows as needed.
-                # NOTE this is not optimized on purpose, it's always a relatively small data set so repetition on upsert reference data is fine
-                
-                # make sure reference data exists.  assume there is a unique key constraint for OR IGNORE to work
-                # NOTE use double quotes to wrap values, we'll replace double quotes with single quotes in metadata
-                self.insert(ignoreErrors=True, table="optic",
-                    values={
-                        "name": datum['optic'],
-                        "focal_ratio": datum['focal_ratio'],
-                    })
-                self.insert(ignoreErrors=True, table="camera",
-                    values={
-                        "name": datum['camera'],
-                    })
-                self.insert(ignoreErrors=True, table="location",
-                    values={
-                        "latitude": datum['latitude'],
-                        "longitude": datum['longitude'],
-                    })
-                self.insert(ignoreErrors=True, table="target",
-                    values={
-                        "name": datum['targetname'],
-                    })
-                self.insert(ignoreErrors=True, table="filter",
-                    values={
-                        "name": datum['filter'],
-                    })
-
-                # insert accepted data, update accepted_count if it already exists
-                insert_stmt=f"""
-                    INSERT INTO accepted_data(date, shutter_time_seconds, accepted_count, panel_name, raw_directory,
-                    camera_id, optic_id, location_id, target_id, filter_id)
-                    VALUES (\"{datum['date']}\", \"{datum['exposureseconds']}\", \"{datum['count']}\", \"{datum['panel']}\", \"{datum['directory']}\",
-                    (select id from camera where name=\"{datum['camera']}\"),
-                    (select id from optic where name=\"{datum['optic']}\" and focal_ratio=\"{datum['focal_ratio']}\"),
-                    (select id from location where latitude=\"{datum['latitude']}\" and longitude=\"{datum['longitude']}\"),
-                    (select id from target where name=\"{datum['targetname']}\"),
-                    (select id from filter where name=\"{datum['filter']}\")
-                    )
-                    ON CONFLICT (raw_directory) 
-                    DO UPDATE SET 
-                    last_updated_date = CURRENT_TIMESTAMP,
-                    accepted_count = \"{datum['count']}\" 
-                    ;"""
-                self.execute(insert_stmt)
+            self.WriteAcceptedData(list(accepted_data.values()))
         else:
             print("DRYRUN: not(Updating database)")
 
 class Scheduler(Database):
+    pragmas = PRAGMAS_SCHEDULER
+
     def GetDesiredHours(self, profile_id:str, targetname:str) -> float:
         output = {}
 
-        select_stmt = f"""
+        select_stmt = """
             select et.defaultexposure, ep.desired, et.name
             from exposuretemplate et, exposureplan ep, target t
             where et.id=ep.exposuretemplateid
             and ep.targetid=t.id
-            and t.name='{self.normalize_str(targetname)}'
-            and et.profileid='{profile_id}'
+            and t.name=?
+            and et.profileid=?
             order by et.name
             ;"""
         data = self.select(
             stmt=select_stmt,
-            columns=['defaultexposure', 'desired', 'filtername']
+            columns=['defaultexposure', 'desired', 'filtername'],
+            params=(targetname, profile_id),
         )
         for datum in data:
             output[datum['filtername']] = datum['defaultexposure'] * datum['desired'] / 60 / 60
 
-        return output
\ No newline at end of file
+        return output
+
+    def GetDesiredHoursByTarget(self, targets:list) -> dict:
+        """
+        Desired hours by filter for many targets at once, see GetDesiredHours.
+
+        Args:
+            targets (list): (profile id, target name) tuples.
+
+        Returns:
+            dict: (profile id, target name) -> {filter name: desired hours}, an empty dict for targets without plans.
+        """
+        output = {}
+        for key in targets:
+            output[(key[0], key[1])] = {}
+        profile_ids = sorted(set(key[0] for key in output.keys()))
+        for names in common.batched(sorted(set(key[1] for key in output.keys())), IN_BATCH_SIZE):
+            select_stmt = f"""
+                select et.profileid, t.name, et.defaultexposure, ep.desired, et.name
+                from exposuretemplate et, exposureplan ep, target t
+                where et.id=ep.exposuretemplateid
+                and ep.targetid=t.id
+                and t.name in ({','.join(['?'] * len(names))})
+                and et.profileid in ({','.join(['?'] * len(profile_ids))})
+                order by et.profileid, t.name, et.name
+                ;"""
+            data = self.fetch_iter(
+                stmt=select_stmt,
+                columns=['profile_id', 'targetname', 'defaultexposure', 'desired', 'filtername'],
+                params=list(names) + profile_ids,
+            )
+            for datum in data:
+                key = (datum['profile_id'], datum['targetname'])
+                if key in output:
+                    output[key][datum['filtername']] = datum['defaultexposure'] * datum['desired'] / 60 / 60
+
+        return output
+
+    def _split_panel(self, targetname:str) -> list:
+        """
+        Splits "<target> Panel <panel>" into [target, panel], panel is "" if there isn't one.
+        """
+        m = re.match("(.*) Panel (.*)", targetname)
+        if m is not None and m.groups() is not None and len(m.groups()) == 2:
+            return [m.groups()[0], m.groups()[1]]
+        return [targetname, ""]
+
+    def GetAcceptedChanges(self, db_ap_filename:str):
+        """
+        Compares the accepted counts and project states in the scheduler with the astrophotography database.
+        Everything is computed in one grouped query with the astrophotography database attached.
+
+        Accepted count is the sum of accepted frames for the exposure plan's rig, target, panel, filter and exposure.  If
+        it is short of desired but within MASTER_READY_PERCENT it is set to 2x desired so the scheduler doesn't collect
+        single subs for channels that have enough data.
+        Project state is the highest state (see common.project_status_from_path) of the directories with data for the
+        target, unchanged if there is no data.
+
+        Args:
+            db_ap_filename (str): The astrophotography database.
+
+        Returns:
+            tuple: (exposure plan changes, project changes), both lists of dicts with the id, names, "old" and "new" value.
+        """
+        self.conn.create_function("target_name", 1, lambda n: self._split_panel(n)[0], deterministic=True)
+        self.conn.create_function("panel_name", 1, lambda n: self._split_panel(n)[1], deterministic=True)
+        self.conn.create_function("project_status", 1, common.project_status_from_path, deterministic=True)
+
+        stmt = """
+            with plan as (
+                select ep.id, ep.profileid, t.name as name, target_name(t.name) as targetname, panel_name(t.name) as panelname,
+                et.name as filtername, ep.accepted, ep.desired,
+                case when ep.exposure > 0 then ep.exposure else et.defaultexposure end as exposure,
+                p.state, p.id as project_id, p.name as project_name
+                from exposuretemplate et, exposureplan ep, target t, project p
+                where ep.profileid=et.profileid
+                and ep.profileid=p.profileid
+                and ep.targetid=t.id
+                and ep.exposuretemplateid=et.id
+                and t.projectid=p.id
+            ),
+            accepted as (
+                select p.id as profileid, t.name as targetname, a.panel_name as panelname, f.name as filtername,
+                a.shutter_time_seconds as exposure, sum(a.accepted_count) as accepted_count
+                from astrophotography.accepted_data a, astrophotography.target t, astrophotography.filter f, astrophotography.profile p
+                where a.target_id=t.id
+                and a.filter_id=f.id
+                and a.camera_id=p.camera_id
+                and a.optic_id=p.optic_id
+                group by p.id, t.name, a.panel_name, f.name, a.shutter_time_seconds
+            ),
+            status as (
+                select p.id as profileid, t.name as targetname, a.panel_name as panelname, max(project_status(a.raw_directory)) as state
+                from astrophotography.accepted_data a, astrophotography.target t, astrophotography.profile p
+                where a.target_id=t.id
+                and a.camera_id=p.camera_id
+                and a.optic_id=p.optic_id
+                and a.raw_directory is not null
+                group by p.id, t.name, a.panel_name
+            )
+            select plan.id, plan.profileid, plan.targetname, plan.panelname, plan.filtername, plan.accepted, plan.desired,
+            plan.state, plan.project_id, plan.project_name,
+            accepted.accepted_count, status.state
+            from plan
+            left join accepted
+                on accepted.profileid=plan.profileid
+                and accepted.targetname=plan.targetname
+                and accepted.panelname=plan.panelname
+                and accepted.filtername=plan.filtername
+                and accepted.exposure=plan.exposure
+            left join status
+                on status.profileid=plan.profileid
+                and status.targetname=plan.targetname
+                and status.panelname=plan.panelname
+            ;"""
+        self.attach(db_ap_filename, "astrophotography")
+        try:
+            rows = self.select(
+                stmt=stmt,
+                columns=['id', 'profileid', 'targetname', 'panelname', 'filtername', 'accepted', 'desired',
+                         'state', 'project_id', 'project_name', 'new_accepted', 'new_state'],
+            )
+        finally:
+            self.detach("astrophotography")
+
+        plan_changes = []
+        project_changes = {}
+        for row in rows:
+            new_accepted = row['new_accepted']
+            if new_accepted is None:
+                new_accepted = 0
+            desired = row['desired']
+            if new_accepted < desired and new_accepted/desired > common.MASTER_READY_PERCENT:
+                # 2x desired so any % over 100% in scheduler does _not_ kick in anymore
+                new_accepted = desired*2
+
+            if self.debug:
+                print(f"DEBUG: {row['profileid']} | {row['targetname']} | {row['filtername']} | {row['panelname']} --> {new_accepted} (was {row['accepted']})")
+
+            if new_accepted != row['accepted']:
+                plan_changes.append({
+                    "id": row['id'],
+                    "targetname": row['targetname'],
+                    "panelname": row['panelname'],
+                    "filtername": row['filtername'],
+                    "old": row['accepted'],
+                    "new": new_accepted,
+                })
+
+            # projects with targets in more than one state get the state of the last one
+            if row['new_state'] is not None and row['new_state'] != row['state']:
+                project_changes[row['project_id']] = {
+                    "id": row['project_id'],
+                    "name": row['project_name'],
+                    "targetname": row['targetname'],
+                    "old": row['state'],
+                    "new": row['new_state'],
+                }
+
+        return plan_changes, list(project_changes.values())
+
+    def WriteAcceptedChanges(self, plan_changes:list, project_changes:list):
+        """
+        Applies the changes from GetAcceptedChanges in a single transaction.
+        """
+        with self.transaction():
+            self.executemany(
+                "update exposureplan set accepted=?, acquired=? where id=?;",
+                [(c["new"], c["new"], c["id"]) for c in plan_changes],
+            )
+            self.executemany(
+                "update project set state=? where id=?;",
+                [(c["new"], c["id"]) for c in project_changes],
+            )
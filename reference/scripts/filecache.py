@@ -0,0 +1,213 @@
+"""
+This module provides a small SQLite-backed cache for data parsed out of files.
+Entries are keyed by the full path of the file and are only valid while the file's size and
+modification time (in nanoseconds) are unchanged.  The cache is capped in size and evicts the
+least recently used entries when it grows beyond the cap.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+from pathlib import Path
+
+
+class FileCache():
+    # bump when the layout of the cache table or the cached values changes, forces a rebuild
+    SCHEMA_VERSION = 1
+    # several caches (tables) can share one file, the schema version of each table is kept here
+    VERSION_TABLE = "cache_version"
+
+    db_filename = ""
+    table = ""
+    max_entries = 0
+    commitInterval = 0
+    conn = None
+    pending = 0
+    hits = 0
+    misses = 0
+    debug = False
+
+    def __init__(self, db_filename:str, table="headers", max_entries=500000, commitInterval=1000, debug=False):
+        """
+        Initializes the cache.  Nothing is opened until open() is called.
+
+        Args:
+            db_filename (str): Path to the SQLite file backing the cache.  Use ":memory:" for a throw-away cache.
+            table (str): Name of the table holding cached entries.
+            max_entries (int): Maximum number of entries kept after a flush.  0 or None disables the cap.
+            commitInterval (int): Number of writes between commits.
+            debug (bool): Enable debug output.
+        """
+        self.db_filename = db_filename
+        self.table = table
+        self.max_entries = max_entries
+        self.commitInterval = commitInterval
+        self.debug = debug
+
+    def isOpen(self):
+        return self.conn is not None
+
+    def open(self):
+        """
+        Opens (creating if required) the cache database.  If the schema version of this cache's table does not match
+        the table is rebuilt, other tables in the same file are rebuilt when they are opened.
+        """
+        if self.isOpen():
+            return
+        if self.db_filename != ":memory:":
+            Path(os.path.dirname(os.path.abspath(self.db_filename))).mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_filename)
+        # the cache is local and disposable, favor speed over durability
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.VERSION_TABLE} (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )""")
+        row = self.conn.execute(f"select version from {self.VERSION_TABLE} where name=?", (self.table,)).fetchone()
+        version = row[0] if row is not None else None
+        if version != self.SCHEMA_VERSION:
+            if self.debug:
+                print(f"DEBUG rebuilding cache '{self.db_filename}' table '{self.table}', schema version {version} != {self.SCHEMA_VERSION}")
+            self.conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+        self.conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.table} (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            last_access REAL NOT NULL
+        )""")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table}(last_access)")
+        self.conn.execute(f"insert or replace into {self.VERSION_TABLE} (name, version) values (?,?)", (self.table, self.SCHEMA_VERSION))
+        self.conn.commit()
+
+    def _stat(self, path:str, stat=None):
+        """
+        Returns (size, mtime_ns) for the path, using the given os.stat_result if provided.  None if the file is gone.
+        """
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _written(self):
+        self.pending += 1
+        if self.commitInterval and self.pending >= self.commitInterval:
+            self.conn.commit()
+            self.pending = 0
+
+    def get(self, path:str, stat=None):
+        """
+        Get the cached value for a file.
+
+        Args:
+            path (str): Full path of the file.
+            stat (os.stat_result): Optional stat of the file if the caller already has it.
+
+        Returns:
+            Any: The cached value, or None if there is no valid entry.  Stale entries are removed.
+        """
+        key = self._stat(path, stat)
+        row = self.conn.execute(f"select size, mtime_ns, value from {self.table} where path=?", (path,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if key is None or (row[0], row[1]) != key:
+            # file changed (or is gone) since it was cached
+            self.invalidate(path)
+            self.misses += 1
+            return None
+        self.conn.execute(f"update {self.table} set last_access=? where path=?", (time.time(), path))
+        self._written()
+        self.hits += 1
+        return json.loads(row[2])
+
+    def peek(self, path:str):
+        """
+        Get the cached value for a file even if the file has changed since, i.e. to compare with the new content.
+        Does not count as a hit or miss and does not update the entry.
+
+        Returns:
+            Any: The cached value, or None if there is no entry.
+        """
+        row = self.conn.execute(f"select value from {self.table} where path=?", (path,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, path:str, value, stat=None):
+        """
+        Store a value for a file.  The value must be JSON serializable.
+
+        Args:
+            path (str): Full path of the file.
+            value (Any): Value to cache.
+            stat (os.stat_result): Optional stat of the file if the caller already has it.
+        """
+        key = self._stat(path, stat)
+        if key is None:
+            # nothing to key on, don't cache it
+            return
+        self.conn.execute(
+            f"insert or replace into {self.table} (path, size, mtime_ns, value, last_access) values (?,?,?,?,?)",
+            (path, key[0], key[1], json.dumps(value), time.time()),
+        )
+        self._written()
+
+    def invalidate(self, path:str):
+        """
+        Remove the cached value for a file, if any.
+        """
+        self.conn.execute(f"delete from {self.table} where path=?", (path,))
+        self._written()
+
+    def clear(self):
+        """
+        Remove all cached values.
+        """
+        self.conn.execute(f"delete from {self.table}")
+        self.conn.commit()
+        self.pending = 0
+
+    def count(self):
+        return self.conn.execute(f"select count(path) from {self.table}").fetchone()[0]
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is within max_entries.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        if not self.max_entries:
+            return 0
+        excess = self.count() - self.max_entries
+        if excess <= 0:
+            return 0
+        self.conn.execute(
+            f"delete from {self.table} where path in (select path from {self.table} order by last_access asc limit ?)",
+            (excess,),
+        )
+        return excess
+
+    def flush(self):
+        """
+        Evict entries beyond the cap and commit.
+        """
+        if self.isOpen():
+            self.evict()
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        if self.isOpen():
+            self.flush()
+            if self.debug:
+                print(f"DEBUG cache '{self.db_filename}' hits={self.hits}, misses={self.misses}")
+            self.conn.close()
+            self.conn = None
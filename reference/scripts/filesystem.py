@@ -18,10 +18,11 @@ class Prepare():
     output_dir_light = None
     debug = False
     dryrun = False
+    workers = 0
 
     def __init__(self, input_dir:str, input_pattern:str,
                  output_dir_bias:str, output_dir_dark:str, output_dir_flat:str, output_dir_light:str, 
-                 debug:bool, dryrun:bool):
+                 debug:bool, dryrun:bool, workers=0):
         self.input_dir = input_dir
         self.input_pattern = input_pattern
         self.output_dir_bias = output_dir_bias
@@ -30,6 +31,7 @@ class Prepare():
         self.output_dir_light = output_dir_light
         self.debug=debug
         self.dryrun=dryrun
+        self.workers=workers
 
     def _prepare(self, type:str, output_dir:str, recursive=False, printStatus=False):
         # set required properties based on the image type
@@ -43,7 +45,18 @@ class Prepare():
         else:
             raise Exception(f"unexpected image type: {type}")
 
-        data = common.get_filtered_metadata(
+        # stream the data so files are moved while the scan is still running.
+        # can't do that if the output is inside the input, moved files would be scanned again.
+        batch_size = common.METADATA_BATCH_SIZE
+        input_dir = os.path.abspath(common.replace_env_vars(self.input_dir))
+        try:
+            if os.path.commonpath([input_dir, os.path.abspath(common.replace_env_vars(output_dir))]) == input_dir:
+                batch_size = None
+        except ValueError:
+            # different drives, can't overlap
+            pass
+
+        data = common.iter_filtered_metadata(
             dirs=[self.input_dir],
             patterns=[self.input_pattern],
             recursive=recursive,
@@ -51,17 +64,22 @@ class Prepare():
             filters={"type": type.upper()},
             debug=self.debug,
             profileFromPath=False,
-            printStatus=printStatus,
+            # when streaming the per-batch loading status would be printed in the middle of the moving status
+            printStatus=printStatus and batch_size is None,
+            workers=self.workers,
+            batch_size=batch_size,
         )
 
-        if printStatus:
-            print("Moving files..", end=".", flush=True)
-
         # collect all "target" directories (parent of DATE) so can create "accept" sub-dirs
         target_dirs = set()
         count_files=0 # could use len but assuming this is faster
+        moving=False
 
-        for datum in data.values():
+        for datum in data:
+            # data is loaded lazily, print the status once loading is done (or the first batch is loaded)
+            if printStatus and not moving:
+                print("Moving files..", end=".", flush=True)
+                moving=True
             filename_src=datum['filename']
             statedir=None
             if 'type' not in datum:
@@ -93,7 +111,7 @@ class Prepare():
                     pathlib.Path(t+os.sep+common.DIRECTORY_ACCEPT).mkdir(parents=True, exist_ok=True)
                 target_dirs.add(t)
         
-        if printStatus:
+        if moving:
             print("\n")
         
     def bias(self):
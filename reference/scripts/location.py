@@ -60,13 +60,7 @@ class Location():
                 self.brightness = m.groups()[2]
                 self.artifical_brightness = m.groups()[3]
     
-    def location_upsert_stmt(self):
-        """
-        Generate an SQL upsert statement for the location data.
-
-        Returns:
-            str: The SQL upsert statement for the location.
-        """
+    def _location_upsert_args(self):
         insert_values = {
             "name": self.name,
             "latitude": self.latitude,
@@ -83,14 +77,32 @@ class Location():
             "brightness_mcd_m2": self.brightness,
             "artifical_brightness_ucd_m2": self.artifical_brightness,
         }
+        return {
+            "table": "location",
+            "insert_values": insert_values,
+            "update_values": update_values,
+            "conflictColumns": ['latitude', 'longitude'],
+        }
+
+    def location_upsert_stmt(self):
+        """
+        Generate an SQL upsert statement for the location data.
+
+        Returns:
+            str: The SQL upsert statement for the location.
+        """
         # using the database object just for statement generation.. (HACK)
         d = database.Database("")
-        return d.upsert_stmt(
-            table="location",
-            insert_values=insert_values,
-            update_values=update_values,
-            conflictColumns=['latitude', 'longitude'],
-        )
+        return d.upsert_stmt(**self._location_upsert_args())
+
+    def location_upsert(self, d: database.Database):
+        """
+        Upsert the location data with bound parameters.
+
+        Args:
+            d (database.Database): An open database.
+        """
+        return d.upsert(**self._location_upsert_args())
       
 class LocationControl():
     locations = [
@@ -150,9 +162,9 @@ if __name__ == '__main__':
         l = LocationControl()
         l.loadAllData()
         d.open()
-        for upsert in l.location_upsert_stmts():
-            print(upsert)
-            d.execute(upsert)
+        for location in l.locations:
+            print(location.location_upsert_stmt())
+            location.location_upsert(d)
         d.commit()
     except Exception as e:
         print(e)
@@ -0,0 +1,248 @@
+"""
+This module provides a columnar table of frame metadata backed by NumPy arrays.
+Every column is stored as categorical codes (one small int per frame) plus the list of distinct values, so filters and
+group-by run over arrays and each distinct value is only converted or compared once.
+"""
+
+import numpy as np
+
+import common
+
+
+class MetadataTable():
+    # code used for frames that do not have the column at all
+    ABSENT = -1
+
+    length = 0
+    columns = None
+
+    def __init__(self, columns: dict, length: int):
+        """
+        Initializes the table.  Use from_records to build one from metadata.
+
+        Args:
+            columns (dict): column name -> (codes, categories) where codes is an int32 array and categories a list of values.
+            length (int): Number of rows.
+        """
+        self.columns = columns
+        self.length = length
+
+    @staticmethod
+    def from_records(records, columns=None):
+        """
+        Builds a table from metadata records.
+
+        Args:
+            records (Any): Iterable of metadata records (dict or FrameMetadata), or a dict of filename -> record.
+            columns (list): Columns to keep.  Defaults to every key found, in the order first seen.
+
+        Returns:
+            MetadataTable: The table.
+        """
+        if isinstance(records, dict):
+            records = records.values()
+        records = list(records)
+
+        if columns is None:
+            keys = {}
+            for datum in records:
+                for key in datum:
+                    keys[key] = None
+            columns = list(keys.keys())
+
+        table_columns = {}
+        for column in columns:
+            index = {}
+            codes = np.empty(len(records), dtype=np.int32)
+            for i, datum in enumerate(records):
+                if column not in datum:
+                    codes[i] = MetadataTable.ABSENT
+                    continue
+                value = datum[column]
+                code = index.get(value)
+                if code is None:
+                    code = len(index)
+                    index[value] = code
+                codes[i] = code
+            table_columns[column] = (codes, list(index.keys()))
+        return MetadataTable(table_columns, len(records))
+
+    def __len__(self):
+        return self.length
+
+    def add_column(self, name: str, values: list):
+        """
+        Adds (or replaces) a column from a list of values, one per row.
+        """
+        if len(values) != self.length:
+            raise Exception(f"column '{name}' has {len(values)} values, expected {self.length}")
+        index = {}
+        codes = np.empty(self.length, dtype=np.int32)
+        for i, value in enumerate(values):
+            code = index.get(value)
+            if code is None:
+                code = len(index)
+                index[value] = code
+            codes[i] = code
+        self.columns[name] = (codes, list(index.keys()))
+
+    def _codes(self, name: str):
+        if name not in self.columns:
+            return np.full(self.length, MetadataTable.ABSENT, dtype=np.int32)
+        return self.columns[name][0]
+
+    def _categories(self, name: str):
+        if name not in self.columns:
+            return []
+        return self.columns[name][1]
+
+    def _lookup(self, name: str, function, absent, dtype):
+        """
+        Evaluates function once per distinct value of the column and maps the result to every row.
+        """
+        categories = self._categories(name)
+        lut = np.empty(len(categories) + 1, dtype=dtype)
+        for i, value in enumerate(categories):
+            lut[i] = function(value)
+        # last entry is for ABSENT (-1)
+        lut[-1] = absent
+        return lut[self._codes(name)]
+
+    def values(self, name: str):
+        """
+        Returns the values of a column as a list, None where the row doesn't have the column.
+        """
+        categories = self._categories(name) + [None]
+        return [categories[c] for c in self._codes(name)]
+
+    def numeric(self, name: str):
+        """
+        Returns the values of a column as a float array, NaN where the row doesn't have the column or it's not a number.
+        """
+        def to_float(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return np.nan
+        return self._lookup(name, to_float, np.nan, np.float64)
+
+    def mask(self, filters: dict):
+        """
+        Returns a bool array that is True for every row matching all filters.
+        Filters behave exactly like common.filter_metadata (callable, int, float or string and a missing key matches).
+        Additionally a (low, high) tuple matches numeric values in the inclusive range, either end can be None.
+        """
+        common.validate_filters(filters)
+        output = np.ones(self.length, dtype=bool)
+        for key in filters.keys():
+            filter_value = filters[key]
+            if type(filter_value) is tuple:
+                low, high = filter_value
+                values = self.numeric(key)
+                # NaN never matches a range, but a missing key does
+                match = ~np.isnan(values)
+                if low is not None:
+                    match &= values >= low
+                if high is not None:
+                    match &= values <= high
+                match |= self._codes(key) == MetadataTable.ABSENT
+            else:
+                match = self._lookup(key, lambda v: common.match_filters({key: v}, {key: filter_value}), True, bool)
+            output &= match
+        return output
+
+    def take(self, indices):
+        """
+        Returns a new table with only the given rows (index array or bool mask).
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.nonzero(indices)[0]
+        columns = {}
+        for name, (codes, categories) in self.columns.items():
+            columns[name] = (codes[indices], categories)
+        return MetadataTable(columns, len(indices))
+
+    def filter(self, filters: dict):
+        """
+        Returns a new table with only the rows matching the filters, see mask.
+        """
+        return self.take(self.mask(filters))
+
+    def _groups(self, columns: list):
+        """
+        Returns (unique codes, group of each row, count of each group, group order by first appearance).
+        Rows without a column are grouped with rows where it is None.
+        """
+        keys = []
+        for column in columns:
+            codes = self._codes(column)
+            categories = self._categories(column)
+            if None in categories:
+                codes = np.where(codes == MetadataTable.ABSENT, categories.index(None), codes)
+            keys.append(codes)
+        keys = np.stack(keys, axis=1)
+        unique, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+        return unique, inverse.reshape(-1), counts, np.argsort(first, kind="stable")
+
+    def _decode(self, columns: list, codes):
+        output = {}
+        for i, column in enumerate(columns):
+            code = codes[i]
+            output[column] = None if code == MetadataTable.ABSENT else self._categories(column)[code]
+        return output
+
+    def group_indices(self, columns: list):
+        """
+        Groups rows by the values of the given columns.
+
+        Returns:
+            list: (values dict, row index array) for each group, in order of first appearance.
+        """
+        if self.length == 0:
+            return []
+        unique, inverse, counts, order = self._groups(columns)
+        rows = np.split(np.argsort(inverse, kind="stable"), np.cumsum(counts)[:-1])
+        return [(self._decode(columns, unique[g]), rows[g]) for g in order]
+
+    def group_by(self, columns: list, sum=[]):
+        """
+        Groups rows by the values of the given columns with a count and optional sums.
+
+        Args:
+            columns (list): Columns to group by.
+            sum (list): Numeric columns to sum for each group, added as "sum_<column>".  Non-numeric values are skipped.
+
+        Returns:
+            list: dict of group values (None if missing) plus "count" (and sums) for each group, in order of first appearance.
+        """
+        if self.length == 0:
+            return []
+        unique, inverse, counts, order = self._groups(columns)
+        sums = {}
+        for column in sum:
+            sums[column] = np.bincount(inverse, weights=np.nan_to_num(self.numeric(column)), minlength=len(unique))
+        output = []
+        for g in order:
+            group = self._decode(columns, unique[g])
+            group["count"] = int(counts[g])
+            for column in sum:
+                group[f"sum_{column}"] = float(sums[column][g])
+            output.append(group)
+        return output
+
+    def to_records(self, columns=None):
+        """
+        Returns the rows as a list of dicts.  Columns a row doesn't have are left out.
+        """
+        if columns is None:
+            columns = list(self.columns.keys())
+        decoded = [(c, self._codes(c), self._categories(c)) for c in columns]
+        output = []
+        for i in range(0, self.length):
+            datum = {}
+            for column, codes, categories in decoded:
+                if codes[i] != MetadataTable.ABSENT:
+                    datum[column] = categories[codes[i]]
+            output.append(datum)
+        return output
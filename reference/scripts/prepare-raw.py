@@ -17,6 +17,7 @@ parser.add_argument("--output_flat_dir", type=str, help="directory to search for
 parser.add_argument("--output_light_dir", type=str, help="directory to search for images", default=common.DIRECTORY_ROOT_DATA)
 parser.add_argument("--debug", action='store_true')
 parser.add_argument("--dryrun", action='store_true')
+parser.add_argument("--workers", type=int, help="number of threads used to read image headers, 0 to read serially", default=0)
 
 # treat args parsed as a dictionary
 args = vars(parser.parse_args())
@@ -29,6 +30,7 @@ user_output_flat_dir = args["output_flat_dir"]
 user_output_light_dir = args["output_light_dir"]
 user_debug = args["debug"]
 user_dryrun = args["dryrun"]
+user_workers = args["workers"]
 
 p = filesystem.Prepare(
     input_dir=user_input_dir,
@@ -39,6 +41,7 @@ p = filesystem.Prepare(
     output_dir_light=user_output_light_dir,
     debug=user_debug,
     dryrun=user_dryrun,
+    workers=user_workers,
 )
 
 p.bias()
@@ -3,8 +3,6 @@ This script generates reports based on data from the astrophotography and schedu
 It includes methods to query and process data for reporting purposes.
 """
 
-import os
-import re
 import traceback
 import common
 import database
@@ -13,46 +11,53 @@ class Report():
     db_astrophotography = None
     db_scheduler = None
 
-    def __init__(self):
+    def __init__(self, db_astrophotography_filename=common.DATABASE_ASTROPHOTGRAPHY, db_scheduler_filename=common.DATABASE_TARGET_SCHEDULER):
         """
         Initialize the Report class.
 
         This class connects to the astrophotography and scheduler databases
         to generate reports and process data for various purposes.
         """
-        self.db_astrophotography = database.Database(common.DATABASE_ASTROPHOTGRAPHY)
-        self.db_scheduler = database.Database(common.DATABASE_TARGET_SCHEDULER)
+        self.db_astrophotography = database.Astrophotgraphy(db_astrophotography_filename)
+        self.db_scheduler = database.Scheduler(db_scheduler_filename)
 
-    def _findData(self, like: str):
+    def _checkSchema(self):
+        """
+        Reports only read the databases.  Raise if the astrophotography database still has to be upgraded to have the
+        directory table, the upgrade is done by the scripts that write to it.
+        """
+        if self.db_astrophotography.NeedsUpgrade():
+            raise Exception(f"database '{self.db_astrophotography.db_filename}' has no directory table, run database-update.py to upgrade it")
+
+    def _findData(self, stage: str):
         """
         Query and aggregate data from the astrophotography database.
 
         Args:
-            like (str): A string pattern to filter raw directories.
+            stage (str): The stage directory (i.e. common.DIRECTORY_DATA) to report on.
 
         Returns:
-            dict: A dictionary where keys are directory paths and values are aggregated counts.
+            dict: A dictionary where keys are target directory paths (parent of "accept") and values are aggregated counts.
         """
         try:
             self.db_astrophotography.open()
-            stmt = f"select sum(accepted_count), raw_directory from accepted_data where raw_directory like '%{like}%' group by raw_directory;"
-            data = self.db_astrophotography.select(
+            self._checkSchema()
+            stmt = """
+                select sum(a.accepted_count), p.path
+                from accepted_data a, directory d, directory p
+                where a.directory_id=d.id
+                and d.parent_id=p.id
+                and d.stage=?
+                group by p.path
+                ;"""
+            data = self.db_astrophotography.fetch_iter(
                 stmt=stmt,
-                columns=["accepted_count", "raw_directory"],
+                columns=["accepted_count", "path"],
+                params=(stage,),
             )
-            # raw directory is full path.  strip off everything "\accept\.*$".
             output = {}
             for datum in data:
-                m = re.match("(.*)[\\\\\\/]accept[\\\\\\/].*", datum['raw_directory'])
-                if m and len(m.groups()) == 1:
-                    dir = m.groups()[0]
-                    count = int(datum['accepted_count'])
-                    if dir in output:
-                        # existing data, add to accepted_count
-                        output[dir] += count
-                    else:
-                        # new data to aggregate, set to accepted_count
-                        output[dir] = count
+                output[datum['path']] = int(datum['accepted_count'])
             return output
         except Exception as e:
             print(e)
@@ -112,48 +117,42 @@ class Report():
         Returns:
             list: A list of directory paths ready to be moved to the master folder.
         """
-        data_dirs = self.data()
-
         try:
-            self.db_scheduler.open()
-
-            ready2move_dirs = []
-
-            for data_dir in data_dirs:
-                # NOTE append "accept" so objectFromPath works
-                metadata = common.get_file_headers(
-                    filename=data_dir+os.sep+common.DIRECTORY_ACCEPT,
-                    profileFromPath=True,
-                    objectFromPath=True,
-                    normalize=True,
-                )
-
-                # for the target, find all acquired data
-                stmt = f"""
-                    select ep.profileid, t.name, ep.desired, ep.acquired, ep.accepted
-                    from exposureplan ep, target t
-                    where ep.targetid = t.id
-                    and t.name like "{metadata['targetname']}%"
-                    ;"""
-                data = self.db_scheduler.select(
-                    stmt=stmt,
-                    columns=['profile_id', 'name', 'desired', 'acquired', 'accepted'],
+            self.db_astrophotography.open()
+            self._checkSchema()
+            self.db_astrophotography.attach(self.db_scheduler.db_filename, "scheduler")
+
+            # target directories are matched on scheduler target names starting with the target (no panel, no single
+            # quotes, same as the target name from the path).  it is ready to move if there is at least one exposure
+            # plan and all the exposure plans with a desired count have accepted > desired * 95%
+            stmt = """
+                with data as (
+                    select p.path, replace(p.target, '''', '') as target
+                    from accepted_data a, directory d, directory p
+                    where a.directory_id=d.id
+                    and d.parent_id=p.id
+                    and d.stage=?
+                    group by p.path
                 )
-                # it is ready to move if all the exposure plans (datum) returned have accepted * 95% >= desired
-                is_ready = len(data) > 0
-                for datum in data:
-                    if datum['desired'] > 0 and not (datum['accepted'] > datum['desired'] * common.MASTER_READY_PERCENT):
-                        is_ready = False
-                        break
-                if is_ready:
-                    ready2move_dirs.append(data_dir)
-
-            return ready2move_dirs
+                select data.path
+                from data, scheduler.target t, scheduler.exposureplan ep
+                where ep.targetid=t.id
+                and substr(t.name, 1, length(data.target))=data.target
+                group by data.path
+                having sum(ep.desired > 0 and not (ep.accepted > ep.desired * ?))=0
+                order by data.path
+                ;"""
+            data = self.db_astrophotography.select(
+                stmt=stmt,
+                columns=["path"],
+                params=(common.DIRECTORY_DATA, common.MASTER_READY_PERCENT),
+            )
+            return [datum["path"] for datum in data]
         except Exception as e:
             print(e)
             traceback.print_exc()
         finally:
-            self.db_scheduler.close()
+            self.db_astrophotography.close()
 
 if __name__ == "__main__":
     """
@@ -9,6 +9,7 @@ import sys
 import traceback
 
 import common
+import database
 
 parser = argparse.ArgumentParser(description="disable unused projects")
 parser.add_argument("--debug", action='store_true')
@@ -22,7 +23,7 @@ user_dryrun = args["dryrun"]
 
 
 try:
-    conn_ts = sqlite3.connect(common.DATABASE_TARGET_SCHEDULER)
+    conn_ts = database.connect(common.DATABASE_TARGET_SCHEDULER, database.PRAGMAS_SCHEDULER)
     c_ts = conn_ts.cursor()
 
     # simple script, disable all projects that have no EP attached
@@ -44,22 +45,21 @@ try:
 
     # disable every project found.  NOTE this only works with the assumption that every project has one target.. this is valid at time of writing!
 
-    for row_ts in rows_ts:
-        project_id=row_ts[0]
-        project_name=row_ts[1]
-        targetname=row_ts[2]
-        project_state=row_ts[3]
-        profile_id=row_ts[4]
-        new_project_state=0
-        print(f"update project state: {profile_id}/{project_name}/{targetname}: {project_state} --> {new_project_state}")
-        if not user_dryrun:
+    with database.transaction(conn_ts):
+        for row_ts in rows_ts:
+            project_id=row_ts[0]
+            project_name=row_ts[1]
+            targetname=row_ts[2]
+            project_state=row_ts[3]
+            profile_id=row_ts[4]
+            new_project_state=0
+            print(f"update project state: {profile_id}/{project_name}/{targetname}: {project_state} --> {new_project_state}")
+            if not user_dryrun:
 
-            c_ts.execute(f"""update project
-                            set state='{new_project_state}'
-                            where id='{project_id}'
-                            ;""")
-
-    conn_ts.commit()
+                c_ts.execute("""update project
+                                set state=?
+                                where id=?
+                                ;""", (new_project_state, project_id))
 
     common.backup_scheduler_database()
 
@@ -10,6 +10,7 @@ import sys
 import traceback
 
 import common
+import database
 
 SKIP_PROFILES=[
     "7c504d1b-6d2d-4e1e-ba80-5615fcdfc814", # C8@f6.3+ZWO ASI2600MM Pro
@@ -23,11 +24,14 @@ SKIP_PROFILES=[
 ]
 
 try:
-    conn_ts = sqlite3.connect(common.DATABASE_TARGET_SCHEDULER)
+    conn_ts = database.connect(common.DATABASE_TARGET_SCHEDULER, database.PRAGMAS_SCHEDULER)
     c_ts = conn_ts.cursor()
-    conn_ap = sqlite3.connect(common.DATABASE_ASTROPHOTGRAPHY)
+    conn_ap = database.connect(common.DATABASE_ASTROPHOTGRAPHY, database.PRAGMAS_ASTROPHOTOGRAPHY)
     c_ap = conn_ap.cursor()
 
+    # target name without "panel" suffix, as the prefix of project names
+    conn_ts.create_function("target_prefix", 1, lambda n: common.normalize_target_name(n.replace("\"", "'"))[0], deterministic=True)
+
     # output the following:
     # profile id, profile name, target name, filter, desired hours, accepted hours, exposureplan id
 
@@ -47,88 +51,90 @@ try:
             #print(f"SKIPPING {profile_id}, {profile_name}")
             continue
 
-        # get all draft and active target data where also have an exposureplan
-        c_ts.execute(f"""select distinct p.profileid, t.name, p.priority
-                        from target t, project p
-                        where t.projectid=p.id
-                        and p.profileid='{profile_id}'
-                        and (p.state = 0 or p.state = 1)
-                        order by p.profileid, t.name
-                    ;""")
+        # one statement for all of the profile's draft and active targets, one row per target and exposure plan:
+        # - targets: distinct target name and project priority
+        # - weights: count of rule weights > 0 on projects with a name starting with the target name (no panel), only
+        #   used for priority 0 targets
+        # - plans: desired and accepted for default exposure plans, joined on target name
+        c_ts.execute("""with targets as (
+                            select distinct t.name, p.priority, target_prefix(t.name) as prefix
+                            from target t, project p
+                            where t.projectid=p.id
+                            and p.profileid=:profile_id
+                            and (p.state = 0 or p.state = 1)
+                        ),
+                        weights as (
+                            select targets.name, targets.priority, count(r.id) as weight_count
+                            from targets
+                            left join project rp on substr(rp.name, 1, length(targets.prefix))=targets.prefix
+                            left join ruleweight r on r.projectid=rp.id and r.weight > 0
+                            group by targets.name, targets.priority
+                        ),
+                        plans as (
+                            select t.name, et.name as filter_name, et.defaultexposure, ep.desired, ep.accepted
+                            from exposureplan ep, exposuretemplate et, target t
+                            where et.profileid=ep.profileid
+                            and et.id=ep.exposureTemplateId
+                            and ep.exposure<0
+                            and et.profileid=:profile_id
+                            and ep.targetid=t.id
+                        )
+                        select w.name, w.priority, w.weight_count, plans.filter_name, plans.defaultexposure, plans.desired, plans.accepted
+                        from weights w
+                        left join plans on plans.name=w.name
+                        order by w.name, w.priority
+                    ;""", {"profile_id": profile_id})
 
         rows_ts = c_ts.fetchall()
         if rows_ts is None or len(rows_ts) == 0:
             print(f"ERROR no exposure plans found for profile '{profile_id} / {profile_name}'. Aborting.")
             sys.exit(1)
 
-        data = []
-
+        # pivot to one row per target with desired hours and accepted % for each of the profile's filters
+        data = {}
         for row_ts in rows_ts:
-            profile_id = row_ts[0]
-            target_name = row_ts[1].replace("\"", "'")
-            priority = row_ts[2]
-
-            # get the name of target without "panel" suffix
-            project_name_prefix=common.normalize_target_name(target_name)[0]
-
-            # if priority is 0 then check ruleweights
-            # if all are "0" then set priority to -1 (yes, a magical number. too bad.)
-            if priority == 0:
-                select_ruleweight = f"""select count(*)
-                                    from ruleweight
-                                    where weight > 0
-                                    and projectid in (select id from project where name like '{project_name_prefix}%')
-                                    ;"""
-                c_ts.execute(select_ruleweight)
-                row_ruleweight_count = c_ts.fetchall()
-                if row_ruleweight_count is not None and len(row_ruleweight_count) > 0 and row_ruleweight_count[0][0] == 0:
-                    # all rule weights are 0
-                    #print(f"{target_name}: all rule weights are 0: {row_ruleweight_count}")
+            target_name = row_ts[0].replace("\"", "'")
+            priority = row_ts[1]
+            ruleweight_count = row_ts[2]
+            filter_name = row_ts[3]
+
+            key = (row_ts[0], priority)
+            if key not in data:
+                # if priority is 0 and all rule weights are "0" then set priority to -1 (yes, a magical number. too bad.)
+                if priority == 0 and ruleweight_count == 0:
                     priority = -1
-
-            datum = {
-                "profile_id": profile_id,
-                "target_name": target_name,
-                "priority": priority,
-            }
-
-            # initialize filters
-            for filter_name in filter_names:
-                select_filter = f"""
-                            select et.defaultexposure, ep.desired, ep.accepted
-                            from exposureplan ep, exposuretemplate et, target t
-                            where et.profileid=ep.profileid
-                            and et.id=ep.exposureTemplateId
-                            and ep.exposure<0
-                            and et.name='{filter_name}'
-                            and et.profileid='{profile_id}'
-                            and ep.targetid=t.id
-                            and t.name=\"{target_name}\"
-                            ;"""
-                #print(select_filter)
-                c_ts.execute(select_filter)
-                row_filter = c_ts.fetchone()
-                if row_filter is not None and len(row_filter) > 0:
-                    exposure_s = row_filter[0]
-                    desired_count = row_filter[1]
-                    accepted_count = row_filter[2]
-                    desired_h = desired_count * exposure_s / 60 / 60
-                    datum[f"{filter_name}_h"] = str(desired_h)
-                    datum[f"{filter_name}_%"] = ""
-                    if desired_count > 0:
-                        datum[f"{filter_name}_%"] = str('{:.1f}'.format(accepted_count / desired_count))
-                else:
-                    datum[f"{filter_name}_h"] = "0"
-                    datum[f"{filter_name}_%"] = ""
-
-            data.append(datum)
+                data[key] = {
+                    "profile_id": profile_id,
+                    "target_name": target_name,
+                    "priority": priority,
+                    "filters": {},
+                }
+
+            # first plan found for the filter wins
+            if filter_name in filter_names and filter_name not in data[key]["filters"]:
+                exposure_s = row_ts[4]
+                desired_count = row_ts[5]
+                accepted_count = row_ts[6]
+                desired_h = desired_count * exposure_s / 60 / 60
+                percent = ""
+                if desired_count > 0:
+                    percent = str('{:.1f}'.format(accepted_count / desired_count))
+                data[key]["filters"][filter_name] = [str(desired_h), percent]
 
         # write the profile's csv
         print(f"Writing CSV for profile '{profile_id}' / {profile_name}")
         filename_csv = f"{common.DIRECTORY_CSV}{os.sep}desired-{profile_id}.csv"
-        data_csv = common.simpleObject_to_csv(data, output_headers=True)
+        headers = ["profile_id", "target_name", "priority"]
+        for filter_name in filter_names:
+            headers += [f"{filter_name}_h", f"{filter_name}_%"]
+        rows = []
+        for datum in data.values():
+            row = [datum["profile_id"], datum["target_name"], datum["priority"]]
+            for filter_name in filter_names:
+                row += datum["filters"].get(filter_name, ["0", ""])
+            rows.append(dict(zip(headers, row)))
         with open(filename_csv, "w") as f:
-            f.write(data_csv)
+            common.write_csv(f, rows, columns=headers)
 
         # open the csv.. assume since we created it we want to edit
         print(f"Opening CSV for profile '{profile_id}' / {profile_name}")
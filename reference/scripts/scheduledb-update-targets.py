@@ -3,309 +3,386 @@ This script updates target data in the NINA Scheduler database.
 It processes profile files and integrates them into the database.
 
 The script performs the following tasks:
-- Collects all profile file names from a specified directory.
+- Collects all target file names from the NINA profiles directory.
+- Skips target files that have not changed since the last run if their targets are still in the scheduler database
+  (see --nocache).
 - Connects to the astrophotography and scheduler databases.
-- Processes target data from profile files and updates the database.
+- Processes target data from the new and changed target files and updates the database in one transaction.
 - Handles specific profiles and their associated projects, targets, and exposure plans.
 
 Exceptions:
     sqlite3.Error: Handles SQLite errors and ensures database connections are closed properly.
 """
 
+import argparse
+import hashlib
+import json
 import os
 import re
 import sqlite3
 import traceback
-import yaml
 
 import common
+import database
+import filecache
 
+parser = argparse.ArgumentParser(description="create and update scheduler projects and targets from NINA targets")
+parser.add_argument("--nocache", action='store_true', help="process all target files, not only the ones changed since the last run")
+parser.add_argument("--debug", action='store_true')
+
+# treat args parsed as a dictionary
+args = vars(parser.parse_args())
+
+user_nocache = args["nocache"]
+user_debug = args["debug"]
+
+
+def read_target(filename: str, raw_data: dict) -> dict:
+    """
+    Extracts the target name, panel, coordinates and profile name from a NINA target file.
+    """
+    targetname_with_panel=raw_data["Target"]["TargetName"].replace("\"", "")
+    targetname_with_panel=targetname_with_panel.replace("'", "")
+
+    # find panel name (if it exists)
+    m = re.match("(.*) Panel (.*)", targetname_with_panel)
+    targetname = targetname_with_panel
+    panelname = ""
+    if m is not None and m.groups() is not None and len(m.groups()) == 2:
+        targetname = m.groups()[0]
+        panelname = m.groups()[1]
+
+    coord_ra=(
+        float(raw_data["Target"]["InputCoordinates"]["RAHours"]) +
+        float((raw_data["Target"]["InputCoordinates"]["RAMinutes"]) / 60) +
+        float((raw_data["Target"]["InputCoordinates"]["RASeconds"]) / 60 / 60)
+    )
+
+    coord_dec = (
+        abs(float(raw_data["Target"]["InputCoordinates"]["DecDegrees"])) +
+        abs(float(raw_data["Target"]["InputCoordinates"]["DecMinutes"]) / 60) +
+        abs(float(raw_data["Target"]["InputCoordinates"]["DecSeconds"]) / 60 / 60)
+    )
+
+    rotation = 0
+    if "PositionAngle" in raw_data["Target"]:
+        rotation = float(raw_data["Target"]["PositionAngle"])
+
+    if raw_data["Target"]["InputCoordinates"]["NegativeDec"]:
+        coord_dec *= -1
+
+    # don't like this, but get profile _name_ from the parent dir of Targets.. so many brittle "standards"
+    # monkey with filename as the path separator is messing up regex.
+    filename = "/".join(filename.split(os.sep))
+    m = re.match(f".*/([^/]*)/Targets.*", filename)
+    profile_name = ""
+
+    if m is not None and m.groups() is not None and len(m.groups()) == 1:
+        profile_name = m.groups()[0]
+
+    # FIX profile that was incorrectly named..
+    if profile_name == "C8E@f7+ZWO ASI2600MM Pro":
+        profile_name = "C8E@f7.0+ZWO ASI2600MM Pro"
+
+    return {
+        "targetname_with_panel": targetname_with_panel,
+        "targetname": targetname,
+        "panelname": panelname,
+        "ra": coord_ra,
+        "dec": coord_dec,
+        "rotation": rotation,
+        "profile_name": profile_name,
+    }
+
+
+def get_project_data(profile_name: str, panelname: str) -> dict:
+    """
+    Returns the projects to create for a target, by project name suffix.
+    """
+    # HACK: dirty way to handle the profiles and initial creation :(
+    isMosaic = "0"
+    if panelname != "":
+        isMosaic = "1"
+
+    project_data = {}
+    if profile_name.endswith("+ZWO ASI2600MM Pro"):
+        project_data["LRGB"] = {
+            "priority": 0,
+            "ditherevery": 15,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "L",
+                },
+                {
+                    "filtername": "R",
+                },
+                {
+                    "filtername": "G",
+                },
+                {
+                    "filtername": "B",
+                },
+            ]
+        }
+        project_data["SHO"] = {
+            "priority": 0,
+            "ditherevery": 5,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "O",
+                    "filtername": "S",
+                    "filtername": "H",
+                },
+            ]
+        }
+        if profile_name.startswith("C8@f6.3+"):
+            project_data["LRGB"]["ditherevery"] = 15
+            project_data["SHO"]["ditherevery"] = 5
+        if profile_name.startswith("C8E@f7.0+"):
+            project_data["LRGB"]["ditherevery"] = 15
+            project_data["SHO"]["ditherevery"] = 2
+        elif profile_name.startswith("E120@f7.0+"):
+            project_data["LRGB"]["ditherevery"] = 7
+            project_data["SHO"]["ditherevery"] = 1
+    elif profile_name.endswith("+ATR585M"):
+        project_data["LRGB"] = {
+            "priority": 0,
+            "ditherevery": 10,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "L",
+                },
+                {
+                    "filtername": "R",
+                },
+                {
+                    "filtername": "G",
+                },
+                {
+                    "filtername": "B",
+                },
+            ]
+        }
+        project_data["SHO"] = {
+            "priority": 0,
+            "ditherevery": 5,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "O",
+                    "filtername": "S",
+                    "filtername": "H",
+                },
+            ]
+        }
+        if profile_name.startswith("C8@f6.3+"):
+            project_data["LRGB"]["ditherevery"] = 15
+            project_data["SHO"]["ditherevery"] = 5
+        if profile_name.startswith("C8E@f7.0+"):
+            project_data["LRGB"]["ditherevery"] = 15
+            project_data["SHO"]["ditherevery"] = 2
+        elif profile_name.startswith("E120@f7.0+"):
+            project_data["LRGB"]["ditherevery"] = 7
+            project_data["SHO"]["ditherevery"] = 1
+    elif profile_name.endswith("+AP26CC"):
+        project_data["UVIR"] = {
+            "priority": 0,
+            "ditherevery": 5,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "UVIR",
+                },
+            ]
+        }
+        project_data["LeXtr"] = {
+            "priority": 0,
+            "ditherevery": 4,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "LeXtr",
+                },
+            ]
+        }
+        project_data["ALPT"] = {
+            "priority": 0,
+            "ditherevery": 4,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "ALPT",
+                },
+            ]
+        }
+    elif profile_name.endswith("+DWARFIII"):
+        project_data["Astro"] = {
+            "priority": 0,
+            "ditherevery": 0,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "Astro",
+                },
+            ]
+        }
+        project_data["Dual-Band"] = {
+            "priority": 0,
+            "ditherevery": 0,
+            "isMosaic": isMosaic,
+            "filters": [
+                {
+                    "filtername": "Dual-Band",
+                },
+            ]
+        }
+    else:
+        print(f"WARNING: profile not handled!  '{profile_name}'")
+    return project_data
 
-# collected data
-data = {}
 
 # collect all file names
 filenames = []
 
 for root, d_names, f_names in os.walk(common.DIRECTORY_NINA_PROFILES):
     for f in f_names:
-        filenames.append(os.path.normpath(f"{root}\{f}"))
+        filenames.append(os.path.normpath(os.path.join(root, f)))
 
+# the cache remembers target files that are already in the scheduler database
+cache = None
+if not user_nocache:
+    cache = filecache.FileCache(db_filename=common.DATABASE_HEADER_CACHE, table="targets", debug=user_debug)
+    cache.open()
+
+def load_target(filename: str, stat, content: bytes=None):
+    """
+    Reads a target file.  Returns (filename, stat, cache value, target) or None if the file can't be read.
+    """
+    if content is None:
+        with open(filename, "rb") as stream:
+            content = stream.read()
+    value = {"sha256": hashlib.sha256(content).hexdigest()}
+    try:
+        target = read_target(filename, json.loads(content.decode("utf-8-sig")))
+    except (ValueError, KeyError, TypeError):
+        print(f"ERROR reading file {filename}")
+        traceback.print_exc()
+        return None
+    return (filename, stat, value, target)
+
+
+# find new and changed targets.  unchanged files are checked against the scheduler database once it is loaded.
+targets_changed = []
+targets_cached = []
+for filename in (filename for filename in filenames if "Targets" in filename and filename.endswith(".json")):
+    stat = os.stat(filename)
+    previous = None
+    if cache is not None:
+        previous = cache.peek(filename)
+        value = cache.get(filename, stat)
+        if value is not None:
+            # unchanged since it was last synced
+            targets_cached.append((filename, stat, value))
+            continue
+
+    with open(filename, "rb") as stream:
+        content = stream.read()
+    if previous is not None and previous.get("sha256") == hashlib.sha256(content).hexdigest():
+        # saved again but the content is the same
+        targets_cached.append((filename, stat, previous))
+        continue
+
+    loaded = load_target(filename, stat, content)
+    if loaded is not None:
+        targets_changed.append(loaded)
+
+if user_debug:
+    print(f"DEBUG {len(targets_changed)} new or changed target files")
 
 # connect to the 2 databases
 try:
-    conn_ts = sqlite3.connect(common.DATABASE_TARGET_SCHEDULER)
+    conn_ts = database.connect(common.DATABASE_TARGET_SCHEDULER, database.PRAGMAS_SCHEDULER)
     c_ts = conn_ts.cursor()
-    conn_ap = sqlite3.connect(common.DATABASE_ASTROPHOTGRAPHY)
+    conn_ap = database.connect(common.DATABASE_ASTROPHOTGRAPHY, database.PRAGMAS_ASTROPHOTOGRAPHY)
     c_ap = conn_ap.cursor()
 
-    # find targets
-    for filename in (filename for filename in filenames if "Targets" in filename and filename.endswith(".json")):
-        with open(filename, "r") as stream:
-            try:
-                raw_data = yaml.safe_load(stream)
-            except yaml.YAMLError as ex:
-                print(f"ERROR reading file {filename}")
-                traceback.print_exc()
-
-        targetname_with_panel=raw_data["Target"]["TargetName"].replace("\"", "")
-        targetname_with_panel=targetname_with_panel.replace("'", "")
-
-        # find panel name (if it exists)
-        m = re.match("(.*) Panel (.*)", targetname_with_panel)
-        targetname = targetname_with_panel
-        panelname = ""
-        if m is not None and m.groups() is not None and len(m.groups()) == 2:
-            targetname = m.groups()[0]
-            panelname = m.groups()[1]
-        
-        coord_ra=(
-            float(raw_data["Target"]["InputCoordinates"]["RAHours"]) +
-            float((raw_data["Target"]["InputCoordinates"]["RAMinutes"]) / 60) +
-            float((raw_data["Target"]["InputCoordinates"]["RASeconds"]) / 60 / 60)
-        )
-
-        coord_dec = (
-            abs(float(raw_data["Target"]["InputCoordinates"]["DecDegrees"])) +
-            abs(float(raw_data["Target"]["InputCoordinates"]["DecMinutes"]) / 60) +
-            abs(float(raw_data["Target"]["InputCoordinates"]["DecSeconds"]) / 60 / 60)
-        )
-
-        rotation = 0
-        if "PositionAngle" in raw_data["Target"]:
-            rotation = float(raw_data["Target"]["PositionAngle"])
-
-        if raw_data["Target"]["InputCoordinates"]["NegativeDec"]:
-            coord_dec *= -1
-        
-        # don't like this, but get profile _name_ from the parent dir of Targets.. so many brittle "standards"
-        # monkey with filename as the path separator is messing up regex.
-        filename = "/".join(filename.split(os.sep))
-        m = re.match(f".*/([^/]*)/Targets.*", filename)
-        profile_name = ""
-
-        if m is not None and m.groups() is not None and len(m.groups()) == 1:
-            profile_name = m.groups()[0]
-
-        # FIX profile that was incorrectly named..
-        if profile_name == "C8E@f7+ZWO ASI2600MM Pro":
-            profile_name = "C8E@f7.0+ZWO ASI2600MM Pro"
-
-        c_ap.execute(f"select id from profile where name='{profile_name}'")
-        row_ap = c_ap.fetchone() # UniqueKey on name, there can be only one
-        if row_ap is not None:
-            profile_id = row_ap[0]
-        else:
+    # UniqueKey on name, there can be only one
+    c_ap.execute("select name, id from profile;")
+    profile_ids = dict(c_ap.fetchall())
+
+    # existing projects and targets
+    SELECT_PROJECTS = "select profileid, name, id from project;"
+    c_ts.execute(SELECT_PROJECTS)
+    projects = {(row[0], row[1]): row[2] for row in c_ts.fetchall()}
+    c_ts.execute("""select p.profileid, p.name, t.name, t.id, t.ra, t.dec, t.rotation
+                    from target t, project p
+                    where t.projectid=p.id
+                    order by t.id
+                    ;""")
+    targets = {}
+    for row in c_ts.fetchall():
+        targets.setdefault((row[0], row[1], row[2]), row[3:])
+
+    # unchanged files are only skipped if everything they created is still in the scheduler database, i.e. it was not
+    # reset or restored from a backup since they were synced
+    synced = []
+    for filename, stat, value in targets_cached:
+        if "targets" in value and all(tuple(key) in targets for key in value["targets"]):
+            # remember the new stat if the file was saved again
+            synced.append((filename, stat, value))
+            continue
+        if user_debug:
+            print(f"DEBUG targets missing from the scheduler database for {filename}")
+        loaded = load_target(filename, stat)
+        if loaded is not None:
+            targets_changed.append(loaded)
+
+    # collect everything to create or update
+    insert_projects = {}
+    insert_targets = {}
+    update_targets = {}
+    for filename, stat, value, target in targets_changed:
+        profile_name = target["profile_name"]
+        targetname = target["targetname"]
+        targetname_with_panel = target["targetname_with_panel"]
+        coord_ra = target["ra"]
+        coord_dec = target["dec"]
+        rotation = target["rotation"]
+
+        if profile_name not in profile_ids:
             print(f"ERROR: unable to find profile id for '{profile_name}'")
-            break
-        
-        # HACK: dirty way to handle the profiles and initial creation :(
-        isMosaic = "0"
-        if panelname != "":
-            isMosaic = "1"
-
-        project_data = {}
-        if profile_name.endswith("+ZWO ASI2600MM Pro"):
-            project_data["LRGB"] = {
-                "priority": 0,
-                "ditherevery": 15,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "L",
-                    },
-                    {
-                        "filtername": "R",
-                    },
-                    {
-                        "filtername": "G",
-                    },
-                    {
-                        "filtername": "B",
-                    },
-                ]
-            }
-            project_data["SHO"] = {
-                "priority": 0,
-                "ditherevery": 5,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "O",
-                        "filtername": "S",
-                        "filtername": "H",
-                    },
-                ]
-            }
-            if profile_name.startswith("C8@f6.3+"):
-                project_data["LRGB"]["ditherevery"] = 15
-                project_data["SHO"]["ditherevery"] = 5
-            if profile_name.startswith("C8E@f7.0+"):
-                project_data["LRGB"]["ditherevery"] = 15
-                project_data["SHO"]["ditherevery"] = 2
-            elif profile_name.startswith("E120@f7.0+"):
-                project_data["LRGB"]["ditherevery"] = 7
-                project_data["SHO"]["ditherevery"] = 1
-        elif profile_name.endswith("+ATR585M"):
-            project_data["LRGB"] = {
-                "priority": 0,
-                "ditherevery": 10,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "L",
-                    },
-                    {
-                        "filtername": "R",
-                    },
-                    {
-                        "filtername": "G",
-                    },
-                    {
-                        "filtername": "B",
-                    },
-                ]
-            }
-            project_data["SHO"] = {
-                "priority": 0,
-                "ditherevery": 5,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "O",
-                        "filtername": "S",
-                        "filtername": "H",
-                    },
-                ]
-            }
-            if profile_name.startswith("C8@f6.3+"):
-                project_data["LRGB"]["ditherevery"] = 15
-                project_data["SHO"]["ditherevery"] = 5
-            if profile_name.startswith("C8E@f7.0+"):
-                project_data["LRGB"]["ditherevery"] = 15
-                project_data["SHO"]["ditherevery"] = 2
-            elif profile_name.startswith("E120@f7.0+"):
-                project_data["LRGB"]["ditherevery"] = 7
-                project_data["SHO"]["ditherevery"] = 1
-        elif profile_name.endswith("+AP26CC"):
-            project_data["UVIR"] = {
-                "priority": 0,
-                "ditherevery": 5,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "UVIR",
-                    },
-                ]
-            }
-            project_data["LeXtr"] = {
-                "priority": 0,
-                "ditherevery": 4,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "LeXtr",
-                    },
-                ]
-            }
-            project_data["ALPT"] = {
-                "priority": 0,
-                "ditherevery": 4,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "ALPT",
-                    },
-                ]
-            }
-        elif profile_name.endswith("+DWARFIII"):
-            project_data["Astro"] = {
-                "priority": 0,
-                "ditherevery": 0,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "Astro",
-                    },
-                ]
-            }
-            project_data["Dual-Band"] = {
-                "priority": 0,
-                "ditherevery": 0,
-                "isMosaic": isMosaic,
-                "filters": [
-                    {
-                        "filtername": "Dual-Band",
-                    },
-                ]
-            }
-        else:
-            print(f"WARNING: profile not handled!  '{profile_name}'")
-
-        
+            continue
+        profile_id = profile_ids[profile_name]
+
+        project_data = get_project_data(profile_name, target["panelname"])
+        # scheduler targets for this file, to check they still exist next time
+        value["targets"] = []
+
         #print(f"{profile_name}: {targetname}/{panelname} @ {coord_ra} / {coord_dec}")
         for key in project_data.keys():
+            project_name = f"{targetname}+{key}"
             # don't create duplicates
-            select_project = f"""select id 
-                                from project
-                                where profileid='{profile_id}'
-                                and name=\"{targetname}+{key}\"
-                                ;
-                                """
-            c_ts.execute(select_project)
-            row_p=c_ts.fetchone()
-            if row_p is None or len(row_p) == 0:
-                print(f"CREATE profile: {profile_name}/{targetname}+{key}")
+            if (profile_id, project_name) not in projects and (profile_id, project_name) not in insert_projects:
+                print(f"CREATE profile: {profile_name}/{project_name}")
                 # NOTE create all projects as "Active" (state=1)
-                insert_project = f"""insert into project (
-                                    profileid, name, state, priority, createdate, minimumtime, minimumaltitude, 
-                                    usecustomhorizon, horizonoffset, meridianwindow, filterswitchfrequency,
-                                    ditherevery, enablegrader, isMosaic
-                                )
-                                values (
-                                    '{profile_id}',
-                                    \"{targetname}+{key}\",
-                                    1,
-                                    {project_data[key]["priority"]},
-                                    1700839363,
-                                    30, 0, 1, 0, 0, 0,
-                                    {project_data[key]["ditherevery"]},
-                                    0,
-                                    {project_data[key]["isMosaic"]}
-                                );"""
-                c_ts.execute(insert_project)
-
-            select_target = f"""select id, ra, dec, rotation
-                                from target
-                                where name=\"{targetname_with_panel}\"
-                                and projectid in (select id 
-                                    from project
-                                    where profileid='{profile_id}'
-                                    and name=\"{targetname}+{key}\")
-                                ;
-                                """
-            c_ts.execute(select_target)
-            row_p=c_ts.fetchone()
-            if row_p is None or len(row_p) == 0:
-                print(f"CREATE target: {profile_name}/{targetname_with_panel}")
-                insert_target = f"""insert into target (
-                                    name, active, ra, dec, epochcode, rotation, roi, projectid
-                                )
-                                values (
-                                    \"{targetname_with_panel}\",
-                                    1,
-                                    {coord_ra},
-                                    {coord_dec},
-                                    2,
-                                    {rotation},
-                                    100,
-                                    (select id 
-                                        from project
-                                        where profileid='{profile_id}'
-                                        and name=\"{targetname}+{key}\")
-                                );
-                                """
-                c_ts.execute(insert_target)
+                insert_projects[(profile_id, project_name)] = (
+                    profile_id,
+                    project_name,
+                    project_data[key]["priority"],
+                    project_data[key]["ditherevery"],
+                    int(project_data[key]["isMosaic"]),
+                )
+
+            key_target = (profile_id, project_name, targetname_with_panel)
+            value["targets"].append(list(key_target))
+            row_p = targets.get(key_target)
+            if row_p is None:
+                if key_target not in insert_targets:
+                    print(f"CREATE target: {profile_name}/{targetname_with_panel}")
+                insert_targets[key_target] = (targetname_with_panel, coord_ra, coord_dec, rotation)
             else:
                 precision = 6
                 t_id = row_p[0]
@@ -316,14 +393,9 @@ try:
                     print(f"UPDATE target: {profile_name}/{targetname_with_panel}")
                     print(f"\tra     ({row_p[1]} --> {coord_ra})")
                     print(f"\tdec    ({row_p[2]} --> {coord_dec})")
-                    print(f"\rotation({row_p[3]} --> {rotation})")
+                    print(f"\trotation({row_p[3]} --> {rotation})")
                     # update coordinates..
-                    update_target = f"""update target
-                                        set ra={coord_ra},
-                                        dec={coord_dec},
-                                        rotation={rotation}
-                                        where id={t_id};"""
-                    c_ts.execute(update_target)
+                    update_targets[t_id] = (coord_ra, coord_dec, rotation, t_id)
 
             '''
             for filter in project_data[key]["filters"]:
@@ -382,8 +454,31 @@ try:
                                             """
                     c_ts.execute(insert_exposureplan)
                 '''
-            
-            conn_ts.commit()
+
+        synced.append((filename, stat, value))
+
+    with database.transaction(conn_ts):
+        c_ts.executemany("""insert into project (
+                                profileid, name, state, priority, createdate, minimumtime, minimumaltitude,
+                                usecustomhorizon, horizonoffset, meridianwindow, filterswitchfrequency,
+                                ditherevery, enablegrader, isMosaic
+                            )
+                            values (?, ?, 1, ?, 1700839363, 30, 0, 1, 0, 0, 0, ?, 0, ?);""",
+                         list(insert_projects.values()))
+        if len(insert_projects) > 0:
+            c_ts.execute(SELECT_PROJECTS)
+            projects = {(row[0], row[1]): row[2] for row in c_ts.fetchall()}
+        c_ts.executemany("""insert into target (
+                                name, active, ra, dec, epochcode, rotation, roi, projectid
+                            )
+                            values (?, 1, ?, ?, 2, ?, 100, ?);""",
+                         [values + (projects[(key[0], key[1])],) for key, values in insert_targets.items()])
+        c_ts.executemany("update target set ra=?, dec=?, rotation=? where id=?;", list(update_targets.values()))
+
+    # only remember target files once they are in the scheduler database
+    if cache is not None:
+        for filename, stat, value in synced:
+            cache.put(filename, value, stat)
 
     common.backup_scheduler_database()
 
@@ -400,6 +495,9 @@ except sqlite3.Error as e:
         conn_ap.close()
     print(e)
     traceback.print_exc()
+finally:
+    if cache is not None:
+        cache.close()
 
-# RESET for testing
+# RESET for testing, the next run creates everything again (cached target files are checked against the database)
 # delete from exposureplan; delete from target; delete from project;
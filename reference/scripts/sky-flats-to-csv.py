@@ -9,6 +9,7 @@ Command-line Arguments:
     --output_csv (str): Path to the CSV file for output. Defaults to a predefined path.
     --debug (bool): If set, enables debug mode for verbose output.
     --dryrun (bool): If set, simulates the process without writing to the CSV file.
+    --nocache (bool): If set, do not use the local header cache.
 """
 
 import argparse
@@ -22,6 +23,7 @@ parser.add_argument("--input_dir", type=str, help="directory to search for image
 parser.add_argument("--output_csv", type=str, help="csv file to output results", default=common.DIRECTORY_ROOT_RAW_FLAT+os.path.sep+"sky-flats-analysis.csv")
 parser.add_argument("--debug", action='store_true')
 parser.add_argument("--dryrun", action='store_true')
+parser.add_argument("--nocache", action='store_true', help="do not use the local header cache")
 
 # treat args parsed as a dictionary
 args = vars(parser.parse_args())
@@ -30,6 +32,10 @@ user_input_dir = args["input_dir"]
 user_output_csv = args["output_csv"]
 user_debug = args["debug"]
 user_dryrun = args["dryrun"]
+user_nocache = args["nocache"]
+
+if not user_nocache:
+    common.open_header_cache(debug=user_debug)
 
 
 print(f"Reading data for sky flats...")
@@ -45,40 +51,38 @@ data_flats = common.get_filtered_metadata(
 if user_debug:
     print(data_flats)
 
-# convert data to array, drop key since it's already in the 'filename' attribute
-data_flattened = []  # yes, I get this is a bit ironic and possibly confusing. I like it, move along.
-for key in data_flats:
-    datum = data_flats[key]
-    # keep a subset of attributes to make the data easier to work with
-    keep_keys = [
-        "filter",
-        "camera",
-        "optic",
-        "focal_ratio",
-        "date-loc",
-        "sunangle",
-        "centalt",
-        "exposureseconds",
-        "gain",
-        "offset",
-        "moonangl",
-        "settemp",
-        "temp",
-        "ra",
-        "dec",
-        "filename",
-    ]
-    datum_filtered = {}
-    for k in keep_keys:
-        datum_filtered[k] = datum[k]
-    data_flattened.append(datum_filtered)
+# keep a subset of attributes to make the data easier to work with
+keep_keys = [
+    "filter",
+    "camera",
+    "optic",
+    "focal_ratio",
+    "date-loc",
+    "sunangle",
+    "centalt",
+    "exposureseconds",
+    "gain",
+    "offset",
+    "moonangl",
+    "settemp",
+    "temp",
+    "ra",
+    "dec",
+    "filename",
+]
+
+# flatten data to rows, drop key since it's already in the 'filename' attribute.
+# rows are generated as they are written so the output is never built up in memory.
+def flatten(data):
+    for key in data:
+        datum = data[key]
+        yield {k: datum[k] for k in keep_keys}
 
 if user_debug:
-    print(data_flattened)
+    print(list(flatten(data_flats)))
 
 
 print(f"Writing CSV for sky flats...")
 filename_csv = user_output_csv
-data_csv = common.simpleObject_to_csv(data_flattened, output_headers=True)
 with open(filename_csv, "w") as f:
-    f.write(data_csv)
+    common.write_csv(f, flatten(data_flats), columns=keep_keys, output_headers=True)
@@ -4,6 +4,7 @@ It includes classes and methods to process directories and databases for generat
 """
 
 import argparse
+import hashlib
 import json
 import os
 import traceback
@@ -48,9 +49,8 @@ class SummaryData():
             self.db_ap.open()
 
             # for every target (unique per optic/camera!), build csv data and write to target's root directory (parent of 'accept')
-            d = self.from_dir.replace("'", "''")
-            stmt=f"""
-                select o.id, c.id, t.id, t.name, a.panel_name, a.raw_directory, a.date, f.name, f.astrobin_id, a.accepted_count, a.shutter_time_seconds, o.focal_ratio, l.bortle, p.id
+            stmt="""
+                select o.id, c.id, t.id, t.name, a.panel_name, a.raw_directory, a.date, f.name, f.astrobin_id, a.accepted_count, a.shutter_time_seconds, o.focal_ratio, l.bortle, p.id, a.last_updated_date
                 from target t, accepted_data a, filter f, optic o, location l, camera c, profile p
                 where t.id=a.target_id
                 and f.id=a.filter_id
@@ -59,12 +59,13 @@ class SummaryData():
                 and c.id=a.camera_id
                 and p.optic_id=o.id
                 and p.camera_id=c.id
-                and a.raw_directory like '{d}%'
+                and a.raw_directory >= ? and a.raw_directory < ?
                 order by p.id, f.name, a.raw_directory, a.panel_name, f.astrobin_id
                 ;"""
-            data = self.db_ap.select(
+            data = self.db_ap.fetch_iter(
                 stmt=stmt,
-                columns=['optic_id', 'camera_id', 'target_id', 'targetname', 'panelname', 'raw_directory', 'date', 'filter_name', 'filter_astrobinid', 'accepted_count', 'exposureseconds', 'focal_ratio', 'bortle', 'profile_id'],
+                columns=['optic_id', 'camera_id', 'target_id', 'targetname', 'panelname', 'raw_directory', 'date', 'filter_name', 'filter_astrobinid', 'accepted_count', 'exposureseconds', 'focal_ratio', 'bortle', 'profile_id', 'last_updated_date'],
+                params=database.prefix_range(self.from_dir),
             )
             # NOTE the columns are named because of what Astrobin wants!
 
@@ -111,19 +112,39 @@ class SummaryData():
 
         return output
 
+    def fingerprint(self, data: list, want: dict) -> str:
+        """
+        Fingerprint of a target directory's summary inputs: the latest accepted data update, number of accepted data
+        rows and the desired hours.  The summary files only need to be written again if this changes.
+
+        Args:
+            data (list): The target directory's rows from prepare_data.
+            want (dict): Desired hours for the target, see Totals.
+
+        Returns:
+            str: The fingerprint.
+        """
+        last_updated_date = max([str(datum['last_updated_date']) for datum in data])
+        value = json.dumps([last_updated_date, len(data), want], sort_keys=True)
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
 class Astrobin(SummaryData):
 
-    def prepare_csv(self) -> dict[str, str]:
+    def prepare_csv(self, grouped_data: dict=None) -> dict[str, str]:
         """
         Prepare CSV data for Astrobin by translating metadata into CSV format.
 
+        Args:
+            grouped_data (dict): Result of prepare_data, if already available.
+
         Returns:
             dict: A dictionary where the key is the directory and the value is the CSV string.
         """
 
         output = {}
 
-        grouped_data = self.prepare_data()
+        if grouped_data is None:
+            grouped_data = self.prepare_data()
         for target_directory in grouped_data.keys():
             translated_data = []
             for d in grouped_data[target_directory]:
@@ -141,21 +162,27 @@ class Astrobin(SummaryData):
 
         return output
 
-    def write_csv(self, data: dict[str, str]):
+    def write_csv(self, data: dict[str, str]) -> list[str]:
         """
         Write the prepared CSV data to files in the corresponding directories.
+        Files that already have the same content are not written.
 
         Args:
             data (dict): A dictionary where the key is the directory and the value is the CSV string.
+
+        Returns:
+            list: The directories where the file is up to date (written or unchanged).
         """
 
+        output = []
         for directory in data.keys():
             data_csv = data[directory]
             filename_csv=os.path.join(directory, FILENAME_CSV)
             if not self.dryrun:
                 try:
-                    with open(filename_csv, "w") as f:
-                        f.write(data_csv)
+                    if common.write_file_if_changed(filename_csv, data_csv) and self.debug:
+                        print(f"DEBUG wrote {filename_csv}")
+                    output.append(directory)
                 except Exception as e:
                     print(e)
                     pass
@@ -163,6 +190,7 @@ class Astrobin(SummaryData):
                 print("--------------")
                 print(filename_csv)
                 print(data_csv)
+        return output
 
 class Totals(SummaryData):
     db_ts:database.Scheduler = None
@@ -186,19 +214,28 @@ class Totals(SummaryData):
         self.dryrun = dryrun
 
 
-    def prepare_totals(self) -> dict[str, str]:
+    def prepare_totals(self, grouped_data: dict=None) -> dict[str, str]:
         """
         Prepare totals data by calculating desired, available, and needed hours for each target.
 
+        Args:
+            grouped_data (dict): Result of prepare_data, if already available.
+
         Returns:
             dict: A dictionary where the key is the directory and the value is a dictionary of totals.
         """
 
+        if grouped_data is None:
+            grouped_data = self.prepare_data()
+
         try:
             self.db_ts.open() # to get desired hours
 
             output = {}
-            grouped_data = self.prepare_data()
+            # desired hours for all targets in one query
+            desired = self.db_ts.GetDesiredHoursByTarget(
+                [(data[0]['profile_id'], data[0]['targetname']) for data in grouped_data.values()]
+            )
             for target_directory in grouped_data.keys():
                 totals = {
                     'have': {
@@ -215,7 +252,7 @@ class Totals(SummaryData):
                     },
                 }
                 # want
-                wanted = self.db_ts.GetDesiredHours(grouped_data[target_directory][0]['profile_id'], grouped_data[target_directory][0]['targetname'])
+                wanted = desired[(grouped_data[target_directory][0]['profile_id'], grouped_data[target_directory][0]['targetname'])]
                 for filtername in wanted.keys():
                     totals['want'][filtername] = wanted[filtername]
                     totals['want']['total'] += totals['want'][filtername]
@@ -250,14 +287,19 @@ class Totals(SummaryData):
 
         return output
 
-    def write_totals(self, data: dict[str, str]):
+    def write_totals(self, data: dict[str, str]) -> list[str]:
         """
         Write the prepared totals data to files in the corresponding directories.
+        Files that already have the same content are not written.
 
         Args:
             data (dict): A dictionary where the key is the directory and the value is the totals data.
+
+        Returns:
+            list: The directories where the file is up to date (written or unchanged).
         """
 
+        output = []
         for directory in data.keys():
             totals = data[directory]
             filename_total=os.path.join(directory, FILENAME_TOTALS)
@@ -269,8 +311,9 @@ class Totals(SummaryData):
                 data_total += f"{key} = {value}\n"
             if not self.dryrun:
                 try:
-                    with open(filename_total, "w") as f:
-                        f.write(json.dumps(totals, indent=4))
+                    if common.write_file_if_changed(filename_total, json.dumps(totals, indent=4)) and self.debug:
+                        print(f"DEBUG wrote {filename_total}")
+                    output.append(directory)
                 except Exception as e:
                     print(e)
                     pass
@@ -278,6 +321,7 @@ class Totals(SummaryData):
                 print("--------------")
                 print(filename_total)
                 print(data_total)
+        return output
 
 class Metadata():
     pass
@@ -294,6 +338,7 @@ if __name__ == "__main__":
     parser.add_argument("--fromdir", required=True, type=str, help="directory to search for images")
     parser.add_argument("--debug", action='store_true')
     parser.add_argument("--dryrun", action='store_true')
+    parser.add_argument("--force", action='store_true', help="write summaries for all targets, not only the ones that changed")
 
     # treat args parsed as a dictionary
     args = vars(parser.parse_args())
@@ -301,22 +346,57 @@ if __name__ == "__main__":
     user_fromdir = args["fromdir"]
     user_debug = args["debug"]
     user_dryrun = args["dryrun"]
+    user_force = args["force"]
+
+    db_ap = database.Astrophotgraphy(common.DATABASE_ASTROPHOTGRAPHY)
 
     a = Astrobin(
-        db_ap=database.Astrophotgraphy(common.DATABASE_ASTROPHOTGRAPHY),
+        db_ap=db_ap,
         from_dir=user_fromdir,
         debug=user_debug,
         dryrun=user_dryrun,
     )
-    data=a.prepare_csv()
-    a.write_csv(data)
-
     t = Totals(
-        db_ap=database.Astrophotgraphy(common.DATABASE_ASTROPHOTGRAPHY),
+        db_ap=db_ap,
         db_ts=database.Scheduler(common.DATABASE_TARGET_SCHEDULER),
         from_dir=user_fromdir,
         debug=user_debug,
         dryrun=user_dryrun,
     )
-    data=t.prepare_totals()
-    t.write_totals(data)
\ No newline at end of file
+
+    # query the accepted data once for both the astrobin csv and the totals
+    grouped_data=a.prepare_data()
+
+    totals=t.prepare_totals(grouped_data)
+
+    # only targets with new or changed data (or desired hours) get their summary files written
+    fingerprints = {}
+    for target_directory in grouped_data.keys():
+        fingerprints[target_directory] = a.fingerprint(grouped_data[target_directory], totals[target_directory]['want'])
+    # the summary table is only written (and created) when not in dryrun
+    db_summary = database.Astrophotgraphy(common.DATABASE_ASTROPHOTGRAPHY, dryrun=user_dryrun)
+    try:
+        db_summary.open()
+        db_summary.UpgradeSchema()
+        previous = db_summary.GetSummaryFingerprints(list(fingerprints.keys()))
+    finally:
+        db_summary.close()
+    changed = []
+    for target_directory in grouped_data.keys():
+        if (user_force or previous.get(target_directory) != fingerprints[target_directory]
+                or not os.path.isfile(os.path.join(target_directory, FILENAME_CSV))
+                or not os.path.isfile(os.path.join(target_directory, FILENAME_TOTALS))):
+            changed.append(target_directory)
+    print(f"{len(changed)} of {len(grouped_data)} targets changed")
+
+    data=a.prepare_csv({d: grouped_data[d] for d in changed})
+    written_csv=a.write_csv(data)
+
+    written_totals=t.write_totals({d: totals[d] for d in changed})
+
+    if not user_dryrun:
+        try:
+            db_summary.open()
+            db_summary.WriteSummaryFingerprints({d: fingerprints[d] for d in changed if d in written_csv and d in written_totals})
+        finally:
+            db_summary.close()
\ No newline at end of file
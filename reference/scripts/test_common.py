@@ -1,15 +1,121 @@
 import unittest
 
+import io
 import json
+import random
+import re
+import shutil
+import tempfile
+import tracemalloc
 import traceback
 import xisf
 import os
 from astropy.io import fits
 
 import common
+import filecache
+import metadatatable
 
 DIRECTORY_TEST_DATA = os.path.join(os.getcwd(), "test_data")
 
+def legacy_get_file_headers(filename: str, profileFromPath: bool, objectFromPath=True, normalize=True):
+    """
+    Original (unoptimized) implementation of common.get_file_headers, used as the reference in differential tests.
+    """
+    output = {
+        "filename": filename, # before any name manipulations
+    }
+
+    # SPECIAL CASES:
+    # SET-TEMP: A key with a dash.  Thanks NINA.  Handle it before parsing by removing the dash.
+    if "SET-TEMP" in filename:
+        filename = filename.replace("SET-TEMP", "SETTEMP")
+
+    # Hate special cases so it is optional.
+    # Pick OBJECT from the path.  Is the beginning of the dir that is _parent_ of "accept".
+    if objectFromPath and common.DIRECTORY_ACCEPT in filename:
+        # inject OBJECT_ at beginning of path before accept.
+        # do this by splitting path and finding accept
+        filename_split = filename.split(os.sep)
+        filename_new = []
+        for i in range(0, len(filename_split)-1):
+            icurr = filename_split[i]
+            inext = filename_split[i+1]
+            if inext == common.DIRECTORY_ACCEPT:
+                filename_new.append(f"OBJECT_{icurr}")
+            else:
+                filename_new.append(icurr)
+        filename_new.append(filename_split[-1])
+        filename=os.sep.join(filename_new)
+
+    # Pick Profile (optic, focal ratio, camera) from path.
+    if profileFromPath:
+        m = re.match("(.*[\\\\\\/])([^@]*)@f([^+]*)[+]([^\\\\\\/]*)([\\\\\\/].*)", filename)
+        if m and m.groups() and len(m.groups()) == 5:
+            # rebuild path by injecting property prefixes
+            p = m.groups()
+            filename=f"{p[0]}TELESCOP_{p[1]}_FOCRATIO_{p[2]}_INSTRUME_{p[3]}{p[4]}"
+
+    # just get the headers from the filename itself
+    # don't be picky.  get EVERYTHING that could match
+    for chunk in os.path.splitext(filename)[0].split(os.sep):
+        #print(f"chunk={chunk}")
+        m1 = re.split("[_]", chunk)
+        for i in range(1, len(m1)):
+            k = m1[i-1]
+            v = m1[i]
+            #print(f"k={k}, v={v}")
+            if not str.isnumeric(k) and k not in output:
+                output[k] = v
+        for x in m1:
+            #print(f"x={x}")
+            if "-" in x:
+                m2 = re.split("[-]", x)
+                k = m2[0]
+                v = "-".join(m2[1:])
+                if not str.isnumeric(k) and k not in output and v is not None:
+                    #print(f"m2: k={k}, v={v}")
+                    output[k] = v
+
+    # SPECIAL CASES:
+    # .CR2: If extension is .cr2 and TYPE is not already set, default TYPE to LIGHT
+    if filename.endswith(".cr2") and "TYPE" not in output:
+        output["TYPE"] = "LIGHT"
+
+    # SET-TEMP: The dash was previously removed.  Add it back.
+    if "SETTEMP" in output:
+        output['SET-TEMP'] = output['SETTEMP']
+
+    # EXPOSURE: Value may end in "s", starting Dec 2023.  Thanks NINA.
+    if "EXPOSURE" in output and "s" in output['EXPOSURE']:
+        output['EXPOSURE'] = output['EXPOSURE'].replace("s", "")
+
+    if normalize:
+        output = common.normalize_headers(output)
+
+    return output
+
+
+def legacy_get_filenames(dirs: list, patterns=[".*\\.fits$"], recursive=False):
+    """
+    Original (unoptimized) implementation of common.get_filenames without zip support, used as the reference in differential tests.
+    """
+    filenames = []
+    for pattern in patterns:
+        for dir in dirs:
+            dir=common.replace_env_vars(dir)
+            if not recursive:
+                for filename in (filename for filename in os.listdir(dir) if re.search(pattern, filename)):
+                    filenames.append(os.path.join(dir, filename))
+            else:
+                for root, _, f_names in os.walk(dir):
+                    for filename in (filename for filename in f_names if re.search(pattern, filename)):
+                        # special cases to ignore...
+                        if "_stash" in root:
+                            continue
+                        filenames.append(os.path.join(root, filename))
+    return filenames
+
 class Test_env_vars(unittest.TestCase):
     def test_replace_env_vars(self):
         filename=r"%AppData%"
@@ -494,6 +600,57 @@ class Test_schedulerdb(unittest.TestCase):
         status = common.project_status_from_path(filename)
         self.assertEqual(status, 3)
 
+class Test_get_directory_parts(unittest.TestCase):
+    def test_full(self):
+        path = os.sep.join(["F:", "Data", "SQA55@f4.8+ATR585M", "20_Data", "Sadr Region Panel 2", "accept", "DATE_2024-01-05", "FILTER_Ha_EXP_300.00_PANEL_2"])
+        parts = common.get_directory_parts(path)
+        self.assertEqual(parts["rig"], "SQA55@f4.8+ATR585M")
+        self.assertEqual(parts["stage"], "20_Data")
+        self.assertEqual(parts["target"], "Sadr Region")
+        self.assertEqual(parts["panel"], "2")
+        self.assertEqual(parts["date"], "2024-01-05")
+        self.assertEqual(parts["target_directory"], os.sep.join(["F:", "Data", "SQA55@f4.8+ATR585M", "20_Data", "Sadr Region Panel 2"]))
+
+    def test_windows(self):
+        parts = common.get_directory_parts(r"C:\Something\30_Master\My Target\accept\DATE_2023-12-12")
+        self.assertIsNone(parts["rig"])
+        self.assertEqual(parts["stage"], "30_Master")
+        self.assertEqual(parts["target"], "My Target")
+        self.assertEqual(parts["panel"], "")
+        self.assertEqual(parts["date"], "2023-12-12")
+        self.assertEqual(parts["target_directory"], r"C:\Something\30_Master\My Target")
+
+    def test_stage_matches_status(self):
+        for stage in common.DIRECTORY_STAGES:
+            path = os.sep.join(["C:", "rig@f1+cam", stage, "Target", "accept", "DATE_2023-12-12"])
+            self.assertEqual(common.get_directory_parts(path)["stage"], stage)
+
+    def test_unknown(self):
+        parts = common.get_directory_parts(os.sep.join(["C:", "Something", "Unknown", "My Target"]))
+        for key in ["rig", "stage", "target", "panel", "date", "target_directory"]:
+            self.assertIsNone(parts[key])
+
+
+class Test_write_file_if_changed(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "totals.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        self.assertTrue(common.write_file_if_changed(self.filename, "a\nb\n"))
+        st = os.stat(self.filename)
+        self.assertFalse(common.write_file_if_changed(self.filename, "a\nb\n"))
+        self.assertEqual(os.stat(self.filename).st_mtime_ns, st.st_mtime_ns)
+        self.assertTrue(common.write_file_if_changed(self.filename, "a\n"))
+        with open(self.filename, "r") as f:
+            self.assertEqual(f.read(), "a\n")
+        # nothing left behind
+        self.assertEqual(os.listdir(self.tmpdir), ["totals.txt"])
+
+
 class Test_csv(unittest.TestCase):
     def test_simpleObject_to_csv_withHeader(self):
         data = [{"key1": "1value1", "key2": "1value2"}, {"key1": "2value1", "key2": "2value2"}]
@@ -510,6 +667,24 @@ class Test_csv(unittest.TestCase):
         csv = common.simpleObject_to_csv(data=data, output_headers=True)
         self.assertEqual(csv, "key1,key2,key3\n1value1,1value2,\n,2value2,2value3\n")
 
+    def test_simpleObject_to_csv_quoted(self):
+        data = [{"key1": "a,b", "key2": 'say "hi"', "key3": None}]
+        csv = common.simpleObject_to_csv(data=data, output_headers=True)
+        self.assertEqual(csv, 'key1,key2,key3\n"a,b","say ""hi""",None\n')
+
+    def test_simpleObject_to_csv_empty(self):
+        csv = common.simpleObject_to_csv(data=[], output_headers=True)
+        self.assertEqual(csv, "")
+
+    def test_write_csv_generator(self):
+        def rows():
+            for i in range(1, 3):
+                yield {"key1": f"{i}value1", "key2": f"{i}value2"}
+        output = io.StringIO()
+        count = common.write_csv(output, rows(), columns=["key2", "key1"], output_headers=True)
+        self.assertEqual(count, 2)
+        self.assertEqual(output.getvalue(), "key2,key1\n1value2,1value1\n2value2,2value1\n")
+
 class Test_get_metadata(unittest.TestCase):
     def test_enrich_metadata_cr2(self):
         filename="some.cr2"
@@ -921,6 +1096,787 @@ class Test_copy_calibration(unittest.TestCase):
         self.assertEqual(len(output), 0)
 
 
+class Test_header_cache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fits_filename = os.path.join(self.tmpdir, "IMAGETYP_LIGHT_EXPOSURE_30.fits")
+        self._write_fits("M 31")
+        common.close_header_cache()
+        self.cache = common.open_header_cache(db_filename=os.path.join(self.tmpdir, "cache.sqlite"))
+
+    def tearDown(self):
+        common.close_header_cache()
+        shutil.rmtree(self.tmpdir)
+
+    def _write_fits(self, object):
+        hdu = fits.PrimaryHDU()
+        hdu.header['OBJECT'] = object
+        hdu.header['GAIN'] = 100
+        hdu.writeto(self.fits_filename, overwrite=True)
+
+    def _metadata(self):
+        return common.get_metadata(
+            dirs=[self.tmpdir],
+            patterns=[".*\\.fits$"],
+            profileFromPath=False,
+        )[self.fits_filename]
+
+    def test_cache_hit(self):
+        first = self._metadata()
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 0)
+        second = self._metadata()
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second['targetname'], "M 31")
+        self.assertEqual(second['gain'], "100")
+
+    def test_cache_invalidated_on_change(self):
+        self._metadata()
+        st = os.stat(self.fits_filename)
+        self._write_fits("M 33")
+        # make sure mtime moves even on coarse filesystems
+        os.utime(self.fits_filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        output = self._metadata()
+        self.assertEqual(output['targetname'], "M 33")
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_cache_persisted(self):
+        expected = self._metadata()
+        common.close_header_cache()
+        self.cache = common.open_header_cache(db_filename=os.path.join(self.tmpdir, "cache.sqlite"))
+        self.assertEqual(self._metadata(), expected)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_cache_eviction(self):
+        cache = filecache.FileCache(":memory:", max_entries=2)
+        cache.open()
+        for i in range(0, 4):
+            filename = os.path.join(self.tmpdir, f"{i}.txt")
+            with open(filename, "w") as f:
+                f.write(str(i))
+            cache.put(filename, {"i": i})
+        # touch the oldest so it survives
+        self.assertEqual(cache.get(os.path.join(self.tmpdir, "0.txt")), {"i": 0})
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual(cache.count(), 2)
+        self.assertIsNotNone(cache.get(os.path.join(self.tmpdir, "0.txt")))
+        self.assertIsNotNone(cache.get(os.path.join(self.tmpdir, "3.txt")))
+        self.assertIsNone(cache.get(os.path.join(self.tmpdir, "1.txt")))
+        cache.close()
+
+    def test_cache_peek(self):
+        cache = filecache.FileCache(":memory:", table="targets")
+        cache.open()
+        filename = os.path.join(self.tmpdir, "target.json")
+        with open(filename, "w") as f:
+            f.write("{}")
+        self.assertIsNone(cache.peek(filename))
+        cache.put(filename, {"sha256": "abc"})
+        st = os.stat(filename)
+        os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        # stale for get but still there to compare with
+        self.assertEqual(cache.peek(filename), {"sha256": "abc"})
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.assertIsNone(cache.get(filename))
+        self.assertIsNone(cache.peek(filename))
+        cache.close()
+
+    def test_cache_version_per_table(self):
+        db_filename = os.path.join(self.tmpdir, "shared.sqlite")
+        filename = os.path.join(self.tmpdir, "target.json")
+        with open(filename, "w") as f:
+            f.write("{}")
+        for table in ["headers", "targets"]:
+            cache = filecache.FileCache(db_filename, table=table)
+            cache.open()
+            cache.put(filename, {"table": table})
+            cache.close()
+
+        class NewFileCache(filecache.FileCache):
+            SCHEMA_VERSION = filecache.FileCache.SCHEMA_VERSION + 1
+
+        # every table sharing the file is rebuilt, not only the first one opened
+        for table in ["headers", "targets"]:
+            cache = NewFileCache(db_filename, table=table)
+            cache.open()
+            self.assertEqual(cache.count(), 0)
+            cache.put(filename, {"table": table})
+            cache.close()
+        # and only once
+        cache = NewFileCache(db_filename, table="targets")
+        cache.open()
+        self.assertEqual(cache.get(filename), {"table": "targets"})
+        cache.close()
+
+class Test_parallel_enrich(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for i in range(0, 20):
+            hdu = fits.PrimaryHDU()
+            hdu.header['OBJECT'] = f"M {i % 3}"
+            hdu.header['IMAGETYP'] = "LIGHT"
+            hdu.header['EXPOSURE'] = 10 * i
+            hdu.writeto(os.path.join(self.tmpdir, f"frame_{i:03d}.fits"))
+
+    def tearDown(self):
+        common.close_header_cache()
+        shutil.rmtree(self.tmpdir)
+
+    def _metadata(self, workers, pool="thread"):
+        return common.get_metadata(
+            dirs=[self.tmpdir],
+            patterns=[".*\\.fits$"],
+            required_properties=['exposureseconds'],
+            profileFromPath=False,
+            workers=workers,
+            pool=pool,
+        )
+
+    def test_threads_same_as_serial(self):
+        expected = self._metadata(workers=0)
+        output = self._metadata(workers=4)
+        self.assertEqual(list(output.keys()), list(expected.keys()))
+        self.assertEqual(output, expected)
+
+    def test_processes_same_as_serial(self):
+        expected = self._metadata(workers=0)
+        output = self._metadata(workers=2, pool="process")
+        self.assertEqual(output, expected)
+
+    def test_threads_with_cache(self):
+        expected = self._metadata(workers=0)
+        cache = common.open_header_cache(db_filename=os.path.join(self.tmpdir, "cache.sqlite"))
+        self.assertEqual(self._metadata(workers=4), expected)
+        self.assertEqual(cache.misses, 20)
+        self.assertEqual(self._metadata(workers=4), expected)
+        self.assertEqual(cache.hits, 20)
+
+    def test_iter_file_headers_order(self):
+        filenames = sorted(common.get_filenames(dirs=[self.tmpdir], patterns=[".*\\.fits$"]))
+        output = [f for f, _ in common.iter_file_headers(filenames, workers=3)]
+        self.assertEqual(output, filenames)
+
+    def test_invalid_pool(self):
+        with self.assertRaises(Exception):
+            list(common.iter_file_headers(["x.fits", "y.fits"], workers=2, pool="bogus"))
+
+class Test_fits_header_reader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_fits(self, name, cards, data=None):
+        hdu = fits.PrimaryHDU(data=data)
+        for k, v in cards:
+            hdu.header.append((k, v), end=True)
+        filename = os.path.join(self.tmpdir, name)
+        hdu.writeto(filename)
+        return filename
+
+    def _assert_parity(self, filename, fast=True):
+        expected = common.read_fits_file_headers_astropy(filename)
+        parsed = common.parse_fits_header_cards(common.read_fits_header_cards(filename))
+        if fast:
+            self.assertIsNotNone(parsed)
+            self.assertEqual(list(parsed.items()), list(expected.items()))
+        else:
+            self.assertIsNone(parsed)
+        self.assertEqual(common.read_fits_file_headers(filename), expected)
+
+    def test_nina_like(self):
+        import numpy
+        filename = self._write_fits("light.fits", [
+            ("IMAGETYP", "LIGHT"),
+            ("EXPOSURE", 30.0),
+            ("EXPTIME", 30),
+            ("DATE-OBS", "2024-01-05T03:04:05.123"),
+            ("XBINNING", 1),
+            ("GAIN", 100),
+            ("OFFSET", 50),
+            ("CCD-TEMP", -9.9),
+            ("SET-TEMP", -10.0),
+            ("SITELAT", 35.61234567),
+            ("SITELONG", -78.812345),
+            ("OBJECT", "Sadr's Region Panel 1"),
+            ("FILTER", "Ha"),
+            ("TELESCOP", "SQA55"),
+            ("INSTRUME", "ATR585M"),
+            ("READOUTM", "Normal"),
+            ("BAYERPAT", ""),
+            ("ROWORDER", "TOP-DOWN"),
+            ("EQUINOX", 2000.0),
+            ("SMALL", 1.5e-20),
+            ("BIG", 12345678901234567890),
+            ("NEG", -42),
+            ("FLAG", False),
+            ("COMMENT", "first comment"),
+            ("HISTORY", "some history"),
+            ("COMMENT", "second comment"),
+        ], data=numpy.zeros((10, 10), dtype=numpy.uint16))
+        self._assert_parity(filename)
+
+    def test_multiple_blocks(self):
+        cards = [(f"KEY{i}", f"value {i}") for i in range(0, 100)]
+        filename = self._write_fits("big.fits", cards)
+        self._assert_parity(filename)
+
+    def test_fallback_continue(self):
+        filename = self._write_fits("long.fits", [("LONGSTR", "x" * 200)])
+        self._assert_parity(filename, fast=False)
+
+    def test_fallback_hierarch(self):
+        filename = self._write_fits("hierarch.fits", [("HIERARCH SOME LONG KEY", 1)])
+        self._assert_parity(filename, fast=False)
+
+    def test_not_fits(self):
+        filename = os.path.join(self.tmpdir, "short.fits")
+        with open(filename, "wb") as f:
+            f.write(b"SIMPLE  =                    T")
+        self.assertIsNone(common.read_fits_header_cards(filename))
+
+    def test_test_data(self):
+        # parity on any FITS test data that is available
+        if not os.path.isdir(DIRECTORY_TEST_DATA):
+            self.skipTest("no test data")
+        for filename in common.get_filenames(dirs=[DIRECTORY_TEST_DATA], patterns=[".*\\.fits$"], recursive=True):
+            self.assertEqual(common.read_fits_file_headers(filename), common.read_fits_file_headers_astropy(filename))
+
+class Test_xisf_header_reader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_xisf(self, name, keywords):
+        import numpy
+        fits_keywords = {}
+        for k, v in keywords:
+            fits_keywords.setdefault(k, []).append({"value": v, "comment": ""})
+        filename = os.path.join(self.tmpdir, name)
+        xisf.XISF.write(filename, numpy.zeros((8, 8, 1), dtype=numpy.float32), image_metadata={"FITSKeywords": fits_keywords})
+        return filename
+
+    def _assert_parity(self, filename):
+        expected = common.read_xisf_file_headers_xisf(filename)
+        parsed = common.read_xisf_header_keywords(filename)
+        self.assertIsNotNone(parsed)
+        self.assertEqual(list(parsed.items()), list(expected.items()))
+        self.assertEqual(common.read_xisf_file_headers(filename), expected)
+
+    def test_master(self):
+        filename = self._write_xisf("masterDark.xisf", [
+            ("IMAGETYP", "'Master Dark'"),
+            ("EXPOSURE", "300.00"),
+            ("SET-TEMP", "-10.00"),
+            ("INSTRUME", "'ATR585M  '"),
+            ("GAIN", "100"),
+            ("OFFSET", "50"),
+            ("HISTORY", "'ImageIntegration.numberOfImages: 30'"),
+            ("HISTORY", "'ImageIntegration.pixelCombination: average'"),
+            ("OBJECT", "'Sadr''s Region'"),
+            ("EMPTY", "''"),
+            ("EMPTY", "'not used, first value wins'"),
+            ("GAIN", "200"),
+        ])
+        self._assert_parity(filename)
+        output = common.read_xisf_file_headers(filename)
+        self.assertNotIn("HISTORY", output)
+        self.assertNotIn("EMPTY", output)
+        self.assertEqual(output["GAIN"], "100")
+        self.assertEqual(output["INSTRUME"], "ATR585M")
+
+    def test_headers_override(self):
+        filename = self._write_xisf("masterFlat_FILTER_Ha.xisf", [
+            ("IMAGETYP", "'Master Flat'"),
+            ("FILTER", "'O'"),
+        ])
+        expected = common.get_xisf_headers(filename, profileFromPath=False, file_naming_override=True,
+                                           headers=common.read_xisf_file_headers_xisf(filename))
+        output = common.get_xisf_headers(filename, profileFromPath=False, file_naming_override=True)
+        self.assertEqual(output, expected)
+        self.assertEqual(output["type"], "MASTER FLAT")
+
+    def test_not_xisf(self):
+        filename = os.path.join(self.tmpdir, "bogus.xisf")
+        with open(filename, "wb") as f:
+            f.write(b"SIMPLE  =                    T")
+        self.assertIsNone(common.read_xisf_header_keywords(filename))
+
+    def test_test_data(self):
+        # parity on any XISF test data that is available
+        if not os.path.isdir(DIRECTORY_TEST_DATA):
+            self.skipTest("no test data")
+        for filename in common.get_filenames(dirs=[DIRECTORY_TEST_DATA], patterns=[".*\\.xisf$"], recursive=True):
+            self.assertEqual(common.read_xisf_file_headers(filename), common.read_xisf_file_headers_xisf(filename))
+
+class Test_file_headers_differential(unittest.TestCase):
+    # building blocks for paths, biased toward what shows up in real data plus the special cases
+    TOKENS = [
+        "SQA55@f4.8+ATR585M", "C8E@f7.0+ZWO ASI2600MM Pro", "@f", "+", "@", "_", "-", "__", "--",
+        "accept", "10_Blink", "20_Data", "DATE_2024-01-05", "FILTER_Ha_EXP_300.00_SETTEMP_-10.00",
+        "SET-TEMP_-10.00", "SET-TEMP", "PANEL_1", "EXPOSURE_30.00s", "EXPOSURE_30s", "GAIN_100", "gain-100",
+        "123", "123_456", "M 31", "Sadr's Region", "filename_x", "TYPE_LIGHT", "OBJECT_M 42", "x.y", ".",
+        "2024-01-05_03-04-05_HFR_1.23_STARS_100_RMSAC_0.5_TEMP_-9.90", "\\", "/",
+    ]
+    EXTENSIONS = [".fits", ".cr2", ".xisf", "", ".tar.gz", "."]
+
+    def _random_path(self, rng):
+        components = []
+        for _ in range(0, rng.randint(0, 7)):
+            components.append("".join(rng.choice(self.TOKENS) for _ in range(0, rng.randint(1, 3))))
+        leaf = "".join(rng.choice(self.TOKENS) for _ in range(0, rng.randint(0, 3))) + rng.choice(self.EXTENSIONS)
+        if rng.random() < 0.05:
+            leaf = common.DIRECTORY_ACCEPT
+        if rng.random() < 0.01:
+            leaf += "\n"
+        return os.sep.join(components + [leaf])
+
+    def _assert_same(self, filename, profileFromPath, objectFromPath, normalize):
+        try:
+            expected = legacy_get_file_headers(filename, profileFromPath=profileFromPath, objectFromPath=objectFromPath, normalize=normalize)
+        except Exception as e:
+            with self.assertRaises(type(e), msg=filename):
+                common.get_file_headers(filename, profileFromPath=profileFromPath, objectFromPath=objectFromPath, normalize=normalize)
+            return
+        output = common.get_file_headers(filename, profileFromPath=profileFromPath, objectFromPath=objectFromPath, normalize=normalize)
+        self.assertEqual(list(output.items()), list(expected.items()), msg=filename)
+
+    def test_generated_paths(self):
+        rng = random.Random(20240105)
+        for _ in range(0, 5000):
+            filename = self._random_path(rng)
+            for profileFromPath in [True, False]:
+                for objectFromPath in [True, False]:
+                    self._assert_same(filename, profileFromPath, objectFromPath, normalize=False)
+
+    def test_generated_paths_normalized(self):
+        rng = random.Random(42)
+        for _ in range(0, 1000):
+            self._assert_same(self._random_path(rng), True, True, normalize=True)
+
+    def test_realistic_paths(self):
+        for filename in [
+            os.sep.join(["F:", "Astrophotography", "Data", "SQA55@f4.8+ATR585M", "20_Data", "Sadr Region Panel 2", "accept", "DATE_2024-01-05", "FILTER_Ha_EXP_300.00_SETTEMP_-10.00_PANEL_2", "2024-01-05_03-04-05_HFR_1.23_STARS_100_RMSAC_0.5_TEMP_-9.90.fits"]),
+            os.sep.join(["E:", "RAW", "C8E@f7.0+ATR585M", "M 42_15s60_Astro_20250413-193110677_27C.fits"]),
+            os.sep.join(["RAW", "LIGHT", "2024-01-05", "LIGHT_SET-TEMP_-10.00_GAIN_100_EXPOSURE_30.00s.cr2"]),
+            "no_separator_EXPOSURE_30.fits",
+        ]:
+            for profileFromPath in [True, False]:
+                for objectFromPath in [True, False]:
+                    self._assert_same(filename, profileFromPath, objectFromPath, normalize=False)
+                    self._assert_same(filename, profileFromPath, objectFromPath, normalize=True)
+
+class Test_get_filenames_walker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        files = [
+            "a.fits", "b.cr2", "c.xisf", "d.fits.txt", "e.FITS",
+            os.path.join("t1", "DATE_2024-01-01", "x.fits"),
+            os.path.join("t1", "DATE_2024-01-01", "y.cr2"),
+            os.path.join("t1", "accept", "z.fits"),
+            os.path.join("t1", "_stash", "s.fits"),
+            os.path.join("t1", "_stash", "deeper", "s2.fits"),
+            os.path.join("t2_stash", "s3.fits"),
+            os.path.join("t3", "dir.fits", "inner.fits"),
+            os.path.join("t3", "a", "b", "c", "deep.cr2"),
+        ]
+        for f in files:
+            filename = os.path.join(self.tmpdir, f)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as fd:
+                fd.write(f)
+        try:
+            # symlinked directories are listed but not followed, same as os.walk
+            os.symlink(os.path.join(self.tmpdir, "t1"), os.path.join(self.tmpdir, "t4link"))
+            os.symlink(os.path.join(self.tmpdir, "a.fits"), os.path.join(self.tmpdir, "link.fits"))
+        except (OSError, NotImplementedError):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_as_legacy(self):
+        for patterns in [[".*\\.fits$"], [".*\\.cr2$", ".*\\.fits$"], [".*\\.fits$", ".*"], [common.INPUT_PATTERN_ALL], ["(?i)\\.fits$", "cr2"]]:
+            for recursive in [True, False]:
+                for dirs in [[self.tmpdir], [self.tmpdir, os.path.join(self.tmpdir, "t1")], [os.path.join(self.tmpdir, "t1", "_stash")]]:
+                    self.assertEqual(
+                        common.get_filenames(dirs=dirs, patterns=patterns, recursive=recursive),
+                        legacy_get_filenames(dirs=dirs, patterns=patterns, recursive=recursive),
+                        msg=f"{patterns} {recursive} {dirs}",
+                    )
+
+    def test_iter_filenames_with_entries(self):
+        output = list(common.iter_filenames(dirs=[self.tmpdir], patterns=[".*\\.cr2$", ".*\\.fits$"], recursive=True, with_entries=True))
+        self.assertTrue(len(output) > 0)
+        for filename, entry in output:
+            self.assertEqual(filename, entry.path)
+            self.assertEqual(entry.stat().st_size, os.stat(filename).st_size)
+        # single traversal yields each file once even if it matches more than one pattern
+        filenames = [f for f, _ in output]
+        self.assertEqual(len(filenames), len(set(filenames)))
+        self.assertFalse(any("_stash" in f for f in filenames))
+
+    def test_exclude(self):
+        # exclude matches anywhere in the path, use the full path so the temp dir name can't match
+        filenames = list(common.iter_filenames(dirs=[self.tmpdir], patterns=[".*"], recursive=True, exclude=[os.path.join(self.tmpdir, "t1"), "_stash"]))
+        self.assertFalse(any(os.sep + "t1" + os.sep in f for f in filenames))
+        self.assertIn(os.path.join(self.tmpdir, "t3", "a", "b", "c", "deep.cr2"), filenames)
+
+    def test_zips(self):
+        import zipfile
+        with zipfile.ZipFile(os.path.join(self.tmpdir, "accept.zip"), "w") as archive:
+            archive.writestr("in_zip.fits", "x")
+            archive.writestr("in_zip.txt", "x")
+        filenames = common.get_filenames(dirs=[self.tmpdir], patterns=[".*\\.fits$"], recursive=False, zips=True)
+        self.assertIn(os.path.join(self.tmpdir, "accept.zip", "in_zip.fits"), filenames)
+        self.assertNotIn(os.path.join(self.tmpdir, "accept.zip", "in_zip.txt"), filenames)
+        self.assertIn(os.path.join(self.tmpdir, "a.fits"), filenames)
+
+class Test_iter_metadata(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for i in range(0, 25):
+            hdu = fits.PrimaryHDU()
+            hdu.header['OBJECT'] = f"M {i % 4}"
+            hdu.header['IMAGETYP'] = "LIGHT" if i % 5 else "DARK"
+            filename = os.path.join(self.tmpdir, f"T{i % 3}", f"EXPOSURE_{i}_{i:03d}.fits")
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            hdu.writeto(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_metadata_same_as_iter(self):
+        expected = common.get_metadata(dirs=[self.tmpdir], recursive=True, required_properties=['type'], profileFromPath=False)
+        output = list(common.iter_metadata(dirs=[self.tmpdir], recursive=True, required_properties=['type'], profileFromPath=False))
+        self.assertEqual([d['filename'] for d in output], list(expected.keys()))
+        self.assertEqual(len(output), 25)
+
+    def test_batches(self):
+        expected = common.get_metadata(dirs=[self.tmpdir], recursive=True, required_properties=['type'], profileFromPath=False)
+        output = list(common.iter_metadata(dirs=[self.tmpdir], recursive=True, required_properties=['type'], profileFromPath=False, batch_size=4))
+        self.assertEqual(len(output), len(expected))
+        for datum in output:
+            self.assertEqual(datum, expected[datum['filename']])
+
+    def test_filtered_batches(self):
+        expected = common.get_filtered_metadata(dirs=[self.tmpdir], recursive=True, filters={"type": "LIGHT"}, required_properties=[], profileFromPath=False)
+        output = list(common.iter_filtered_metadata(dirs=[self.tmpdir], recursive=True, filters={"type": "LIGHT"}, profileFromPath=False, batch_size=7))
+        self.assertEqual(len(output), 20)
+        self.assertEqual(sorted(d['filename'] for d in output), sorted(expected.keys()))
+        for datum in output:
+            self.assertEqual(datum['type'], "LIGHT")
+
+    def test_lazy(self):
+        it = common.iter_metadata(dirs=[self.tmpdir], recursive=True, profileFromPath=False, batch_size=1)
+        first = next(it)
+        self.assertIn(first['targetname'], ["M 0", "M 1", "M 2", "M 3"])
+
+    def test_invalid_filters(self):
+        with self.assertRaises(Exception):
+            list(common.iter_filtered_metadata(dirs=[self.tmpdir], recursive=True, filters={"type": None}, profileFromPath=False))
+
+class Test_FrameMetadata(unittest.TestCase):
+    def setUp(self):
+        self.datum = {
+            "filename": os.path.join("a", "b", "c.fits"),
+            "type": "LIGHT",
+            "camera": "ATR585M",
+            "optic": "SQA55",
+            "focal_ratio": "4.8",
+            "date": "2024-01-05",
+            "datetime": "2024-01-05_03-04-05",
+            "exposureseconds": "300.00",
+            "filter": "H",
+            "settemp": "-10.00",
+            "targetname": "M 31",
+            "panel": "",
+            "hfr": None,
+            "sunangle": "-20.5",
+            "date-loc": "2024-01-05T22:04:05",
+        }
+
+    def test_dict_compatible(self):
+        frame = common.FrameMetadata(self.datum)
+        self.assertEqual(frame, self.datum)
+        self.assertEqual(self.datum, frame)
+        self.assertEqual(len(frame), len(self.datum))
+        self.assertEqual(set(frame.keys()), set(self.datum.keys()))
+        self.assertEqual(frame.to_dict(), self.datum)
+        self.assertIn("hfr", frame)
+        self.assertIsNone(frame["hfr"])
+        self.assertNotIn("rmsac", frame)
+        self.assertNotIn("moonangl", frame)
+        self.assertIsNone(frame.get("rmsac"))
+        self.assertEqual(frame.get("sunangle"), "-20.5")
+        with self.assertRaises(KeyError):
+            frame["rmsac"]
+        with self.assertRaises(KeyError):
+            frame["moonangl"]
+        frame["rmsac"] = "0.5"
+        frame["moonangl"] = "90"
+        self.assertEqual(frame["rmsac"], "0.5")
+        del frame["rmsac"]
+        del frame["moonangl"]
+        self.assertEqual(frame, self.datum)
+
+    def test_interned(self):
+        a = common.FrameMetadata(self.datum)
+        b = common.FrameMetadata(json.loads(json.dumps(self.datum)))
+        self.assertIs(a["camera"], b["camera"])
+        self.assertIs(a["targetname"], b["targetname"])
+
+    def test_filter_metadata(self):
+        data = {self.datum["filename"]: self.datum}
+        compact = {self.datum["filename"]: common.FrameMetadata(self.datum)}
+        for filters in [{"type": "LIGHT"}, {"type": "DARK"}, {"exposureseconds": 300}, {"settemp": -10.0}, {"rmsac": "x"}, {"camera": lambda x: x.startswith("ATR")}]:
+            self.assertEqual(
+                list(common.filter_metadata(compact, filters).keys()),
+                list(common.filter_metadata(data, filters).keys()),
+            )
+
+    def test_normalize_filename(self):
+        self.assertEqual(
+            common.normalize_filename("out", self.datum["filename"], common.FrameMetadata(self.datum), common.DIRECTORY_BLINK),
+            common.normalize_filename("out", self.datum["filename"], self.datum, common.DIRECTORY_BLINK),
+        )
+
+    def test_get_metadata_compact(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for i in range(0, 3):
+                hdu = fits.PrimaryHDU()
+                hdu.header['OBJECT'] = "M 31"
+                hdu.header['SUNANGLE'] = -20.5
+                hdu.writeto(os.path.join(tmpdir, f"IMAGETYP_LIGHT_{i}.fits"))
+            expected = common.get_metadata(dirs=[tmpdir], profileFromPath=False)
+            output = common.get_metadata(dirs=[tmpdir], profileFromPath=False, compact=True)
+            self.assertEqual(output, expected)
+            for datum in output.values():
+                self.assertIsInstance(datum, common.FrameMetadata)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_iter_metadata_compact_peak(self):
+        # headers come from the file names, nothing to enrich so empty files are enough
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for i in range(0, 1000):
+                open(os.path.join(tmpdir, f"IMAGETYP_LIGHT_OBJECT_M31_FILTER_L_EXPOSURE_300.00_GAIN_100_HFR_1.5_{i}.fits"), "w").close()
+            peaks = {}
+            for compact in [False, True]:
+                tracemalloc.start()
+                try:
+                    output = list(common.iter_metadata(dirs=[tmpdir], profileFromPath=False, compact=compact))
+                    peaks[compact] = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                self.assertEqual(len(output), 1000)
+            self.assertLess(peaks[True], peaks[False])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class Test_MetadataTable(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(9)
+        self.data = {}
+        for i in range(0, 500):
+            filename = os.path.join("data", rng.choice(["accept", "raw"]), f"d{i % 7}", f"f{i}.fits")
+            datum = {
+                "filename": filename,
+                "type": rng.choice(["LIGHT", "DARK", "FLAT"]),
+                "filter": rng.choice(["L", "R", "G", "B", None]),
+                "exposureseconds": rng.choice(["60.00", "120.00", "300", "abc"]),
+                "hfr": rng.choice([None, "1.5", "2.25", "3.0", "5"]),
+                "gain": rng.choice(["100", "100.0", "0"]),
+            }
+            # some records don't have every key
+            if i % 11 == 0:
+                del datum["filter"]
+            if i % 13 == 0:
+                del datum["hfr"]
+            self.data[filename] = datum
+        self.table = metadatatable.MetadataTable.from_records(self.data)
+
+    def _filenames(self, table):
+        return table.values("filename")
+
+    def test_filter_parity(self):
+        filter_sets = [
+            {"type": "LIGHT"},
+            {"type": "LIGHT", "filter": "L"},
+            {"filter": "None"},
+            {"exposureseconds": 300},
+            {"exposureseconds": 300.0},
+            {"exposureseconds": "300"},
+            {"gain": 100},
+            {"hfr": lambda v: v is not None and float(v) < 3},
+            {"missing": "anything"},
+        ]
+        for filters in filter_sets:
+            expected = common.filter_metadata(self.data, dict(filters))
+            actual = self.table.filter(filters)
+            self.assertEqual(self._filenames(actual), list(expected.keys()), filters)
+
+    def test_filter_none(self):
+        with self.assertRaises(Exception):
+            self.table.filter({"type": None})
+
+    def test_filter_range(self):
+        actual = self._filenames(self.table.filter({"hfr": (2, 3)}))
+        expected = [f for f, d in self.data.items() if "hfr" not in d or (d["hfr"] is not None and 2 <= float(d["hfr"]) <= 3)]
+        self.assertEqual(actual, expected)
+        actual = self._filenames(self.table.filter({"exposureseconds": (None, 100)}))
+        expected = [f for f, d in self.data.items() if d["exposureseconds"] in ["60.00"]]
+        self.assertEqual(actual, expected)
+
+    def test_numeric(self):
+        values = self.table.numeric("hfr")
+        for value, datum in zip(values, self.data.values()):
+            if datum.get("hfr") is None:
+                self.assertTrue(value != value)
+            else:
+                self.assertEqual(value, float(datum["hfr"]))
+
+    def test_group_by(self):
+        expected = {}
+        for datum in self.data.values():
+            key = (datum["type"], datum.get("filter"))
+            if key not in expected:
+                expected[key] = {"count": 0, "sum_hfr": 0.0}
+            expected[key]["count"] += 1
+            if datum.get("hfr") is not None:
+                expected[key]["sum_hfr"] += float(datum["hfr"])
+        actual = self.table.group_by(["type", "filter"], sum=["hfr"])
+        # groups are in order of first appearance
+        self.assertEqual([(g["type"], g["filter"]) for g in actual], list(expected.keys()))
+        for group in actual:
+            key = (group["type"], group["filter"])
+            self.assertEqual(group["count"], expected[key]["count"])
+            self.assertAlmostEqual(group["sum_hfr"], expected[key]["sum_hfr"])
+
+    def test_group_indices(self):
+        table = self.table
+        table.add_column("directory", [os.path.dirname(f) for f in table.values("filename")])
+        filenames = table.values("filename")
+        expected = {}
+        for filename in self.data.keys():
+            expected.setdefault(os.path.dirname(filename), []).append(filename)
+        actual = table.group_indices(["directory"])
+        self.assertEqual([g["directory"] for g, _ in actual], list(expected.keys()))
+        for group, rows in actual:
+            self.assertEqual([filenames[i] for i in rows], expected[group["directory"]])
+
+    def test_to_records(self):
+        self.assertEqual(self.table.to_records(), list(self.data.values()))
+
+    def test_empty(self):
+        table = metadatatable.MetadataTable.from_records([])
+        self.assertEqual(len(table), 0)
+        self.assertEqual(len(table.filter({"type": "LIGHT"})), 0)
+        self.assertEqual(table.group_by(["type"]), [])
+
+
+class Test_MetadataIndex(unittest.TestCase):
+    keys = ["exposureseconds", "settemp", "camera", "gain", "offset", "readoutmode"]
+
+    def setUp(self):
+        rng = random.Random(10)
+        self.values = {
+            "exposureseconds": ["60.00", "120.00", "300.00"],
+            "settemp": ["-10.00", "0.00"],
+            "camera": ["ATR585M", "ASI2600MM"],
+            "gain": ["100", "0"],
+            "offset": ["50", "10"],
+            "readoutmode": ["0", "1"],
+        }
+        self.data = {}
+        for i in range(0, 400):
+            datum = {"type": "MASTER DARK"}
+            for key in self.keys:
+                # some calibration doesn't have every key, it matches anything for that key
+                if rng.random() < 0.1:
+                    continue
+                datum[key] = rng.choice(self.values[key] + [None])
+            self.data[os.path.join("calibration", f"dark{i}.xisf")] = datum
+        self.index = common.MetadataIndex(data=self.data, keys=self.keys)
+
+    def test_lookup_parity(self):
+        rng = random.Random(11)
+        for i in range(0, 200):
+            filters = {}
+            for key in self.keys:
+                filters[key] = rng.choice(self.values[key] + ["None", "other"])
+            expected = common.filter_metadata(self.data, filters)
+            actual = self.index.lookup(filters)
+            self.assertEqual(list(actual.keys()), list(expected.keys()), filters)
+
+    def test_lookup_fallback(self):
+        # different keys or non-string values are not indexed but must still match like filter_metadata
+        filter_sets = [
+            {"exposureseconds": "60.00"},
+            {"exposureseconds": 60, "settemp": "-10.00", "camera": "ATR585M", "gain": "100", "offset": "50", "readoutmode": "0"},
+            {"type": "MASTER DARK", "gain": lambda v: v == "0"},
+        ]
+        for filters in filter_sets:
+            self.assertEqual(list(self.index.lookup(filters).keys()), list(common.filter_metadata(self.data, filters).keys()))
+
+    def test_lookup_invalid(self):
+        with self.assertRaises(Exception):
+            self.index.lookup({})
+        filters = dict((k, self.values[k][0]) for k in self.keys)
+        filters["gain"] = None
+        with self.assertRaises(Exception):
+            self.index.lookup(filters)
+
+
+class Test_find_missing_dirs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dirs = []
+        for target in ["M 31", "M 33", "M 42"]:
+            for date in ["DATE_2024-01-01", "DATE_2024-01-02"]:
+                for filter in ["FILTER_L", "FILTER_R"]:
+                    d = os.path.join(self.tmpdir, target, "accept", date, filter)
+                    os.makedirs(d)
+                    self.dirs.append(d)
+        # whole target is gone, one date is gone and one filter is gone
+        shutil.rmtree(os.path.join(self.tmpdir, "M 33"))
+        shutil.rmtree(os.path.join(self.tmpdir, "M 42", "accept", "DATE_2024-01-02"))
+        shutil.rmtree(os.path.join(self.tmpdir, "M 31", "accept", "DATE_2024-01-01", "FILTER_R"))
+        self.expected = set(d for d in self.dirs if not os.path.isdir(d))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_missing(self):
+        for workers in [0, 4]:
+            self.assertEqual(common.find_missing_dirs(self.dirs, self.tmpdir, workers=workers), self.expected)
+
+    def test_missing_parent_not_checked(self):
+        checked = []
+        isdir = os.path.isdir
+        def counting_isdir(path):
+            checked.append(path)
+            return isdir(path)
+        os.path.isdir = counting_isdir
+        try:
+            self.assertEqual(common.find_missing_dirs(self.dirs, self.tmpdir, workers=0), self.expected)
+        finally:
+            os.path.isdir = isdir
+        self.assertEqual(len(checked), len(set(checked)))
+        self.assertFalse(any(p.startswith(os.path.join(self.tmpdir, "M 33") + os.sep) for p in checked))
+        self.assertNotIn(os.path.join(self.tmpdir, "M 42", "accept", "DATE_2024-01-02", "FILTER_L"), checked)
+
+    def test_root_and_outside(self):
+        outside = os.path.join(self.tmpdir + "-missing", "x")
+        self.assertEqual(common.find_missing_dirs([self.tmpdir, outside], self.tmpdir, workers=0), set([outside]))
+
 
 if __name__ == '__main__':
     unittest.main()
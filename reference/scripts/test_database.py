@@ -1,10 +1,33 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+from pathlib import Path
+
+import common
 import database
+import filecache
+import report
 
-DATABASE_FILENAME=r"test_data\database.sqlite"
+DATABASE_FILENAME=os.path.join("test_data", "database.sqlite")
 
 class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        # test_open creates the database, clean up anything that wasn't there before
+        self.created = []
+        for path in [os.path.dirname(DATABASE_FILENAME), DATABASE_FILENAME]:
+            if not os.path.exists(path):
+                self.created.append(path)
+        Path(os.path.dirname(DATABASE_FILENAME)).mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        for path in reversed(self.created):
+            if os.path.isdir(path):
+                os.rmdir(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
     def test_init(self):
         d = database.Database(DATABASE_FILENAME)
         self.assertFalse(d.isOpen())
@@ -95,5 +118,612 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(stmt, "delete from sometable where name='bob' and location='moon';")
 
 
+class TestConnect(unittest.TestCase):
+    def test_pragmas(self):
+        conn = database.connect(":memory:", database.PRAGMAS_ASTROPHOTOGRAPHY)
+        try:
+            self.assertEqual(conn.execute("PRAGMA cache_size;").fetchone()[0], database.PRAGMAS_ASTROPHOTOGRAPHY["cache_size"])
+            self.assertEqual(conn.execute("PRAGMA temp_store;").fetchone()[0], 2) # MEMORY
+            conn.execute("create table t (name text);")
+            conn.execute("insert into t values ('Abc');")
+            # case_sensitive_like
+            self.assertEqual(conn.execute("select count(*) from t where name like 'abc';").fetchone()[0], 0)
+        finally:
+            conn.close()
+
+    def test_scheduler_pragmas(self):
+        d = database.Scheduler(":memory:")
+        d.open()
+        try:
+            self.assertEqual(d.execute("PRAGMA cache_size;")[0][0], database.PRAGMAS_SCHEDULER["cache_size"])
+        finally:
+            d.close()
+
+    def test_transaction(self):
+        conn = database.connect(":memory:")
+        try:
+            conn.execute("create table t (name text);")
+            conn.commit()
+            with database.transaction(conn):
+                conn.execute("insert into t values ('a');")
+            self.assertFalse(conn.in_transaction)
+            with self.assertRaises(ValueError):
+                with database.transaction(conn):
+                    conn.execute("insert into t values ('b');")
+                    raise ValueError("rollback")
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute("select name from t;").fetchall(), [("a",)])
+        finally:
+            conn.close()
+
+    def test_transaction_nested(self):
+        conn = database.connect(":memory:")
+        try:
+            conn.execute("create table t (name text);")
+            conn.commit()
+            with database.transaction(conn):
+                conn.execute("insert into t values ('a');")
+                with database.transaction(conn):
+                    conn.execute("insert into t values ('b');")
+                # inner scope leaves the outer transaction open
+                self.assertTrue(conn.in_transaction)
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(len(conn.execute("select name from t;").fetchall()), 2)
+        finally:
+            conn.close()
+
+    def test_database_transaction_dryrun(self):
+        d = database.Database(DATABASE_FILENAME, dryrun=True)
+        with d.transaction():
+            self.assertEqual(d.execute("something"), "something")
+        self.assertFalse(d.isOpen())
+
+
+class TestDatabaseParams(unittest.TestCase):
+    def setUp(self):
+        self.db = database.Database(":memory:")
+        self.db.open()
+        self.db.execute("create table sometable (id integer primary key, name text not null, stuff text, last_updated_date DATETIME);")
+        self.db.execute("create unique index sometable1 on sometable(name);")
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_insert_select(self):
+        self.db.insert("sometable", {"name": "Bob's \"Nebula\"", "stuff": None})
+        self.db.insert("sometable", {"name": "M 31", "stuff": "x"})
+        self.db.insert("sometable", {"name": "M 31", "stuff": "y"}, ignoreErrors=True)
+        # None is stored as an empty string, same as insert_stmt
+        self.assertEqual(
+            self.db.select_where(["name", "stuff"], "sometable", {"name": "Bob's \"Nebula\""}),
+            [{"name": "Bob's \"Nebula\"", "stuff": ""}],
+        )
+        self.assertEqual(
+            self.db.select_where(["name", "stuff"], "sometable", {"name": "M %"}),
+            [{"name": "M 31", "stuff": "x"}],
+        )
+
+    def test_insert_select_none(self):
+        values = {"name": "M 31", "stuff": None}
+        self.db.insert("sometable", values)
+        self.db.insert_many("sometable", ["name", "stuff"], [("M 33", None)])
+        # a None value is found (and deleted) with the same dict it was written with
+        self.assertEqual(self.db.select_where(["name", "stuff"], "sometable", values), [{"name": "M 31", "stuff": ""}])
+        self.assertEqual(self.db.select_where(["name"], "sometable", {"name": "M 33", "stuff": None}), [{"name": "M 33"}])
+        self.db.delete("sometable", values)
+        self.assertEqual(self.db.execute("select name from sometable;"), [("M 33",)])
+
+    def test_insert_many(self):
+        self.db.insert_many("sometable", ["name", "stuff"], [("a", "1"), ("b", None), ("a", "2")], ignoreErrors=True)
+        self.assertEqual(self.db.execute("select name, stuff from sometable order by name;"), [("a", "1"), ("b", "")])
+
+    def test_upsert(self):
+        for stuff in ["1", "2"]:
+            self.db.upsert(
+                table="sometable",
+                insert_values={"name": "it's", "stuff": stuff},
+                update_values={"stuff": stuff},
+                conflictColumns=["name"],
+            )
+        self.assertEqual(self.db.execute("select name, stuff from sometable;"), [("it's", "2")])
+
+    def test_delete(self):
+        self.db.insert_many("sometable", ["name"], [("a",), ("it's",)])
+        self.db.delete("sometable", {"name": "it's"})
+        self.assertEqual(self.db.execute("select name from sometable;"), [("a",)])
+
+    def test_fetch_iter(self):
+        self.db.insert_many("sometable", ["name", "stuff"], [(f"n{i:03d}", str(i)) for i in range(0, 25)])
+        rows = list(self.db.fetch_iter("select name, stuff from sometable where stuff like ? order by name;", ["name", "stuff"], params=("1%",), size=4))
+        self.assertEqual([r["name"] for r in rows], ["n001", "n010", "n011", "n012", "n013", "n014", "n015", "n016", "n017", "n018", "n019"])
+
+    def test_fetch_iter_dryrun(self):
+        d = database.Database(DATABASE_FILENAME, dryrun=True)
+        self.assertEqual(list(d.fetch_iter("select name from sometable;", ["name"])), [])
+        self.assertFalse(d.isOpen())
+
+
+class TestAstrophotographyWrite(unittest.TestCase):
+    def setUp(self):
+        self.db = database.Astrophotgraphy(":memory:")
+        self.db.open()
+        self.db.CreateSchema()
+        # targets are created with a profile, they can't be inserted from accepted data alone
+        for name in ["M 31", "Bob's Nebula"]:
+            self.db.execute(f"insert into target (name, profile_id) values ('{self.db.normalize_str(name)}', 1);")
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def _datum(self, directory, count, target="M 31", filter="L"):
+        return {
+            "date": "2024-01-05",
+            "optic": "SQA55",
+            "focal_ratio": "4.8",
+            "filter": filter,
+            "camera": "ATR585M",
+            "targetname": target,
+            "panel": "",
+            "latitude": "35.6",
+            "longitude": "-78.8",
+            "exposureseconds": "300.00",
+            "directory": directory,
+            "count": count,
+        }
+
+    def _accepted(self):
+        return self.db.execute("""select a.raw_directory, a.accepted_count, a.shutter_time_seconds, t.name, f.name, c.name, o.name, l.latitude
+            from accepted_data a, target t, filter f, camera c, optic o, location l
+            where a.target_id=t.id and a.filter_id=f.id and a.camera_id=c.id and a.optic_id=o.id and a.location_id=l.id
+            order by a.raw_directory;""")
+
+    def test_write(self):
+        self.db.WriteAcceptedData([
+            self._datum("a", 3),
+            self._datum("b", 4, filter="R"),
+            self._datum("c\"'quoted'", 5, target="Bob's Nebula"),
+        ])
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(self._accepted(), [
+            ("a", 3, 300, "M 31", "L", "ATR585M", "SQA55", "35.6"),
+            ("b", 4, 300, "M 31", "R", "ATR585M", "SQA55", "35.6"),
+            ("c\"'quoted'", 5, 300, "Bob's Nebula", "L", "ATR585M", "SQA55", "35.6"),
+        ])
+        # reference data is only created once
+        self.assertEqual(self.db.execute("select count(id) from camera;"), [(1,)])
+        self.assertEqual(self.db.execute("select count(id) from filter;"), [(2,)])
+
+    def test_write_updates_count(self):
+        self.db.WriteAcceptedData([self._datum("a", 3), self._datum("b", 4)])
+        self.db.WriteAcceptedData([self._datum("a", 10)])
+        self.assertEqual([(r[0], r[1]) for r in self._accepted()], [("a", 10), ("b", 4)])
+        self.assertEqual(self.db.execute("select count(id) from location;"), [(1,)])
+
+    def test_write_unchanged_keeps_last_updated(self):
+        self.db.WriteAcceptedData([self._datum("a", 3), self._datum("b", 4)])
+        self.db.execute("update accepted_data set last_updated_date='2000-01-01 00:00:00';")
+        self.db.commit()
+        self.db.WriteAcceptedData([self._datum("a", 3), self._datum("b", 5)])
+        self.assertEqual(
+            self.db.execute("select raw_directory, accepted_count, last_updated_date='2000-01-01 00:00:00' from accepted_data order by raw_directory;"),
+            [("a", 3, 1), ("b", 5, 0)],
+        )
+
+    def test_missing_directories(self):
+        root = os.path.join("data", "SQA55")
+        existing = [
+            os.path.join(root, "M 31", "accept", "DATE_2024-01-01", "FILTER_L"),
+            os.path.join(root, "M 31", "accept", "DATE_2024-01-02", "FILTER_L"),
+            os.path.join(root, "Bob's", "accept", "DATE_2024-01-01", "FILTER_R"),
+        ]
+        self.db.WriteAcceptedData([self._datum(d, 1) for d in existing])
+        directories = existing + [
+            # parent of existing data
+            os.path.join(root, "M 31", "accept"),
+            os.path.join(root, "M 31", "accept", "DATE_2024-01-03", "FILTER_L"),
+            os.path.join(root, "M 33", "accept", "DATE_2024-01-01", "FILTER_L"),
+            # would match existing data with LIKE since '_' is a wildcard
+            os.path.join(root, "M 31", "accept", "DATEX2024-01-01"),
+            os.path.join("data", "other", "x"),
+        ]
+        missing = self.db._missing_directories(root, set(directories))
+        self.assertEqual(missing, set(directories[4:]))
+
+    def test_delete_missing(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            existing = os.path.join(tmpdir, "M 31", "accept", "DATE_2024-01-01", "FILTER_L")
+            os.makedirs(existing)
+            gone = [os.path.join(tmpdir, "M 33", "accept", f"DATE_2024-01-0{i}", "FILTER_L") for i in range(1, 5)]
+            self.db.WriteAcceptedData([self._datum(d, 1) for d in [existing] + gone])
+
+            # dryrun reports from a read-only connection and doesn't change anything
+            filename = os.path.join(tmpdir, "ap.sqlite")
+            self.db.conn.execute("vacuum into ?;", (filename,))
+            dryrun = database.Astrophotgraphy(filename, dryrun=True)
+            dryrun.UpdateFromDirectory(from_dir=tmpdir, modeDelete=True, modeCreate=False, modeUpdate=False)
+            self.assertFalse(dryrun.isOpen())
+            self.assertEqual(len(self._accepted()), 5)
+
+            self.db.UpdateFromDirectory(from_dir=tmpdir, modeDelete=True, modeCreate=False, modeUpdate=False)
+            self.assertFalse(self.db.conn.in_transaction)
+            self.assertEqual([r[0] for r in self._accepted()], [existing])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_write_directories(self):
+        root = os.path.join("F:", "Data", "SQA55@f4.8+ATR585M")
+        dirs = [
+            os.path.join(root, "20_Data", "M 31", "accept", "DATE_2024-01-01", "FILTER_L"),
+            os.path.join(root, "20_Data", "M 31", "accept", "DATE_2024-01-02", "FILTER_L"),
+            os.path.join(root, "30_Master", "Sadr Panel 2", "accept", "DATE_2024-01-01", "FILTER_H"),
+        ]
+        self.db.WriteAcceptedData([self._datum(d, i + 1) for i, d in enumerate(dirs)])
+        rows = self.db.execute("""select d.path, d.stage, d.target, d.panel, d.date, p.path
+            from accepted_data a, directory d, directory p
+            where a.directory_id=d.id and d.parent_id=p.id
+            order by d.path;""")
+        self.assertEqual(rows, [
+            (dirs[0], "20_Data", "M 31", "", "2024-01-01", os.path.join(root, "20_Data", "M 31")),
+            (dirs[1], "20_Data", "M 31", "", "2024-01-02", os.path.join(root, "20_Data", "M 31")),
+            (dirs[2], "30_Master", "Sadr", "2", "2024-01-01", os.path.join(root, "30_Master", "Sadr Panel 2")),
+        ])
+        # stage report, same query as report.Report._findData
+        rows = self.db.execute("""select sum(a.accepted_count), p.path
+            from accepted_data a, directory d, directory p
+            where a.directory_id=d.id and d.parent_id=p.id and d.stage=?
+            group by p.path;""", ("20_Data",))
+        self.assertEqual(rows, [(3, os.path.join(root, "20_Data", "M 31"))])
+        # stage lookups use the index
+        plan = self.db.execute("explain query plan select id from directory where stage=?;", ("20_Data",))
+        self.assertIn("directory2", " ".join(str(r) for r in plan))
+
+    def test_delete_unused_directories(self):
+        dirs = [os.path.join("F:", "rig@f1+cam", "20_Data", "M 31", "accept", f"DATE_2024-01-0{i}") for i in range(1, 3)]
+        self.db.WriteAcceptedData([self._datum(d, 1) for d in dirs])
+        self.db.execute("delete from accepted_data where raw_directory=?;", (dirs[0],))
+        self.db._delete_unused_directories()
+        self.assertEqual(len(self.db.execute("select id from directory;")), 2)
+        self.db.execute("delete from accepted_data;")
+        self.db._delete_unused_directories()
+        self.assertEqual(self.db.execute("select id from directory;"), [])
+
+    def test_upgrade_schema(self):
+        db = database.Astrophotgraphy(":memory:")
+        db.open()
+        try:
+            # accepted_data as it was before the directory table
+            for stmt in self.db.createSchema:
+                if "directory" not in stmt.split("(")[0]:
+                    db.execute(stmt.replace("directory_id integer,", "").replace(",\n                                    FOREIGN KEY (directory_id) REFERENCES directory (id)", ""))
+            self.assertNotIn("directory_id", [r[1] for r in db.execute("PRAGMA table_info(accepted_data);")])
+            db.execute("insert into accepted_data (date, shutter_time_seconds, accepted_count, raw_directory, camera_id, optic_id, location_id, target_id, filter_id) values ('2024-01-01', 300, 5, ?, 1, 1, 1, 1, 1);",
+                       (os.path.join("F:", "rig@f1+cam", "20_Data", "M 31", "accept", "DATE_2024-01-01"),))
+            db.commit()
+            db.UpgradeSchema()
+            db.UpgradeSchema()
+            rows = db.execute("select d.stage, d.target from accepted_data a, directory d where a.directory_id=d.id;")
+            self.assertEqual(rows, [("20_Data", "M 31")])
+        finally:
+            db.close()
+
+    def test_prefix_range(self):
+        self.db.WriteAcceptedData([self._datum(d, 1) for d in ["a_b/1", "a_b/2", "axb/1", "a_c/1"]])
+        rows = self.db.execute("select raw_directory from accepted_data where raw_directory >= ? and raw_directory < ? order by raw_directory;", database.prefix_range("a_b/"))
+        self.assertEqual(rows, [("a_b/1",), ("a_b/2",)])
+
+    def test_summary_fingerprints(self):
+        self.assertEqual(self.db.GetSummaryFingerprints(["a", "b"]), {})
+        self.db.WriteSummaryFingerprints({"a": "1", "b": "2"})
+        self.db.WriteSummaryFingerprints({"b": "3"})
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(self.db.GetSummaryFingerprints(["a", "b", "c"]), {"a": "1", "b": "3"})
+
+    def test_summary_fingerprints_dryrun(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "ap.sqlite")
+            db = database.Astrophotgraphy(filename)
+            db.open()
+            db.CreateSchema()
+            db.execute("drop table summary;")
+            db.commit()
+            db.close()
+            conn = database.connect(filename)
+            expected = [row[0] for row in conn.execute("select name from sqlite_master where type='table';")]
+            conn.close()
+
+            # an older database without the summary table is read as is, not upgraded
+            db = database.Astrophotgraphy(filename, dryrun=True)
+            db.open()
+            db.UpgradeSchema()
+            self.assertEqual(db.GetSummaryFingerprints(["a"]), {})
+            db.WriteSummaryFingerprints({"a": "1"})
+            db.close()
+            conn = database.connect(filename)
+            tables = [row[0] for row in conn.execute("select name from sqlite_master where type='table';")]
+            conn.close()
+            self.assertEqual(tables, expected)
+
+            db = database.Astrophotgraphy(filename)
+            db.open()
+            db.UpgradeSchema()
+            db.WriteSummaryFingerprints({"a": "1"})
+            db.close()
+            self.assertEqual(database.Astrophotgraphy(filename, dryrun=True).GetSummaryFingerprints(["a", "b"]), {"a": "1"})
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_write_missing_target(self):
+        # same as before, accepted data can't be written for a target that doesn't exist
+        with self.assertRaises(Exception):
+            self.db.WriteAcceptedData([self._datum("a", 3, target="unknown")])
+
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ap_filename = os.path.join(self.tmpdir, "ap.sqlite")
+        self.scheduler_filename = os.path.join(self.tmpdir, "scheduler.sqlite")
+        self.root = os.path.join(self.tmpdir, "SQA55@f4.8+ATR585M", "20_Data")
+
+        conn = database.connect(self.scheduler_filename, database.PRAGMAS_SCHEDULER)
+        try:
+            # just the columns used by the report
+            conn.execute("create table target (id integer primary key, name text);")
+            conn.execute("create table exposureplan (id integer primary key, profileid text, targetid integer, desired integer, acquired integer, accepted integer);")
+            for i, (name, plans) in enumerate([
+                    ("M 31", [(100, 96), (0, 0)]),
+                    ("M 33", [(100, 96), (100, 95)]),
+                    ("Bobs Nebula Panel 1", [(10, 10)]),
+                    ("Sadr", [])]):
+                conn.execute("insert into target (id, name) values (?,?);", (i, name))
+                for desired, accepted in plans:
+                    conn.execute("insert into exposureplan (profileid, targetid, desired, acquired, accepted) values ('p',?,?,?,?);",
+                                 (i, desired, accepted, accepted))
+            conn.commit()
+        finally:
+            conn.close()
+
+        db = database.Astrophotgraphy(self.ap_filename)
+        db.open()
+        try:
+            db.CreateSchema()
+            for name in ["M 31", "M 33", "Bobs Nebula", "Sadr"]:
+                db.execute("insert into target (name, profile_id) values (?, 1);", (name,))
+            db.commit()
+            data = []
+            for target in ["M 31", "M 33", "Bob's Nebula Panel 1", "Sadr"]:
+                data.append({
+                    "date": "2024-01-05",
+                    "optic": "SQA55",
+                    "focal_ratio": "4.8",
+                    "filter": "L",
+                    "camera": "ATR585M",
+                    "targetname": common.normalize_target_name(target)[0],
+                    "panel": "",
+                    "latitude": "35.6",
+                    "longitude": "-78.8",
+                    "exposureseconds": "300.00",
+                    "directory": os.path.join(self.root, target, "accept", "DATE_2024-01-01", "FILTER_L"),
+                    "count": 1,
+                })
+            db.WriteAcceptedData(data)
+        finally:
+            db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_data_ready_for_master(self):
+        r = report.Report(self.ap_filename, self.scheduler_filename)
+        self.assertEqual(r.data_ready_for_master(), [
+            os.path.join(self.root, "Bob's Nebula Panel 1"),
+            os.path.join(self.root, "M 31"),
+        ])
+        self.assertFalse(r.db_astrophotography.isOpen())
+
+    def test_old_schema_not_upgraded(self):
+        # a database from before the directory table, the report must not upgrade it
+        ap_filename = os.path.join(self.tmpdir, "old.sqlite")
+        conn = database.connect(ap_filename)
+        conn.execute("create table accepted_data (id integer primary key, raw_directory text, accepted_count integer);")
+        conn.commit()
+        conn.close()
+        r = report.Report(ap_filename, self.scheduler_filename)
+        self.assertIsNone(r.data_ready_for_master())
+        self.assertIsNone(r.data())
+        conn = database.connect(ap_filename)
+        try:
+            self.assertEqual(conn.execute("select name from sqlite_master;").fetchall(), [("accepted_data",)])
+        finally:
+            conn.close()
+
+    def test_attach_missing(self):
+        d = database.Astrophotgraphy(self.ap_filename)
+        d.open()
+        try:
+            with self.assertRaises(Exception):
+                d.attach(os.path.join(self.tmpdir, "missing.sqlite"), "scheduler")
+        finally:
+            d.close()
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "missing.sqlite")))
+
+
+class TestSchedulerAccepted(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ap_filename = os.path.join(self.tmpdir, "ap.sqlite")
+        root = os.path.join(self.tmpdir, "SQA55@f4.8+ATR585M")
+
+        db = database.Astrophotgraphy(self.ap_filename)
+        db.open()
+        try:
+            db.CreateSchema()
+            for name in ["M 31", "Sadr"]:
+                db.execute("insert into target (name, profile_id) values (?, 1);", (name,))
+            db.commit()
+            data = []
+            for stage, target, panel, date, count in [
+                    ("20_Data", "M 31", "", "2024-01-01", 2),
+                    ("20_Data", "M 31", "", "2024-01-02", 1),
+                    ("30_Master", "Sadr", "2", "2024-01-01", 96)]:
+                target_dir = target if panel == "" else f"{target} Panel {panel}"
+                data.append({
+                    "date": date,
+                    "optic": "SQA55",
+                    "focal_ratio": "4.8",
+                    "filter": "L",
+                    "camera": "ATR585M",
+                    "targetname": target,
+                    "panel": panel,
+                    "latitude": "35.6",
+                    "longitude": "-78.8",
+                    "exposureseconds": "300.00",
+                    "directory": os.path.join(root, stage, target_dir, "accept", f"DATE_{date}", "FILTER_L"),
+                    "count": count,
+                })
+            db.WriteAcceptedData(data)
+            db.execute("""insert into profile (id, name, filter_names, optic_id, camera_id)
+                select 'p1', 'SQA55', 'L,R', o.id, c.id from optic o, camera c;""")
+            db.commit()
+        finally:
+            db.close()
+
+        self.db = database.Scheduler(os.path.join(self.tmpdir, "scheduler.sqlite"))
+        self.db.open()
+        # just the columns used by the sync
+        for stmt in [
+                "create table project (id integer primary key, profileid text, name text, state integer);",
+                "create table target (id integer primary key, projectid integer, name text);",
+                "create table exposuretemplate (id integer primary key, profileid text, name text, defaultexposure real);",
+                "create table exposureplan (id integer primary key, profileid text, targetid integer, exposuretemplateid integer, exposure real, desired integer, acquired integer, accepted integer);",
+                "insert into project values (1, 'p1', 'M 31 project', 1), (2, 'p1', 'Sadr project', 1);",
+                "insert into target values (1, 1, 'M 31'), (2, 2, 'Sadr Panel 2');",
+                "insert into exposuretemplate values (1, 'p1', 'L', 300), (2, 'p1', 'R', 300);",
+                # M 31: L has 3 accepted, R has none.  Sadr Panel 2: 96 of 100 is ready for master
+                """insert into exposureplan values (1, 'p1', 1, 1, -1, 10, 0, 0), (2, 'p1', 1, 2, 0, 10, 5, 5),
+                    (3, 'p1', 1, 1, 180, 10, 0, 0), (4, 'p1', 2, 1, 300, 100, 0, 0);"""]:
+            self.db.execute(stmt)
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_accepted_changes(self):
+        plan_changes, project_changes = self.db.GetAcceptedChanges(self.ap_filename)
+        self.assertEqual(sorted([(c["id"], c["targetname"], c["panelname"], c["old"], c["new"]) for c in plan_changes]), [
+            (1, "M 31", "", 0, 3),
+            (2, "M 31", "", 5, 0),
+            (4, "Sadr", "2", 0, 200),
+        ])
+        self.assertEqual([(c["id"], c["old"], c["new"]) for c in project_changes], [(2, 1, 2)])
+
+        self.db.WriteAcceptedChanges(plan_changes, project_changes)
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(self.db.execute("select id, accepted, acquired from exposureplan order by id;"),
+                         [(1, 3, 3), (2, 0, 0), (3, 0, 0), (4, 200, 200)])
+        self.assertEqual(self.db.execute("select id, state from project order by id;"), [(1, 1), (2, 2)])
+
+        # nothing left to do, and the astrophotography database was detached so it can run again
+        self.assertEqual(self.db.GetAcceptedChanges(self.ap_filename), ([], []))
+
+    def test_desired_hours_by_target(self):
+        targets = [("p1", "M 31"), ("p1", "Sadr Panel 2"), ("p1", "unknown"), ("p2", "M 31")]
+        output = self.db.GetDesiredHoursByTarget(targets)
+        self.assertEqual(output[("p1", "M 31")], {"L": 300 * 10 / 60 / 60, "R": 300 * 10 / 60 / 60})
+        for profile_id, targetname in targets:
+            self.assertEqual(output[(profile_id, targetname)], self.db.GetDesiredHours(profile_id, targetname))
+
+
+PROFILE_XML = """<?xml version="1.0" encoding="utf-8"?>
+<Profile xmlns:i="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://schemas.datacontract.org/2004/07/NINA.Profile">
+  <CameraSettings>
+    <Id>not-the-profile-id</Id>
+  </CameraSettings>
+  <FilterWheelSettings>
+    <FilterWheelFilters xmlns:a="http://schemas.datacontract.org/2004/07/NINA.Core.Model.Equipment">
+{filters}
+    </FilterWheelFilters>
+    <Id>not-the-profile-id-either</Id>
+  </FilterWheelSettings>
+  <Id>{id}</Id>
+  <Name>{name}</Name>
+  <TelescopeSettings>
+    <Name>not-the-profile-name</Name>
+  </TelescopeSettings>
+</Profile>
+"""
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = database.Astrophotgraphy(":memory:")
+        self.db.open()
+        self.db.CreateSchema()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _write_profile(self, id, name, filters):
+        filename = os.path.join(self.tmpdir, f"{id}.profile")
+        xml_filters = "\n".join([f"<a:FilterInfo><a:_name>{f}</a:_name><a:_position>{i}</a:_position></a:FilterInfo>" for i, f in enumerate(filters)])
+        with open(filename, "w") as f:
+            f.write(PROFILE_XML.format(id=id, name=name, filters=xml_filters))
+        return filename
+
+    def _profiles(self):
+        return self.db.execute("""select p.id, p.name, p.filter_names, o.name, o.focal_ratio, c.name
+            from profile p, optic o, camera c
+            where p.optic_id=o.id and p.camera_id=c.id
+            order by p.id;""")
+
+    def test_read_profile(self):
+        filename = self._write_profile("abc", "SQA55@f4.8+ATR585M", ["Lum", "Red", "DARK"])
+        self.assertEqual(database.read_profile(filename), {"id": "abc", "name": "SQA55@f4.8+ATR585M", "filters": ["Lum", "Red", "DARK"]})
+
+    def test_read_profile_whitespace(self):
+        filename = os.path.join(self.tmpdir, "whitespace.profile")
+        with open(filename, "w") as f:
+            f.write(PROFILE_XML.format(id="\n abc ", name=" SQA55@f4.8+ATR585M\n", filters="<a:FilterInfo><a:_name> L </a:_name></a:FilterInfo><a:FilterInfo><a:_name>\n\tR</a:_name></a:FilterInfo>"))
+        self.assertEqual(database.read_profile(filename), {"id": "abc", "name": "SQA55@f4.8+ATR585M", "filters": ["L", "R"]})
+
+    def test_read_profile_single_filter(self):
+        filename = self._write_profile("abc", "SQA55@f4.8+ATR585M", ["UVIR"])
+        self.assertEqual(database.read_profile(filename)["filters"], ["UVIR"])
+
+    def test_create_profiles(self):
+        self._write_profile("a", "SQA55@f4.8+ATR585M", ["L", "R", "G", "B", "S", "H", "O", "DARK", "BLANK"])
+        self._write_profile("b", "SQA55@f5.3+ATR585M", ["UVIR"])
+        self._write_profile("c", "not a standard name", ["L"])
+        cache = filecache.FileCache(":memory:", table="profiles")
+        cache.open()
+        try:
+            self.db.CreateProfiles(self.tmpdir, cache=cache)
+            self.assertFalse(self.db.conn.in_transaction)
+            expected = [
+                ("a", "SQA55@f4.8+ATR585M", "L,R,G,B,O,S,H", "SQA55", "4.8", "ATR585M"),
+                ("b", "SQA55@f5.3+ATR585M", "UVIR", "SQA55", "5.3", "ATR585M"),
+            ]
+            self.assertEqual(self._profiles(), expected)
+            self.assertEqual(cache.misses, 3)
+
+            # unchanged profiles come from the cache, a changed profile is updated
+            self._write_profile("b", "SQA55@f5.3+ATR585M", ["UVIR", "LeXtr"])
+            filename = os.path.join(self.tmpdir, "b.profile")
+            st = os.stat(filename)
+            os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+            self.db.CreateProfiles(self.tmpdir, cache=cache)
+            self.assertEqual(cache.hits, 2)
+            expected[1] = ("b", "SQA55@f5.3+ATR585M", "UVIR,LeXtr", "SQA55", "5.3", "ATR585M")
+            self.assertEqual(self._profiles(), expected)
+            self.assertEqual(self.db.execute("select count(id) from camera;"), [(1,)])
+        finally:
+            cache.close()
+
+
 if __name__ == '__main__':
     unittest.main()